@@ -1,2 +1,8 @@
 from .client import OpenRouterClient, EMOJI_TOOL
+from .retry import RetryPolicy, DEFAULT_RETRY_POLICY
+from .cache import ResponseCache
+from .router import ModelRouter
+from .hedge import HedgePolicy
+from .prompt import PromptBuilder
+from .limiter import AdmissionController, PRIORITY_INTERACTIVE, PRIORITY_MODERATION, PRIORITY_NORMAL, PRIORITY_BACKGROUND
 from .models import get_models, get_vision_models, sort_models, format_price, is_free
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return re.sub(r'\s+', ' ', value).strip()
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    return value
+
+
+class ResponseCache:
+    def __init__(self, max_size: int = 2000, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db = None
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def chat_key(self, model: str, messages: list, params: dict = None) -> str:
+        return self.make_key("chat", model, _normalize(messages), params or {})
+
+    async def attach(self, db):
+        self.db = db
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        await db.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+
+    def _remember(self, key: str, value, expires_at: float):
+        self._items[key] = (expires_at, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    async def get(self, key: str):
+        now = time.time()
+        item = self._items.get(key)
+        if item:
+            expires_at, value = item
+            if expires_at > now:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._items[key]
+
+        if self.db:
+            row = await self.db.fetchone(
+                "SELECT value, expires_at FROM response_cache WHERE key = ? AND expires_at > ?",
+                (key, now)
+            )
+            if row:
+                value = json.loads(row["value"])
+                self._remember(key, value, row["expires_at"])
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value, ttl: float = None):
+        expires_at = time.time() + (ttl or self.ttl)
+        self._remember(key, value, expires_at)
+        if self.db:
+            await self.db.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at)
+            )
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "persistent": self.db is not None
+        }
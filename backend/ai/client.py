@@ -2,6 +2,13 @@ import aiohttp
 import asyncio
 import base64
 import json
+import time
+from contextlib import asynccontextmanager
+from .retry import RetryPolicy, DEFAULT_RETRY_POLICY, parse_retry_after
+from .limiter import AdmissionController, PRIORITY_NORMAL, estimate_tokens
+from .cache import ResponseCache
+from .router import ModelRouter
+from .hedge import HedgePolicy, cancel_task
 
 BASE_URL = "https://openrouter.ai/api/v1"
 
@@ -20,14 +27,148 @@ EMOJI_TOOL = {
 
 
 class OpenRouterClient:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, limit: int = 100, limit_per_host: int = 20, dns_ttl: int = 300,
+                 keepalive_timeout: float = 60, timeout: float = 120, connect_timeout: float = 10,
+                 retry_policy: RetryPolicy = None, limiter: AdmissionController = None, cache: ResponseCache = None,
+                 router: ModelRouter = None, hedge: HedgePolicy = None):
         self.api_key = api_key
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=connect_timeout)
+        self._session = None
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.limiter = limiter
+        self.cache = cache or ResponseCache()
+        self.router = router or ModelRouter()
+        self.hedge = hedge
 
-    async def chat(self, model: str, messages: list, tools: list = None, tool_results: dict = None, retries: int = 20, max_tokens: int = 500, **kwargs) -> dict:
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers=self.headers
+            )
+        return self._session
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _policy(self, retries: int = None) -> RetryPolicy:
+        if retries is None:
+            return self.retry_policy
+        return self.retry_policy.with_attempts(retries)
+
+    @asynccontextmanager
+    async def _admit(self, payload: dict, priority: int):
+        if not self.limiter:
+            yield
+            return
+        tokens = estimate_tokens(payload.get("messages", []), payload.get("max_tokens", 0))
+        async with self.limiter.slot(payload.get("model"), priority, tokens) as reservation:
+            try:
+                yield
+            except aiohttp.ClientConnectorError:
+                # Соединение не установилось — запрос до провайдера не дошёл, лимит не расходуем
+                reservation.refund()
+                raise
+
+    async def _complete(self, payload: dict, retries: int = None, priority: int = PRIORITY_NORMAL) -> dict:
+        policy = self._policy(retries)
+        started = time.monotonic()
+        error = {"message": None, "code": None, "retry_after": None}
+        
+        model = payload.get("model")
+        
+        for attempt in range(policy.max_attempts):
+            retry_after = None
+            try:
+                session = self._get_session()
+                async with self._admit(payload, priority):
+                    sent = time.monotonic()
+                    async with session.post(f"{BASE_URL}/chat/completions", json=payload) as resp:
+                        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                        data = await resp.json(content_type=None)
+                        
+                        if "error" in data or resp.status >= 400:
+                            err = data.get("error") or {}
+                            code = err.get("code") or resp.status
+                            error = {"message": err.get("message", f"HTTP {resp.status}"), "code": code, "retry_after": retry_after}
+                            print(f"[API ERROR] {code}: {error['message']}")
+                            self.router.record(model, False, code=code)
+                            if not policy.is_retryable(code):
+                                break
+                        elif not data.get("choices"):
+                            print(f"[API] Нет choices в ответе: {str(data)[:200]}")
+                            error = {"message": "No choices in response", "code": None, "retry_after": retry_after}
+                            self.router.record(model, False)
+                        else:
+                            self.router.record(model, True, time.monotonic() - sent)
+                            return {"data": data, "attempts": attempt + 1}
+            except Exception as e:
+                error = {"message": str(e), "code": None, "retry_after": None}
+                self.router.record(model, False)
+            
+            if not await policy.wait(attempt, started, retry_after):
+                break
+        
+        return {"data": None, "attempts": attempt + 1, **error}
+
+    async def _hedged_chat(self, model: str, hedge_model: str, messages: list, **kwargs) -> dict:
+        self.hedge.calls += 1
+        delay = self.hedge.delay(self.router, model)
+        started = time.monotonic()
+        primary = asyncio.create_task(self.chat(model, messages, **kwargs))
+        tasks = [primary]
+        winner = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self.hedge.allow():
+                print(f"[HEDGE] {model} молчит {delay:.1f}с, дублирую в {hedge_model}")
+                tasks.append(asyncio.create_task(self.chat(hedge_model, messages, **kwargs)))
+            
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if result.get("finish_reason") != "error" or not pending:
+                        winner = task
+                        if task is not primary:
+                            self.hedge.backup_wins += 1
+                        return result
+        finally:
+            for task, name in zip(tasks, (model, hedge_model)):
+                # Отмену всего вызова снаружи проигрышем не считаем
+                if winner and not task.done():
+                    self.router.record_cancelled(name, time.monotonic() - started if task is primary else None)
+                await cancel_task(task)
+
+    async def chat(self, model: str, messages: list, tools: list = None, tool_results: dict = None, retries: int = None, max_tokens: int = 500, priority: int = PRIORITY_NORMAL, cache_ttl: float = None, hedge_model: str = None, **kwargs) -> dict:
+        cache_key = None
+        if cache_ttl:
+            cache_key = self.cache.chat_key(model, messages, {"max_tokens": max_tokens, "tools": tools, **kwargs})
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        if hedge_model and self.hedge and hedge_model != model:
+            return await self._hedged_chat(model, hedge_model, messages, tools=tools, retries=retries, max_tokens=max_tokens, priority=priority, **kwargs)
+        
         payload = {
             "model": model,
             "messages": messages,
@@ -39,47 +180,192 @@ class OpenRouterClient:
             payload["tools"] = tools
             payload["tool_choice"] = "auto"
         
+        result = await self._complete(payload, retries, priority)
+        data = result["data"]
+        if data is None:
+            return {
+                "content": f"Ошибка после {result['attempts']} попыток: {result['message']}",
+                "tool_calls": None,
+                "finish_reason": "error",
+                "error_code": result["code"],
+                "retry_after": result["retry_after"]
+            }
+        
+        choice = data["choices"][0]
+        message = choice.get("message", {})
+        content = message.get("content", "")
+        
+        if not content and choice.get("finish_reason") == "length":
+            print(f"[API] Ответ обрезан по длине")
+        
+        response = {
+            "content": content,
+            "tool_calls": message.get("tool_calls"),
+            "finish_reason": choice.get("finish_reason"),
+            "usage": data.get("usage")
+        }
+        if cache_key and content and not response["tool_calls"]:
+            await self.cache.set(cache_key, response, cache_ttl)
+        return response
+
+    async def _hedged_stream(self, model: str, hedge_model: str, messages: list, **kwargs):
+        self.hedge.calls += 1
+        delay = self.hedge.delay(self.router, model, stream=True)
+        started = time.monotonic()
+        primary = self.chat_stream(model, messages, **kwargs)
+        streams = {asyncio.ensure_future(primary.__anext__()): primary}
+        winner = None
+        try:
+            done, _ = await asyncio.wait(list(streams), timeout=delay)
+            if not done and self.hedge.allow():
+                print(f"[HEDGE] {model} молчит {delay:.1f}с до первого токена, дублирую в {hedge_model}")
+                backup = self.chat_stream(hedge_model, messages, **kwargs)
+                streams[asyncio.ensure_future(backup.__anext__())] = backup
+            
+            pending = set(streams)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    chunk = task.result()
+                    failed = chunk["type"] == "done" and chunk.get("finish_reason") == "error"
+                    if not failed or not pending:
+                        winner = (streams[task], chunk)
+                        break
+        finally:
+            for task, stream in streams.items():
+                if winner and stream is winner[0]:
+                    continue
+                if winner and not task.done():
+                    self.router.record_cancelled(
+                        model if stream is primary else hedge_model,
+                        time.monotonic() - started if stream is primary else None,
+                        stream=True
+                    )
+                await cancel_task(task)
+                await stream.aclose()
+        
+        stream, chunk = winner
+        if stream is not primary:
+            self.hedge.backup_wins += 1
+        yield chunk
+        async for chunk in stream:
+            yield chunk
+
+    async def chat_stream(self, model: str, messages: list, tools: list = None, retries: int = None, max_tokens: int = 500, priority: int = PRIORITY_NORMAL, hedge_model: str = None, **kwargs):
+        if hedge_model and self.hedge and hedge_model != model:
+            async for chunk in self._hedged_stream(model, hedge_model, messages, tools=tools, retries=retries, max_tokens=max_tokens, priority=priority, **kwargs):
+                yield chunk
+            return
+        
+        payload = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+            **kwargs
+        }
+        
+        if tools:
+            payload["tools"] = tools
+            payload["tool_choice"] = "auto"
+        
+        policy = self._policy(retries)
+        started = time.monotonic()
         last_error = None
-        for attempt in range(retries):
+        streamed = False
+        first_token = None
+        # Пока потребитель редактирует сообщение в Telegram, стрим стоит — это время модели не засчитываем
+        consumer = 0.0
+        
+        for attempt in range(policy.max_attempts):
+            retry_after = None
+            code = None
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        f"{BASE_URL}/chat/completions",
-                        headers=self.headers,
-                        json=payload
-                    ) as resp:
-                        data = await resp.json()
+                session = self._get_session()
+                async with self._admit(payload, priority):
+                    sent = time.monotonic()
+                    async with session.post(f"{BASE_URL}/chat/completions", json=payload) as resp:
+                        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
                         
-                        if "error" in data:
-                            last_error = data['error'].get('message', 'Unknown error')
-                            print(f"[API ERROR] {last_error}")
-                            await asyncio.sleep(0.5)
-                            continue
-                        
-                        if "choices" not in data or not data["choices"]:
-                            print(f"[API] Нет choices в ответе: {str(data)[:200]}")
-                            last_error = "No choices in response"
-                            continue
-                        
-                        choice = data["choices"][0]
-                        message = choice.get("message", {})
-                        content = message.get("content", "")
-                        
-                        if not content and choice.get("finish_reason") == "length":
-                            print(f"[API] Ответ обрезан по длине")
-                        
-                        return {
-                            "content": content,
-                            "tool_calls": message.get("tool_calls"),
-                            "finish_reason": choice.get("finish_reason")
-                        }
+                        if resp.status >= 400:
+                            data = await resp.json(content_type=None)
+                            err = data.get("error") or {}
+                            code = err.get("code") or resp.status
+                            last_error = err.get("message", f"HTTP {resp.status}")
+                            print(f"[API ERROR] {code}: {last_error}")
+                            self.router.record(model, False, code=code)
+                        else:
+                            tool_calls = {}
+                            finish_reason = None
+                            usage = None
+                            
+                            async for raw in resp.content:
+                                line = raw.decode("utf-8", errors="ignore").strip()
+                                if not line.startswith("data:"):
+                                    continue
+                                chunk = line[5:].strip()
+                                if chunk == "[DONE]":
+                                    break
+                                
+                                data = json.loads(chunk)
+                                if "error" in data:
+                                    code = data["error"].get("code")
+                                    raise RuntimeError(data["error"].get("message", "Unknown error"))
+                                usage = data.get("usage") or usage
+                                if not data.get("choices"):
+                                    continue
+                                
+                                choice = data["choices"][0]
+                                delta = choice.get("delta") or {}
+                                finish_reason = choice.get("finish_reason") or finish_reason
+                                
+                                out = []
+                                if delta.get("content"):
+                                    out.append({"type": "content", "text": delta["content"]})
+                                
+                                for tc in delta.get("tool_calls") or []:
+                                    call = tool_calls.setdefault(tc.get("index", 0), {"id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+                                    if tc.get("id"):
+                                        call["id"] = tc["id"]
+                                    fn = tc.get("function") or {}
+                                    call["function"]["name"] += fn.get("name") or ""
+                                    call["function"]["arguments"] += fn.get("arguments") or ""
+                                    out.append({"type": "tool_call", "index": tc.get("index", 0), "delta": tc})
+                                
+                                if out:
+                                    streamed = True
+                                    if first_token is None:
+                                        first_token = time.monotonic() - sent
+                                    paused = time.monotonic()
+                                    for item in out:
+                                        yield item
+                                    consumer += time.monotonic() - paused
+                            
+                            self.router.record(model, True, time.monotonic() - sent - consumer, first_token=first_token)
+                            yield {
+                                "type": "done",
+                                "finish_reason": finish_reason,
+                                "tool_calls": [tool_calls[i] for i in sorted(tool_calls)] or None,
+                                "usage": usage
+                            }
+                            return
             except Exception as e:
                 last_error = str(e)
-                await asyncio.sleep(0.5)
+                self.router.record(model, False, code=code)
+                if streamed:
+                    print(f"[API] Стрим оборвался: {last_error}")
+                    yield {"type": "done", "finish_reason": "error", "tool_calls": None, "error": last_error}
+                    return
+            
+            if code is not None and not policy.is_retryable(code):
+                break
+            if not await policy.wait(attempt, started, retry_after):
+                break
         
-        return {"content": f"Ошибка после {retries} попыток: {last_error}", "tool_calls": None, "finish_reason": "error"}
+        yield {"type": "done", "finish_reason": "error", "tool_calls": None, "error": f"Ошибка после {attempt + 1} попыток: {last_error}"}
 
-    async def chat_with_image(self, model: str, messages: list, image_data: bytes, retries: int = 20, max_tokens: int = 500, **kwargs) -> str:
+    async def chat_with_image(self, model: str, messages: list, image_data: bytes, retries: int = None, max_tokens: int = 500, priority: int = PRIORITY_NORMAL, **kwargs) -> str:
         b64_image = base64.b64encode(image_data).decode('utf-8')
         
         last_msg = messages[-1]
@@ -97,64 +383,43 @@ class OpenRouterClient:
             **kwargs
         }
         
-        last_error = None
-        for attempt in range(retries):
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        f"{BASE_URL}/chat/completions",
-                        headers=self.headers,
-                        json=payload
-                    ) as resp:
-                        data = await resp.json()
-                        if "error" in data:
-                            last_error = data['error'].get('message', 'Unknown error')
-                            await asyncio.sleep(0.5)
-                            continue
-                        return data["choices"][0]["message"]["content"]
-            except Exception as e:
-                last_error = str(e)
-                await asyncio.sleep(0.5)
-        
-        return f"Ошибка после {retries} попыток: {last_error}"
+        result = await self._complete(payload, retries, priority)
+        data = result["data"]
+        if data is None:
+            return f"Ошибка после {result['attempts']} попыток: {result['message']}"
+        return data["choices"][0]["message"]["content"]
 
     async def get_models(self) -> list:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{BASE_URL}/models",
-                headers=self.headers
-            ) as resp:
-                data = await resp.json()
-                return data.get("data", [])
+        session = self._get_session()
+        async with session.get(f"{BASE_URL}/models") as resp:
+            data = await resp.json()
+            return data.get("data", [])
 
     async def get_popular_models(self, free_only: bool = False) -> list:
         url = "https://openrouter.ai/api/frontend/models/find?order=most-popular&supported_parameters=tools"
         if free_only:
             url += "&max_price=0"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=self.headers) as resp:
-                data = await resp.json()
-                models = data.get("data", {}).get("models", [])
-                return [m["slug"] for m in models]
+        session = self._get_session()
+        async with session.get(url) as resp:
+            data = await resp.json()
+            models = data.get("data", {}).get("models", [])
+            return [m["slug"] for m in models]
 
     async def get_vision_models(self, free_only: bool = False) -> list:
         url = "https://openrouter.ai/api/frontend/models/find?order=most-popular&input_modalities=image%2Ctext&supported_parameters=tools"
         if free_only:
             url += "&max_price=0"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=self.headers) as resp:
-                data = await resp.json()
-                models = data.get("data", {}).get("models", [])
-                return models
+        session = self._get_session()
+        async with session.get(url) as resp:
+            data = await resp.json()
+            models = data.get("data", {}).get("models", [])
+            return models
 
     async def get_credits(self) -> dict:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{BASE_URL}/credits",
-                headers=self.headers
-            ) as resp:
-                data = await resp.json()
-                credits_data = data.get("data", {})
-                total = credits_data.get("total_credits", 0)
-                usage = credits_data.get("total_usage", 0)
-                return {"total": total, "usage": usage, "balance": total - usage}
+        session = self._get_session()
+        async with session.get(f"{BASE_URL}/credits") as resp:
+            data = await resp.json()
+            credits_data = data.get("data", {})
+            total = credits_data.get("total_credits", 0)
+            usage = credits_data.get("total_usage", 0)
+            return {"total": total, "usage": usage, "balance": total - usage}
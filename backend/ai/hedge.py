@@ -0,0 +1,45 @@
+import asyncio
+
+
+class HedgePolicy:
+    def __init__(self, max_ratio: float = 0.1, quantile: float = 0.9, default_delay: float = 4.0,
+                 min_delay: float = 1.0):
+        self.max_ratio = max_ratio
+        self.quantile = quantile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.calls = 0
+        self.hedged = 0
+        self.backup_wins = 0
+
+    def delay(self, router, model: str, stream: bool = False) -> float:
+        # Стрим считается живым с первого токена — сравниваем с ним, а не с полным ответом
+        observed = router.first_token(model, self.quantile) if stream else router.latency(model, self.quantile)
+        if observed is None:
+            return self.default_delay
+        return max(self.min_delay, observed)
+
+    def allow(self) -> bool:
+        if self.hedged >= self.calls * self.max_ratio:
+            return False
+        self.hedged += 1
+        return True
+
+    def get_stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "backup_wins": self.backup_wins,
+            "ratio": self.hedged / self.calls if self.calls else 0.0,
+            "max_ratio": self.max_ratio
+        }
+
+
+async def cancel_task(task: asyncio.Task):
+    if task.done():
+        return
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        pass
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_MODERATION = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NORMAL = PRIORITY_MODERATION
+
+LANES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_MODERATION: "moderation",
+    PRIORITY_BACKGROUND: "background",
+}
+
+
+# Картинку провайдер тарифицирует фиксированной ценой, а не по длине base64 в data: URL
+IMAGE_TOKENS = 1000
+
+
+def _strip_images(value, images: list):
+    if isinstance(value, dict):
+        if value.get("type") == "image_url":
+            images.append(value)
+            return None
+        return {k: _strip_images(v, images) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_strip_images(v, images) for v in value]
+    return value
+
+
+def estimate_tokens(messages: list, max_tokens: int = 0) -> int:
+    images = []
+    messages = _strip_images(messages, images)
+    try:
+        size = len(json.dumps(messages, ensure_ascii=False))
+    except (TypeError, ValueError):
+        size = sum(len(str(m)) for m in messages)
+    return size // 4 + len(images) * IMAGE_TOKENS + (max_tokens or 0)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, capacity: float = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def wait_time(self, amount: float, floor: float = 0.0) -> float:
+        # Сколько ждать, чтобы после списания в ведре осталось не меньше floor; ничего не списывает
+        self._refill()
+        missing = min(amount, self.capacity) + floor - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def refund(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+
+class Reservation:
+    def __init__(self, buckets: list):
+        self.buckets = buckets
+
+    def refund(self):
+        # Запрос не ушёл к провайдеру — возвращаем списанное, чтобы не тормозить следующих
+        for bucket, amount in self.buckets:
+            bucket.refund(amount)
+        self.buckets = []
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency: int = 8, rpm: float = None, tpm: float = None, models: dict = None,
+                 reserved: int = 2, starvation_after: float = 30.0, interactive_share: float = 0.2):
+        self.max_concurrency = max(1, max_concurrency)
+        self.reserved = min(max(0, reserved), self.max_concurrency - 1)
+        # Доля rpm/tpm, которую фоновые и модерация не трогают: она остаётся ответам в личке
+        self.interactive_share = min(max(0.0, interactive_share), 1.0)
+        self.starvation_after = starvation_after
+        self.rpm = rpm
+        self.tpm = tpm
+        self.model_limits = models or {}
+        self._buckets = {}
+        self._queues = {lane: deque() for lane in LANES}
+        self._active = 0
+        self._lane_active = {lane: 0 for lane in LANES}
+        self.stats = {
+            lane: {"requests": 0, "waited": 0.0, "max_wait": 0.0, "promoted": 0, "recent": deque(maxlen=200)}
+            for lane in LANES
+        }
+
+    def _get_buckets(self, model: str) -> tuple:
+        if model not in self._buckets:
+            limits = self.model_limits.get(model, {})
+            rpm = limits.get("rpm", self.rpm)
+            tpm = limits.get("tpm", self.tpm)
+            self._buckets[model] = (
+                TokenBucket(rpm) if rpm else None,
+                TokenBucket(tpm) if tpm else None
+            )
+        return self._buckets[model]
+
+    async def _reserve_rate(self, model: str, lane: int, tokens: int) -> Reservation:
+        req_bucket, tok_bucket = self._get_buckets(model)
+        buckets = [(bucket, amount) for bucket, amount in ((req_bucket, 1), (tok_bucket, tokens)) if bucket]
+        if lane != PRIORITY_INTERACTIVE:
+            # Неинтерактивные не уходят в долг: ждут, пока после списания останется запас под интерактив.
+            # Запас не больше того, что остаётся после самого запроса, иначе крупный запрос ждал бы вечно
+            while True:
+                delay = max((
+                    b.wait_time(n, min(b.capacity * self.interactive_share, b.capacity - min(n, b.capacity)))
+                    for b, n in buckets
+                ), default=0.0)
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+        delay = max((b.reserve(n) for b, n in buckets), default=0.0)
+        reservation = Reservation(buckets)
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                reservation.refund()
+                raise
+        return reservation
+
+    def _pick(self) -> Optional[int]:
+        now = time.monotonic()
+        for queue in self._queues.values():
+            while queue and queue[0][1].done():
+                queue.popleft()
+        
+        starving = [
+            (queue[0][0], lane) for lane, queue in self._queues.items()
+            if queue and now - queue[0][0] >= self.starvation_after
+        ]
+        if starving:
+            lane = min(starving)[1]
+            if lane != min(l for l, q in self._queues.items() if q):
+                self.stats[lane]["promoted"] += 1
+            return lane
+        
+        for lane, queue in self._queues.items():
+            if not queue:
+                continue
+            if lane == PRIORITY_BACKGROUND and self._active >= self.max_concurrency - self.reserved:
+                return None
+            return lane
+        return None
+
+    def _dispatch(self):
+        while self._active < self.max_concurrency:
+            lane = self._pick()
+            if lane is None:
+                return
+            _, fut = self._queues[lane].popleft()
+            self._active += 1
+            self._lane_active[lane] += 1
+            fut.set_result(None)
+
+    async def _acquire_slot(self, lane: int):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._queues[lane].append((time.monotonic(), fut))
+        self._dispatch()
+        timer = None
+        if not fut.done() and lane != PRIORITY_INTERACTIVE:
+            timer = loop.call_later(self.starvation_after, self._dispatch)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self._release_slot(lane)
+            raise
+        finally:
+            if timer:
+                timer.cancel()
+
+    def _release_slot(self, lane: int):
+        self._active -= 1
+        self._lane_active[lane] -= 1
+        self._dispatch()
+
+    def _record(self, lane: int, waited: float):
+        stats = self.stats[lane]
+        stats["requests"] += 1
+        stats["waited"] += waited
+        stats["max_wait"] = max(stats["max_wait"], waited)
+        stats["recent"].append(waited)
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: int = PRIORITY_NORMAL, tokens: int = 0):
+        lane = priority if priority in LANES else PRIORITY_NORMAL
+        started = time.monotonic()
+        reservation = await self._reserve_rate(model, lane, tokens)
+        try:
+            await self._acquire_slot(lane)
+        except asyncio.CancelledError:
+            reservation.refund()
+            raise
+        waited = time.monotonic() - started
+        self._record(lane, waited)
+        if waited > 1:
+            print(f"[LIMITER] {model} ({LANES[lane]}) ждал {waited:.1f}с, в очереди {self.queue_depth}")
+        try:
+            yield reservation
+        finally:
+            self._release_slot(lane)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for queue in self._queues.values() for _, fut in queue if not fut.done())
+
+    def get_stats(self) -> dict:
+        lanes = {}
+        for lane, s in self.stats.items():
+            recent = sorted(s["recent"])
+            lanes[LANES[lane]] = {
+                "requests": s["requests"],
+                "active": self._lane_active[lane],
+                "queued": sum(1 for _, fut in self._queues[lane] if not fut.done()),
+                "avg_wait": s["waited"] / s["requests"] if s["requests"] else 0.0,
+                "p95_wait": recent[int(len(recent) * 0.95) - 1] if recent else 0.0,
+                "max_wait": s["max_wait"],
+                "promoted": s["promoted"]
+            }
+        return {
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "reserved": self.reserved,
+            "queue_depth": self.queue_depth,
+            "lanes": lanes
+        }
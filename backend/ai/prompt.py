@@ -0,0 +1,63 @@
+from collections import OrderedDict
+
+# Провайдеры, которым нужен явный cache_control; остальные (OpenAI, DeepSeek, Grok) кэшируют общий префикс сами
+BREAKPOINT_MODELS = ("anthropic/", "google/gemini")
+
+
+class PromptBuilder:
+    def __init__(self, breakpoint_models: list = None, max_prefixes: int = 8):
+        self.breakpoint_models = tuple(BREAKPOINT_MODELS if breakpoint_models is None else breakpoint_models)
+        self.max_prefixes = max(1, max_prefixes)
+        self._prefixes = OrderedDict()
+        self.stats = {"prefix_hits": 0, "prefix_builds": 0, "calls": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+    def prefix(self, persona: str, emoji_prompt: str, emoji_version: int) -> str:
+        # Персона и список эмодзи меняются редко — собираем их один раз на пару версий
+        key = (hash(persona), emoji_version)
+        text = self._prefixes.get(key)
+        if text is not None:
+            self._prefixes.move_to_end(key)
+            self.stats["prefix_hits"] += 1
+            return text
+
+        text = persona + ("\n\n" + emoji_prompt if emoji_prompt else "")
+        self._prefixes[key] = text
+        self.stats["prefix_builds"] += 1
+        while len(self._prefixes) > self.max_prefixes:
+            self._prefixes.popitem(last=False)
+        return text
+
+    def uses_breakpoints(self, model: str) -> bool:
+        return bool(model) and model.startswith(self.breakpoint_models)
+
+    def system_message(self, model: str, prefix: str, stable: str = "", volatile: str = "") -> dict:
+        # Порядок от самого постоянного к самому изменчивому: любое изменение ломает кэш только после себя
+        if not self.uses_breakpoints(model):
+            return {"role": "system", "content": prefix + stable + volatile}
+
+        parts = [{"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}}]
+        if stable:
+            parts.append({"type": "text", "text": stable, "cache_control": {"type": "ephemeral"}})
+        if volatile:
+            parts.append({"type": "text", "text": volatile})
+        return {"role": "system", "content": parts}
+
+    def record(self, model: str, usage: dict):
+        if not usage:
+            return
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        self.stats["calls"] += 1
+        self.stats["prompt_tokens"] += prompt_tokens
+        self.stats["cached_tokens"] += cached_tokens
+        if prompt_tokens:
+            print(f"[PROMPT] {model}: вход {prompt_tokens} токенов, из кэша {cached_tokens} ({cached_tokens / prompt_tokens:.0%})")
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["prefix_hits"] + self.stats["prefix_builds"]
+        return {
+            **self.stats,
+            "prefixes": len(self._prefixes),
+            "prefix_hit_rate": self.stats["prefix_hits"] / lookups if lookups else 0.0,
+            "cached_rate": self.stats["cached_tokens"] / self.stats["prompt_tokens"] if self.stats["prompt_tokens"] else 0.0
+        }
@@ -0,0 +1,64 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+# Коды OpenRouter: 408 таймаут, 429 рейт-лимит, 502 модель упала, 503 нет провайдера.
+# 400/401/402/403 (плохой запрос, ключ, баланс, модерация) повторять бесполезно.
+RETRYABLE_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 520, 524, 529}
+FATAL_CODES = {400, 401, 402, 403, 404, 413}
+
+
+def parse_retry_after(value) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        dt = parsedate_to_datetime(str(value))
+        return max(0.0, dt.timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 6, base_delay: float = 0.5, max_delay: float = 20.0,
+                 max_elapsed: float = 60.0, max_retry_after: float = 60.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_elapsed = max_elapsed
+        self.max_retry_after = max_retry_after
+
+    def with_attempts(self, max_attempts: int) -> "RetryPolicy":
+        return RetryPolicy(max_attempts, self.base_delay, self.max_delay, self.max_elapsed, self.max_retry_after)
+
+    def is_retryable(self, code) -> bool:
+        try:
+            code = int(code)
+        except (TypeError, ValueError):
+            return True
+        if code in FATAL_CODES:
+            return False
+        return code in RETRYABLE_CODES or code >= 500
+
+    def backoff(self, attempt: int, retry_after: float = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        cap = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return random.uniform(0, cap)
+
+    async def wait(self, attempt: int, started: float, retry_after: float = None) -> bool:
+        if attempt + 1 >= self.max_attempts:
+            return False
+        delay = self.backoff(attempt, retry_after)
+        if time.monotonic() - started + delay > self.max_elapsed:
+            return False
+        await asyncio.sleep(delay)
+        return True
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
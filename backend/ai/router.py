@@ -0,0 +1,157 @@
+import time
+from collections import deque
+
+# 4xx кроме таймаута и рейт-лимита — проблема запроса, а не модели
+HEALTH_CODES = {408, 429}
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class ModelHealth:
+    def __init__(self, window: int = 100, alpha: float = 0.2):
+        self.alpha = alpha
+        self.latencies = deque(maxlen=window)
+        # Для стримов отдельно: время до первого токена не смешиваем со временем полного ответа
+        self.first_tokens = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.rate_limited = 0.0
+        self.cancelled = 0
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+
+    @property
+    def success_rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 1.0
+
+    @property
+    def p50(self) -> float:
+        return _percentile(list(self.latencies), 0.5)
+
+    @property
+    def p95(self) -> float:
+        return _percentile(list(self.latencies), 0.95)
+
+    def score(self) -> float:
+        if len(self.latencies) < 3:
+            return 0.0
+        return self.p50 * (1 + 2 * (1 - self.success_rate) + 4 * self.rate_limited)
+
+
+class ModelRouter:
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0, max_cooldown: float = 300.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.models = {}
+        self.decisions = {}
+
+    def _health(self, model: str) -> ModelHealth:
+        if model not in self.models:
+            self.models[model] = ModelHealth()
+        return self.models[model]
+
+    def latency(self, model: str, q: float, min_samples: int = 5):
+        health = self.models.get(model)
+        if not health or len(health.latencies) < min_samples:
+            return None
+        return _percentile(list(health.latencies), q)
+
+    def first_token(self, model: str, q: float, min_samples: int = 5):
+        health = self.models.get(model)
+        if not health or len(health.first_tokens) < min_samples:
+            return None
+        return _percentile(list(health.first_tokens), q)
+
+    def is_available(self, model: str) -> bool:
+        health = self.models.get(model)
+        return not health or time.monotonic() >= health.open_until
+
+    def record(self, model: str, ok: bool, latency: float = None, code=None, first_token: float = None):
+        health = self._health(model)
+        try:
+            code = int(code)
+        except (TypeError, ValueError):
+            code = None
+        health.rate_limited = (1 - health.alpha) * health.rate_limited + health.alpha * (1.0 if code == 429 else 0.0)
+
+        if ok:
+            health.outcomes.append(1)
+            if latency is not None:
+                health.latencies.append(latency)
+            if first_token is not None:
+                health.first_tokens.append(first_token)
+            if health.open_until:
+                print(f"[ROUTER] {model} снова в строю")
+            health.failures = 0
+            health.trips = 0
+            health.open_until = 0.0
+            return
+
+        if code is not None and code < 500 and code not in HEALTH_CODES:
+            return
+
+        health.outcomes.append(0)
+        health.failures += 1
+        # После паузы модель получает пробный запрос: одна ошибка — и снова пауза, вдвое дольше
+        half_open = health.open_until > 0
+        if half_open or health.failures >= self.failure_threshold:
+            health.trips += 1
+            pause = min(self.max_cooldown, self.cooldown * (2 ** (health.trips - 1)))
+            health.open_until = time.monotonic() + pause
+            health.failures = 0
+            print(f"[ROUTER] {model} отключена на {pause:.0f}с (код {code})")
+
+    def record_cancelled(self, model: str, elapsed: float = None, stream: bool = False):
+        # Отменённый дубль не дождался ответа: знаем только нижнюю границу. Передаём её лишь для основной модели —
+        # она уже пережила задержку хеджа, так что это честный медленный замер, а не заниженный
+        health = self._health(model)
+        health.cancelled += 1
+        if elapsed is not None:
+            (health.first_tokens if stream else health.latencies).append(elapsed)
+
+    def order(self, models: list, task: str, pinned: bool = False) -> list:
+        candidates = list(dict.fromkeys(m for m in models if m))
+        if not candidates:
+            return []
+
+        healthy = [m for m in candidates if self.is_available(m)]
+        broken = [m for m in candidates if m not in healthy]
+        if not pinned:
+            healthy.sort(key=lambda m: self.models[m].score() if m in self.models else 0.0)
+        ordered = healthy + broken
+
+        first = ordered[0]
+        if not healthy:
+            reason = "все недоступны"
+        elif first != candidates[0]:
+            reason = "быстрее" if candidates[0] in healthy else f"{candidates[0]} отключена"
+        else:
+            reason = "по порядку"
+        self.decisions[task] = {"model": first, "reason": reason, "at": time.time()}
+        return ordered
+
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "models": {
+                model: {
+                    "requests": len(h.outcomes),
+                    "success_rate": h.success_rate,
+                    "p50": h.p50,
+                    "p95": h.p95,
+                    "first_token": _percentile(list(h.first_tokens), 0.5) if h.first_tokens else None,
+                    "rate_limited": h.rate_limited,
+                    "cancelled": h.cancelled,
+                    "open": h.open_until > now,
+                    "open_for": max(0.0, h.open_until - now)
+                }
+                for model, h in self.models.items()
+            },
+            "decisions": dict(self.decisions)
+        }
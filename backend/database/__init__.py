@@ -1,6 +1,7 @@
-from .sqlite import SQLite
+from .sqlite import SQLite, StorageEngine
 from .emoji import EmojiDB
 from .users import UserDB
 from .reminders import ReminderDB
 from .stickers import StickerDB
 from .groups import GroupDB
+from .history import ChatHistory
@@ -5,9 +5,39 @@ def utf16_len(text: str) -> int:
     return len(text.encode('utf-16-le')) // 2
 
 
+class EmojiCatalog:
+    def __init__(self, emojis: list, version: int = 0):
+        self.version = version
+        self.emojis = emojis
+        self.id_map = {i: e['document_id'] for i, e in enumerate(emojis, 1)}
+        self.emoji_map = {e['document_id']: e['emoji'] for e in emojis}
+        if emojis:
+            self.prompt = "ПРЕМИУМ ЭМОДЗИ (пиши #номер):\n" + "\n".join(
+                f"#{i} — {e['description']}" for i, e in enumerate(emojis, 1)
+            )
+        else:
+            self.prompt = "ЭМОДЗИ НЕТ - не используй никакие эмодзи!"
+
+
 class EmojiDB:
     def __init__(self, db: SQLite):
         self.db = db
+        self.version = 0
+        self._catalog = None
+
+    async def catalog(self) -> EmojiCatalog:
+        # Эмодзи меняются только командами админа — читаем таблицу один раз на версию
+        if self._catalog is None:
+            version = self.version
+            catalog = EmojiCatalog(await self.db.fetchall("SELECT * FROM emojis ORDER BY id"), version)
+            if version != self.version:
+                return catalog
+            self._catalog = catalog
+        return self._catalog
+
+    def _invalidate(self):
+        self.version += 1
+        self._catalog = None
 
     async def init_table(self):
         await self.db.execute("""
@@ -27,13 +57,14 @@ class EmojiDB:
             """,
             (emoji, document_id, description)
         )
+        self._invalidate()
         return True
 
     async def get_all(self) -> list:
-        return await self.db.fetchall("SELECT * FROM emojis ORDER BY id")
+        return list((await self.catalog()).emojis)
 
     async def get_by_index(self, index: int):
-        emojis = await self.get_all()
+        emojis = (await self.catalog()).emojis
         if 0 < index <= len(emojis):
             return emojis[index - 1]
         return None
@@ -47,6 +78,7 @@ class EmojiDB:
 
     async def delete(self, document_id: int) -> bool:
         await self.db.execute("DELETE FROM emojis WHERE document_id=?", (document_id,))
+        self._invalidate()
         return True
 
     async def delete_by_index(self, index: int) -> bool:
@@ -1,124 +1,314 @@
-import aiosqlite
+import itertools
 import json
+import re
 import time
 from typing import Optional
+from .sqlite import SQLite
+from .buffer import WriteBuffer
+from .migrations import migrate, add_columns, table_exists
+
+DAY = 86400
+
+# unicode61 приводит кириллицу к нижнему регистру, в отличие от LIKE
+FTS_TOKENIZER = "unicode61 remove_diacritics 2"
+
+
+def _merge_counts(a: tuple, b: tuple) -> tuple:
+    return (a[0] + b[0], a[1] + b[1], max(a[2], b[2]))
+
+
+INDEXES = {
+    "idx_group_context_time": "group_context(group_id, timestamp, id)",
+    "idx_group_archive_time": "group_archive(group_id, timestamp)",
+    "idx_group_archive_msg": "group_archive(group_id, msg_id)",
+    # Ретенция удаляет по дню во всех группах сразу, поэтому group_id впереди не ставим
+    "idx_group_archive_expiry": "group_archive(day)",
+    "idx_skupki_user": "skupki(group_id, user_id, timestamp)",
+    "idx_skupki_time": "skupki(group_id, timestamp)",
+    "idx_group_warnings_user": "group_warnings(group_id, user_id, expires_at)",
+}
+
+# Запросы горячего пути: на старте проверяем, что ни один не читает таблицу целиком
+HOT_QUERIES = {
+    "get_context": "SELECT * FROM group_context WHERE group_id = 1 ORDER BY timestamp DESC, id DESC LIMIT 15",
+    "get_message_by_msg_id": "SELECT * FROM group_archive WHERE group_id = 1 AND msg_id = 1",
+    "get_message_by_id": "SELECT * FROM group_archive WHERE group_id = 1 AND id = 1",
+    "get_messages_around": "SELECT * FROM group_archive WHERE group_id = 1 AND timestamp < 1 ORDER BY timestamp DESC LIMIT 3",
+    "archive_retention": "DELETE FROM group_archive WHERE day < 1",
+    "get_user_last_skupka": "SELECT * FROM skupki WHERE group_id = 1 AND user_id = 1 ORDER BY timestamp DESC LIMIT 1",
+    "get_all_skupki": "SELECT * FROM skupki WHERE group_id = 1 ORDER BY timestamp DESC LIMIT 20",
+    "get_warnings_count": "SELECT COUNT(*) FROM group_warnings WHERE group_id = 1 AND user_id = 1 AND expires_at > 1",
+    "get_user_warnings": "SELECT * FROM group_warnings WHERE group_id = 1 AND user_id = 1 AND expires_at > 1 ORDER BY timestamp DESC",
+}
+
+
+def _fts_query(query: str, operator: str = " ") -> str:
+    # Каждое слово — отдельная фраза с префиксным поиском: "скуп"* найдёт "скупаю", "скупка"
+    words = re.findall(r'\w+', query.lower())
+    return operator.join(f'"{w}"*' for w in words[:8])
+
+
+async def _create_base_tables(db):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS groups (
+            group_id INTEGER PRIMARY KEY,
+            title TEXT,
+            username TEXT,
+            rules TEXT,
+            staff TEXT,
+            topics TEXT,
+            join_date INTEGER,
+            last_activity INTEGER,
+            message_count INTEGER DEFAULT 0,
+            my_messages INTEGER DEFAULT 0,
+            is_active INTEGER DEFAULT 1,
+            rules_tried INTEGER DEFAULT 0,
+            staff_tried INTEGER DEFAULT 0
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS group_context (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id INTEGER,
+            user_id INTEGER,
+            username TEXT,
+            message TEXT,
+            timestamp INTEGER,
+            msg_id INTEGER,
+            reply_to_msg_id INTEGER
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS group_moderation (
+            group_id INTEGER PRIMARY KEY,
+            mod_level INTEGER DEFAULT 0,
+            promoted_by INTEGER,
+            promoted_at INTEGER,
+            admins_data TEXT DEFAULT '{}',
+            warnings_data TEXT DEFAULT '{}',
+            mod_stats TEXT DEFAULT '{}'
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS group_warnings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id INTEGER,
+            user_id INTEGER,
+            username TEXT,
+            reason TEXT,
+            given_by TEXT,
+            timestamp INTEGER,
+            expires_at INTEGER
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS skupki (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id INTEGER,
+            user_id INTEGER,
+            username TEXT,
+            message_text TEXT,
+            parsed_text TEXT,
+            keywords TEXT,
+            timestamp INTEGER,
+            msg_hash TEXT
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS group_profiles (
+            group_id INTEGER PRIMARY KEY,
+            atmosphere TEXT,
+            main_topics TEXT,
+            communication_style TEXT,
+            key_members TEXT,
+            notes TEXT,
+            last_analyzed INTEGER,
+            analyze_count INTEGER DEFAULT 0
+        )
+    """)
+    
+    await add_columns(db, "groups", {
+        "rules_tried": "INTEGER DEFAULT 0",
+        "staff_tried": "INTEGER DEFAULT 0"
+    })
+    await add_columns(db, "group_context", {
+        "msg_id": "INTEGER",
+        "reply_to_msg_id": "INTEGER"
+    })
+    await add_columns(db, "group_moderation", {
+        "mod_level": "TEXT DEFAULT 0",
+        "promoted_by": "TEXT DEFAULT NULL",
+        "promoted_at": "TEXT DEFAULT NULL",
+        "admins_data": "TEXT DEFAULT '{}'",
+        "warnings_data": "TEXT DEFAULT '{}'",
+        "mod_stats": "TEXT DEFAULT '{}'"
+    })
+
+
+async def _create_archive(db):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS group_archive (
+            id INTEGER PRIMARY KEY,
+            group_id INTEGER,
+            user_id INTEGER,
+            username TEXT,
+            message TEXT,
+            timestamp INTEGER,
+            msg_id INTEGER,
+            reply_to_msg_id INTEGER,
+            day INTEGER
+        )
+    """)
+    # Архив только дописывается: каждая строка горячего окна сразу копируется сюда с тем же id
+    await db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS group_context_archive AFTER INSERT ON group_context BEGIN
+            INSERT OR IGNORE INTO group_archive (id, group_id, user_id, username, message, timestamp, msg_id, reply_to_msg_id, day)
+            VALUES (new.id, new.group_id, new.user_id, new.username, new.message, new.timestamp, new.msg_id, new.reply_to_msg_id, new.timestamp / {DAY});
+        END
+    """)
+    await db.execute(f"""
+        INSERT OR IGNORE INTO group_archive (id, group_id, user_id, username, message, timestamp, msg_id, reply_to_msg_id, day)
+        SELECT id, group_id, user_id, username, message, timestamp, msg_id, reply_to_msg_id, timestamp / {DAY} FROM group_context
+    """)
+
+
+async def _ensure_archive_fts(db) -> bool:
+    # Не шаг миграции: версия записалась бы и без FTS5, а после обновления SQLite индекс так и не появился бы.
+    # Проверяем на каждом старте — всё через IF NOT EXISTS, пересборка только при первом создании
+    async with db.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')") as cursor:
+        if not (await cursor.fetchone())[0]:
+            print("[GROUPS] FTS5 недоступен, поиск через LIKE")
+            return False
+    
+    exists = await table_exists(db, "group_archive_fts")
+    await db.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS group_archive_fts USING fts5(
+            message, content='group_archive', content_rowid='id', tokenize='{FTS_TOKENIZER}'
+        )
+    """)
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS group_archive_ai AFTER INSERT ON group_archive BEGIN
+            INSERT INTO group_archive_fts(rowid, message) VALUES (new.id, new.message);
+        END
+    """)
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS group_archive_ad AFTER DELETE ON group_archive BEGIN
+            INSERT INTO group_archive_fts(group_archive_fts, rowid, message) VALUES ('delete', old.id, old.message);
+        END
+    """)
+    if not exists:
+        await db.execute("INSERT INTO group_archive_fts(group_archive_fts) VALUES ('rebuild')")
+        print("[GROUPS] Построен полнотекстовый индекс архива")
+    await db.commit()
+    return True
+
+
+async def _create_indexes(db):
+    for name, target in INDEXES.items():
+        await db.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+
+
+# Порядок не меняем и старые шаги не правим — только дописываем новые в конец
+MIGRATIONS = [
+    _create_base_tables,
+    _create_archive,
+    _create_indexes,
+]
 
 
 class GroupDB:
-    def __init__(self, db_path: str = "data/groups.db"):
-        self.db_path = db_path
+    def __init__(self, store: SQLite, write_interval: float = 0.5, write_max_rows: int = 100,
+                 context_keep: int = 100, archive_days: int = 90, compact_interval: float = 300):
+        self.store = store
+        self._connect = store.session
+        self._seq = itertools.count()
+        self.writes = WriteBuffer(self._write_batch, write_interval, write_max_rows)
+        self.fts = False
+        # group_context — горячее окно для промптов, group_archive — вся история для поиска
+        self.context_keep = context_keep
+        self.archive_days = archive_days
+        self.compact_interval = compact_interval
     
-    async def init(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS groups (
-                    group_id INTEGER PRIMARY KEY,
-                    title TEXT,
-                    username TEXT,
-                    rules TEXT,
-                    staff TEXT,
-                    topics TEXT,
-                    join_date INTEGER,
-                    last_activity INTEGER,
-                    message_count INTEGER DEFAULT 0,
-                    my_messages INTEGER DEFAULT 0,
-                    is_active INTEGER DEFAULT 1
-                )
-            """)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS group_context (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    group_id INTEGER,
-                    user_id INTEGER,
-                    username TEXT,
-                    message TEXT,
-                    timestamp INTEGER,
-                    msg_id INTEGER,
-                    reply_to_msg_id INTEGER
-                )
-            """)
-            
-            for col in ["msg_id", "reply_to_msg_id"]:
-                try:
-                    await db.execute(f"ALTER TABLE group_context ADD COLUMN {col} INTEGER")
-                except:
-                    pass
-            
-            for col in ["rules_tried", "staff_tried"]:
-                try:
-                    await db.execute(f"ALTER TABLE groups ADD COLUMN {col} INTEGER DEFAULT 0")
-                except:
-                    pass
-            
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS group_moderation (
-                    group_id INTEGER PRIMARY KEY,
-                    mod_level INTEGER DEFAULT 0,
-                    promoted_by INTEGER,
-                    promoted_at INTEGER,
-                    admins_data TEXT DEFAULT '{}',
-                    warnings_data TEXT DEFAULT '{}',
-                    mod_stats TEXT DEFAULT '{}'
-                )
-            """)
-            
-            for col, default in [
-                ("mod_level", "0"),
-                ("promoted_by", "NULL"),
-                ("promoted_at", "NULL"),
-                ("admins_data", "'{}'"),
-                ("warnings_data", "'{}'"),
-                ("mod_stats", "'{}'")
-            ]:
-                try:
-                    await db.execute(f"ALTER TABLE group_moderation ADD COLUMN {col} TEXT DEFAULT {default}")
-                except:
-                    pass
+    async def _write_batch(self, ops: dict):
+        rows = [value for key, value in sorted(ops.items(), key=lambda kv: kv[0][1]) if key[0] == "ctx"]
+        counts = [(key[1], value) for key, value in ops.items() if key[0] == "count"]
+        
+        async with self._connect() as db:
+            if rows:
+                await db.executemany("""
+                    INSERT INTO group_context (group_id, user_id, username, message, timestamp, msg_id, reply_to_msg_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, [
+                    (r["group_id"], r["user_id"], r["username"], r["message"], r["timestamp"], r["msg_id"], r["reply_to_msg_id"])
+                    for r in rows
+                ])
             
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS group_warnings (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    group_id INTEGER,
-                    user_id INTEGER,
-                    username TEXT,
-                    reason TEXT,
-                    given_by TEXT,
-                    timestamp INTEGER,
-                    expires_at INTEGER
-                )
-            """)
+            for group_id, (total, mine, last_activity) in counts:
+                await db.execute("""
+                    UPDATE groups SET 
+                        message_count = message_count + ?,
+                        my_messages = my_messages + ?,
+                        last_activity = ?
+                    WHERE group_id = ?
+                """, (total, mine, last_activity, group_id))
             
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS skupki (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    group_id INTEGER,
-                    user_id INTEGER,
-                    username TEXT,
-                    message_text TEXT,
-                    parsed_text TEXT,
-                    keywords TEXT,
-                    timestamp INTEGER,
-                    msg_hash TEXT
+            await db.commit()
+    
+    def _pending_context(self, group_id: int) -> list:
+        return [dict(value) for key, value in self.writes.pending("ctx") if value["group_id"] == group_id]
+    
+    async def close(self):
+        await self.writes.close()
+        await self.store.close()
+    
+    async def init(self):
+        async with self._connect() as db:
+            await migrate(db, "groups", MIGRATIONS)
+            self.fts = await _ensure_archive_fts(db)
+            await self._check_query_plans(db)
+    
+    async def _check_query_plans(self, db):
+        problems = []
+        for name, query in HOT_QUERIES.items():
+            async with db.execute(f"EXPLAIN QUERY PLAN {query}") as cursor:
+                plan = [row[3] for row in await cursor.fetchall()]
+            scans = [step for step in plan if step.startswith("SCAN") and "USING" not in step and "VIRTUAL TABLE" not in step]
+            if scans:
+                problems.append(name)
+                print(f"[GROUPS] {name}: полный проход по таблице — {'; '.join(scans)}")
+        if not problems:
+            print(f"[GROUPS] План запросов: все {len(HOT_QUERIES)} горячих запросов идут по индексам")
+        return problems
+    
+    async def compact(self) -> dict:
+        await self.writes.flush()
+        async with self._connect() as db:
+            cursor = await db.execute("""
+                DELETE FROM group_context WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, ROW_NUMBER() OVER (PARTITION BY group_id ORDER BY timestamp DESC, id DESC) AS n
+                        FROM group_context
+                    ) WHERE n > ?
                 )
-            """)
+            """, (self.context_keep,))
+            trimmed = cursor.rowcount
             
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS group_profiles (
-                    group_id INTEGER PRIMARY KEY,
-                    atmosphere TEXT,
-                    main_topics TEXT,
-                    communication_style TEXT,
-                    key_members TEXT,
-                    notes TEXT,
-                    last_analyzed INTEGER,
-                    analyze_count INTEGER DEFAULT 0
-                )
-            """)
+            expired = 0
+            if self.archive_days > 0:
+                cutoff = int(time.time()) // DAY - self.archive_days
+                cursor = await db.execute("DELETE FROM group_archive WHERE day < ?", (cutoff,))
+                expired = cursor.rowcount
+                if expired and self.fts:
+                    await db.execute("INSERT INTO group_archive_fts(group_archive_fts) VALUES ('optimize')")
             
             await db.commit()
+        
+        if trimmed or expired:
+            print(f"[GROUPS] Компакция: из окна убрано {trimmed}, из архива удалено {expired} старше {self.archive_days} дн.")
+        return {"trimmed": trimmed, "expired": expired}
     
     async def add_group(self, group_id: int, title: str, username: str = None):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("""
                 INSERT OR REPLACE INTO groups (group_id, title, username, join_date, last_activity)
                 VALUES (?, ?, ?, ?, ?)
@@ -126,110 +316,101 @@ class GroupDB:
             await db.commit()
     
     async def get_group(self, group_id: int) -> dict:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._connect() as db:
             async with db.execute("SELECT * FROM groups WHERE group_id = ? AND is_active = 1", (group_id,)) as cursor:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
     
     async def delete_group(self, group_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        await self.writes.flush()
+        async with self._connect() as db:
             await db.execute("DELETE FROM groups WHERE group_id = ?", (group_id,))
             await db.execute("DELETE FROM group_context WHERE group_id = ?", (group_id,))
+            await db.execute("DELETE FROM group_archive WHERE group_id = ?", (group_id,))
             await db.commit()
     
     async def update_rules(self, group_id: int, rules: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("UPDATE groups SET rules = ? WHERE group_id = ?", (rules[:2000], group_id))
             await db.commit()
     
     async def update_staff(self, group_id: int, staff: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("UPDATE groups SET staff = ? WHERE group_id = ?", (staff[:1000], group_id))
             await db.commit()
     
     async def update_topics(self, group_id: int, topics: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("UPDATE groups SET topics = ? WHERE group_id = ?", (topics[:500], group_id))
             await db.commit()
     
     async def mark_rules_tried(self, group_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("UPDATE groups SET rules_tried = 1 WHERE group_id = ?", (group_id,))
             await db.commit()
     
     async def mark_staff_tried(self, group_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("UPDATE groups SET staff_tried = 1 WHERE group_id = ?", (group_id,))
             await db.commit()
     
     async def increment_messages(self, group_id: int, is_mine: bool = False):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                UPDATE groups SET 
-                    message_count = message_count + 1,
-                    my_messages = my_messages + ?,
-                    last_activity = ?
-                WHERE group_id = ?
-            """, (1 if is_mine else 0, int(time.time()), group_id))
-            await db.commit()
+        await self.writes.put(("count", group_id), (1, 1 if is_mine else 0, int(time.time())), _merge_counts)
     
     async def add_context(self, group_id: int, user_id: int, username: str, message: str, msg_id: int = None, reply_to_msg_id: int = None):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                INSERT INTO group_context (group_id, user_id, username, message, timestamp, msg_id, reply_to_msg_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (group_id, user_id, username, message[:500], int(time.time()), msg_id, reply_to_msg_id))
-            await db.execute("""
-                DELETE FROM group_context 
-                WHERE group_id = ? AND id NOT IN (
-                    SELECT id FROM group_context WHERE group_id = ? ORDER BY timestamp DESC LIMIT 100
-                )
-            """, (group_id, group_id))
-            await db.commit()
+        await self.writes.put(("ctx", next(self._seq)), {
+            "id": None,
+            "group_id": group_id,
+            "user_id": user_id,
+            "username": username,
+            "message": message[:500],
+            "timestamp": int(time.time()),
+            "msg_id": msg_id,
+            "reply_to_msg_id": reply_to_msg_id
+        })
     
     async def get_message_by_msg_id(self, group_id: int, msg_id: int) -> dict:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        await self.writes.flush()
+        async with self._connect() as db:
             async with db.execute("""
-                SELECT * FROM group_context 
+                SELECT * FROM group_archive 
                 WHERE group_id = ? AND msg_id = ?
             """, (group_id, msg_id)) as cursor:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
     
     async def get_context(self, group_id: int, limit: int = 15) -> list:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._connect() as db:
             async with db.execute("""
                 SELECT * FROM group_context 
                 WHERE group_id = ? 
-                ORDER BY timestamp DESC LIMIT ?
+                ORDER BY timestamp DESC, id DESC LIMIT ?
             """, (group_id, limit)) as cursor:
                 rows = await cursor.fetchall()
-                return [dict(row) for row in reversed(rows)]
+            context = [dict(row) for row in reversed(rows)] + self._pending_context(group_id)
+            return context[-limit:]
     
     async def get_message_by_id(self, group_id: int, msg_id: int) -> dict:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        await self.writes.flush()
+        async with self._connect() as db:
             async with db.execute("""
-                SELECT * FROM group_context 
+                SELECT * FROM group_archive 
                 WHERE group_id = ? AND id = ?
             """, (group_id, msg_id)) as cursor:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
     
     async def get_messages_around(self, group_id: int, timestamp: int, before: int = 3, after: int = 3) -> list:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        await self.writes.flush()
+        async with self._connect() as db:
             async with db.execute("""
                 SELECT * FROM (
-                    SELECT * FROM group_context 
+                    SELECT * FROM group_archive 
                     WHERE group_id = ? AND timestamp < ?
                     ORDER BY timestamp DESC LIMIT ?
                 ) UNION ALL
                 SELECT * FROM (
-                    SELECT * FROM group_context 
+                    SELECT * FROM group_archive 
                     WHERE group_id = ? AND timestamp >= ?
                     ORDER BY timestamp ASC LIMIT ?
                 )
@@ -239,10 +420,26 @@ class GroupDB:
                 return [dict(row) for row in rows]
     
     async def search_messages(self, group_id: int, query: str, limit: int = 10) -> list:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        await self.writes.flush()
+        if self.fts and _fts_query(query):
+            # Сначала все слова сразу, если пусто — любое из них; порядок по BM25
+            for match in dict.fromkeys([_fts_query(query), _fts_query(query, " OR ")]):
+                async with self._connect() as db:
+                    async with db.execute("""
+                        SELECT a.*, snippet(group_archive_fts, 0, '«', '»', '…', 12) AS snippet
+                        FROM group_archive_fts
+                        JOIN group_archive a ON a.id = group_archive_fts.rowid
+                        WHERE group_archive_fts MATCH ? AND a.group_id = ?
+                        ORDER BY bm25(group_archive_fts) LIMIT ?
+                    """, (match, group_id, limit)) as cursor:
+                        rows = await cursor.fetchall()
+                if rows:
+                    return [dict(row) for row in rows]
+            return []
+        
+        async with self._connect() as db:
             async with db.execute("""
-                SELECT * FROM group_context 
+                SELECT * FROM group_archive 
                 WHERE group_id = ? AND message LIKE ?
                 ORDER BY timestamp DESC LIMIT ?
             """, (group_id, f"%{query}%", limit)) as cursor:
@@ -250,25 +447,24 @@ class GroupDB:
                 return [dict(row) for row in reversed(rows)]
     
     async def get_all_groups(self) -> list:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._connect() as db:
             async with db.execute("SELECT * FROM groups WHERE is_active = 1") as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
     
     async def deactivate(self, group_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("UPDATE groups SET is_active = 0 WHERE group_id = ?", (group_id,))
             await db.commit()
     
     async def get_mod_level(self, group_id: int) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute("SELECT mod_level FROM group_moderation WHERE group_id = ?", (group_id,)) as cursor:
                 row = await cursor.fetchone()
                 return row[0] if row else 0
     
     async def set_mod_level(self, group_id: int, level: int, promoted_by: int = None):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("""
                 INSERT INTO group_moderation (group_id, mod_level, promoted_by, promoted_at)
                 VALUES (?, ?, ?, ?)
@@ -281,8 +477,7 @@ class GroupDB:
             print(f"[DB] set_mod_level: group_id={group_id}, level={level}, promoted_by={promoted_by}")
     
     async def get_mod_info(self, group_id: int) -> Optional[dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._connect() as db:
             async with db.execute("SELECT * FROM group_moderation WHERE group_id = ?", (group_id,)) as cursor:
                 row = await cursor.fetchone()
                 if row:
@@ -296,7 +491,7 @@ class GroupDB:
                 return None
     
     async def update_admin_performance(self, group_id: int, admin_id: int, admin_name: str, action: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute("SELECT admins_data FROM group_moderation WHERE group_id = ?", (group_id,)) as cursor:
                 row = await cursor.fetchone()
                 admins = json.loads(row[0] if row and row[0] else '{}')
@@ -320,7 +515,7 @@ class GroupDB:
             await db.commit()
     
     async def add_warning(self, group_id: int, user_id: int, username: str, reason: str, given_by: str = "Хоно"):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("""
                 INSERT INTO group_warnings (group_id, user_id, username, reason, given_by, timestamp, expires_at)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -328,8 +523,7 @@ class GroupDB:
             await db.commit()
     
     async def get_user_warnings(self, group_id: int, user_id: int) -> list:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._connect() as db:
             async with db.execute("""
                 SELECT * FROM group_warnings 
                 WHERE group_id = ? AND user_id = ? AND expires_at > ?
@@ -339,11 +533,16 @@ class GroupDB:
                 return [dict(row) for row in rows]
     
     async def get_warnings_count(self, group_id: int, user_id: int) -> int:
-        warnings = await self.get_user_warnings(group_id, user_id)
-        return len(warnings)
+        async with self._connect() as db:
+            async with db.execute("""
+                SELECT COUNT(*) FROM group_warnings 
+                WHERE group_id = ? AND user_id = ? AND expires_at > ?
+            """, (group_id, user_id, int(time.time()))) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else 0
     
     async def update_mod_stats(self, group_id: int, action: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute("SELECT mod_stats FROM group_moderation WHERE group_id = ?", (group_id,)) as cursor:
                 row = await cursor.fetchone()
                 stats = json.loads(row[0] if row and row[0] else '{}')
@@ -360,7 +559,7 @@ class GroupDB:
             await db.commit()
 
     async def add_skupka(self, group_id: int, user_id: int, username: str, message_text: str, parsed_text: str, keywords: str, msg_hash: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("""
                 INSERT INTO skupki (group_id, user_id, username, message_text, parsed_text, keywords, timestamp, msg_hash)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
@@ -368,8 +567,7 @@ class GroupDB:
             await db.commit()
 
     async def get_user_last_skupka(self, group_id: int, user_id: int) -> Optional[dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._connect() as db:
             async with db.execute("""
                 SELECT * FROM skupki WHERE group_id = ? AND user_id = ?
                 ORDER BY timestamp DESC LIMIT 1
@@ -378,8 +576,7 @@ class GroupDB:
                 return dict(row) if row else None
 
     async def search_skupki(self, group_id: int, query: str) -> list:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._connect() as db:
             query_lower = f"%{query.lower()}%"
             async with db.execute("""
                 SELECT DISTINCT user_id, username, parsed_text, keywords, timestamp 
@@ -396,8 +593,7 @@ class GroupDB:
                 return [dict(row) for row in rows]
 
     async def get_all_skupki(self, group_id: int, limit: int = 20) -> list:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._connect() as db:
             async with db.execute("""
                 SELECT DISTINCT user_id, username, parsed_text, keywords, timestamp 
                 FROM skupki WHERE group_id = ?
@@ -407,17 +603,16 @@ class GroupDB:
                 return [dict(row) for row in rows]
 
     async def get_group_profile(self, group_id: int) -> Optional[dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._connect() as db:
             async with db.execute("SELECT * FROM group_profiles WHERE group_id = ?", (group_id,)) as cursor:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
 
     async def update_group_profile(self, group_id: int, atmosphere: str = None, main_topics: str = None,
                                    communication_style: str = None, key_members: str = None, notes: str = None):
-        async with aiosqlite.connect(self.db_path) as db:
-            existing = await self.get_group_profile(group_id)
-            
+        existing = await self.get_group_profile(group_id)
+        
+        async with self._connect() as db:
             if existing:
                 updates = []
                 values = []
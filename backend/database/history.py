@@ -0,0 +1,207 @@
+import itertools
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+from .sqlite import SQLite
+from .buffer import WriteBuffer
+
+
+MIGRATIONS = [
+    [
+        """
+        CREATE TABLE IF NOT EXISTS chat_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_chat ON chat_history(chat_id, id)",
+    ],
+    """
+    CREATE TABLE IF NOT EXISTS chat_summary (
+        chat_id INTEGER PRIMARY KEY,
+        summary TEXT NOT NULL,
+        updated_at INTEGER NOT NULL
+    )
+    """,
+]
+
+
+def message_tokens(message: dict) -> int:
+    # Грубая оценка как в лимитере: ~4 символа на токен плюс служебные токены роли
+    return len(message["content"]) // 4 + 4
+
+
+class ChatHistory:
+    def __init__(self, db: Optional[SQLite] = None, write_interval: float = 0.5, write_max_rows: int = 100,
+                 max_chats: int = 500, max_tokens: int = 2000, max_messages: int = 40, persist: bool = True,
+                 summarize: bool = True, summary_batch: int = 6, summary_tokens: int = 200):
+        self.db = db if persist else None
+        self.writes = WriteBuffer(self._write_batch, write_interval, write_max_rows)
+        self.max_chats = max(1, max_chats)
+        self.max_tokens = max_tokens
+        self.max_messages = max(2, max_messages)
+        # chat_id -> окно последних сообщений; порядок OrderedDict = порядок использования (LRU)
+        self._chats = OrderedDict()
+        self._tokens = {}
+        # Вытесненные из окна реплики копятся здесь, пока фоновая задача не свернёт их в сводку
+        self.summarize = summarize
+        self.summary_batch = max(1, summary_batch)
+        self.summary_tokens = summary_tokens
+        self._summaries = {}
+        self._folded = {}
+        self._summarizing = set()
+        self._seq = itertools.count()
+        self.stats = {"loads": 0, "evictions": 0, "trimmed": 0, "folded": 0}
+
+    async def init_table(self):
+        if self.db:
+            await self.db.migrate("chat_history", MIGRATIONS)
+
+    async def _write_batch(self, ops: dict):
+        rows = [value for key, value in sorted(ops.items(), key=lambda kv: kv[0][1])]
+        async with self.db.session() as db:
+            await db.executemany(
+                "INSERT INTO chat_history (chat_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                [(r["chat_id"], r["role"], r["content"], r["created_at"]) for r in rows]
+            )
+            # В базе держим столько же, сколько влезает в окно — остальное всё равно не читается
+            for chat_id in {r["chat_id"] for r in rows}:
+                await db.execute("""
+                    DELETE FROM chat_history WHERE chat_id = ? AND id <= (
+                        SELECT id FROM chat_history WHERE chat_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+                    )
+                """, (chat_id, chat_id, self.max_messages))
+            await db.commit()
+
+    def _trim(self, chat_id: int, window: deque, fold: bool = False):
+        dropped = []
+        while len(window) > 1 and (self._tokens[chat_id] > self.max_tokens or len(window) > self.max_messages):
+            self._tokens[chat_id] -= message_tokens(window[0])
+            dropped.append(window.popleft())
+        # Окно начинается с реплики пользователя, как раньше при удалении парами
+        while len(window) > 1 and window[0]["role"] == "assistant":
+            self._tokens[chat_id] -= message_tokens(window[0])
+            dropped.append(window.popleft())
+        self.stats["trimmed"] += len(dropped)
+        if fold and self.summarize and dropped:
+            self._folded[chat_id] = (self._folded.get(chat_id, []) + dropped)[-self.max_messages:]
+
+    async def _window(self, chat_id: int) -> deque:
+        window = self._chats.get(chat_id)
+        if window is not None:
+            self._chats.move_to_end(chat_id)
+            return window
+
+        messages = []
+        if self.db:
+            # Вытесненный чат мог не успеть записаться
+            await self.writes.flush()
+            rows = await self.db.fetchall(
+                "SELECT role, content FROM chat_history WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
+                (chat_id, self.max_messages)
+            )
+            messages = [{"role": r["role"], "content": r["content"]} for r in reversed(rows)]
+            summary = await self.db.fetchone("SELECT summary FROM chat_summary WHERE chat_id = ?", (chat_id,))
+            if summary:
+                self._summaries[chat_id] = summary["summary"]
+            self.stats["loads"] += 1
+            # Пока читали, окно мог создать другой обработчик того же чата
+            if chat_id in self._chats:
+                return await self._window(chat_id)
+
+        window = deque(messages)
+        self._chats[chat_id] = window
+        self._tokens[chat_id] = sum(message_tokens(m) for m in window)
+        self._trim(chat_id, window)
+        while len(self._chats) > self.max_chats:
+            evicted, _ = self._chats.popitem(last=False)
+            self._tokens.pop(evicted, None)
+            self._folded.pop(evicted, None)
+            if self.db:
+                self._summaries.pop(evicted, None)
+            self.stats["evictions"] += 1
+        return window
+
+    async def get(self, chat_id: int) -> list:
+        return list(await self._window(chat_id))
+
+    async def add(self, chat_id: int, role: str, content: str):
+        window = await self._window(chat_id)
+        message = {"role": role, "content": content}
+        window.append(message)
+        self._tokens[chat_id] += message_tokens(message)
+        self._trim(chat_id, window, fold=True)
+        if self.db:
+            await self.writes.put(("msg", next(self._seq)), {**message, "chat_id": chat_id, "created_at": int(time.time())})
+
+    async def get_summary(self, chat_id: int) -> str:
+        await self._window(chat_id)
+        return self._summaries.get(chat_id, "")
+
+    def take_folded(self, chat_id: int) -> list:
+        # Отдаём накопленное одной задаче на чат; пока она работает, новые реплики просто копятся
+        folded = self._folded.get(chat_id, [])
+        if chat_id in self._summarizing or len(folded) < self.summary_batch:
+            return []
+        self._summarizing.add(chat_id)
+        return self._folded.pop(chat_id)
+
+    async def set_summary(self, chat_id: int, summary: str, folded: list):
+        if chat_id not in self._summarizing:
+            # Историю успели очистить, пока модель писала сводку
+            return
+        self._summarizing.discard(chat_id)
+        if not summary:
+            # Не получилось — вернём реплики в очередь, но не больше окна, чтобы не копить бесконечно
+            self._folded[chat_id] = (folded + self._folded.get(chat_id, []))[-self.max_messages:]
+            return
+        self._summaries[chat_id] = summary
+        self.stats["folded"] += len(folded)
+        if self.db:
+            await self.db.execute("""
+                INSERT INTO chat_summary (chat_id, summary, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(chat_id) DO UPDATE SET summary = excluded.summary, updated_at = excluded.updated_at
+            """, (chat_id, summary, int(time.time())))
+
+    async def clear(self, chat_id: int) -> bool:
+        existed = bool(self._chats.pop(chat_id, None))
+        existed = bool(self._summaries.pop(chat_id, None)) or existed
+        self._tokens.pop(chat_id, None)
+        self._folded.pop(chat_id, None)
+        self._summarizing.discard(chat_id)
+        if self.db:
+            await self.writes.flush()
+            async with self.db.session() as db:
+                cursor = await db.execute("DELETE FROM chat_history WHERE chat_id = ?", (chat_id,))
+                existed = existed or cursor.rowcount > 0
+                await db.execute("DELETE FROM chat_summary WHERE chat_id = ?", (chat_id,))
+                await db.commit()
+        return existed
+
+    async def clear_all(self):
+        self._chats.clear()
+        self._tokens.clear()
+        self._summaries.clear()
+        self._folded.clear()
+        self._summarizing.clear()
+        if self.db:
+            await self.writes.flush()
+            await self.db.execute_batch([("DELETE FROM chat_history", None), ("DELETE FROM chat_summary", None)])
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "chats": len(self._chats),
+            "messages": sum(len(window) for window in self._chats.values()),
+            "tokens": sum(self._tokens.values()),
+            "bytes": sum(len(m["content"].encode("utf-8")) for window in self._chats.values() for m in window),
+            "summaries": len(self._summaries),
+            "summary_tokens": sum(len(summary) // 4 for summary in self._summaries.values()),
+            "persistent": self.db is not None
+        }
+
+    async def close(self):
+        await self.writes.close()
@@ -1,61 +1,75 @@
-import aiosqlite
 import time
 import json
 from typing import List, Optional, Dict
+from .sqlite import SQLite
+from .migrations import migrate
+
+
+async def _create_tables(db):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS lessons (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category TEXT NOT NULL,
+            trigger_context TEXT,
+            lesson TEXT NOT NULL,
+            importance INTEGER DEFAULT 1,
+            times_applied INTEGER DEFAULT 0,
+            created_at INTEGER,
+            last_used INTEGER,
+            source_chat_id INTEGER,
+            source_user_id INTEGER
+        )
+    """)
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS interactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            user_id INTEGER,
+            my_message TEXT,
+            user_reaction TEXT,
+            reaction_type TEXT,
+            analyzed INTEGER DEFAULT 0,
+            created_at INTEGER
+        )
+    """)
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS patterns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pattern_type TEXT,
+            description TEXT,
+            examples TEXT,
+            effectiveness INTEGER DEFAULT 0,
+            created_at INTEGER
+        )
+    """)
+
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_lessons_category ON lessons(category)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_lessons_importance ON lessons(importance DESC)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_interactions_analyzed ON interactions(analyzed)")
+
+
+MIGRATIONS = [
+    _create_tables,
+]
+
 
 class GlobalMemory:
-    def __init__(self, db_path: str = "data/global_memory.db"):
-        self.db_path = db_path
+    def __init__(self, store: SQLite):
+        self.store = store
+        self._connect = store.session
+    
+    async def close(self):
+        await self.store.close()
     
     async def init(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS lessons (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    category TEXT NOT NULL,
-                    trigger_context TEXT,
-                    lesson TEXT NOT NULL,
-                    importance INTEGER DEFAULT 1,
-                    times_applied INTEGER DEFAULT 0,
-                    created_at INTEGER,
-                    last_used INTEGER,
-                    source_chat_id INTEGER,
-                    source_user_id INTEGER
-                )
-            """)
-            
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS interactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chat_id INTEGER,
-                    user_id INTEGER,
-                    my_message TEXT,
-                    user_reaction TEXT,
-                    reaction_type TEXT,
-                    analyzed INTEGER DEFAULT 0,
-                    created_at INTEGER
-                )
-            """)
-            
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS patterns (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    pattern_type TEXT,
-                    description TEXT,
-                    examples TEXT,
-                    effectiveness INTEGER DEFAULT 0,
-                    created_at INTEGER
-                )
-            """)
-            
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_lessons_category ON lessons(category)")
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_lessons_importance ON lessons(importance DESC)")
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_interactions_analyzed ON interactions(analyzed)")
-            await db.commit()
+        async with self._connect() as db:
+            await migrate(db, "global_memory", MIGRATIONS)
     
     async def add_lesson(self, category: str, lesson: str, trigger_context: str = None, 
                          importance: int = 1, chat_id: int = None, user_id: int = None) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             existing = await db.execute(
                 "SELECT id, importance FROM lessons WHERE lesson LIKE ? AND category = ?",
                 (f"%{lesson[:50]}%", category)
@@ -81,7 +95,7 @@ class GlobalMemory:
     
     async def log_interaction(self, chat_id: int, user_id: int, my_message: str, 
                               user_reaction: str, reaction_type: str = "neutral"):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute(
                 """INSERT INTO interactions (chat_id, user_id, my_message, user_reaction, reaction_type, created_at)
                    VALUES (?, ?, ?, ?, ?, ?)""",
@@ -90,8 +104,7 @@ class GlobalMemory:
             await db.commit()
     
     async def get_relevant_lessons(self, context: str = None, category: str = None, limit: int = 5) -> List[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._connect() as db:
             
             if category:
                 cursor = await db.execute(
@@ -124,7 +137,7 @@ class GlobalMemory:
             return lessons
     
     async def mark_lesson_used(self, lesson_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute(
                 "UPDATE lessons SET times_applied = times_applied + 1, last_used = ? WHERE id = ?",
                 (int(time.time()), lesson_id)
@@ -132,8 +145,7 @@ class GlobalMemory:
             await db.commit()
     
     async def get_unanalyzed_interactions(self, limit: int = 20) -> List[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._connect() as db:
             cursor = await db.execute(
                 "SELECT * FROM interactions WHERE analyzed = 0 ORDER BY created_at DESC LIMIT ?",
                 (limit,)
@@ -144,13 +156,13 @@ class GlobalMemory:
     async def mark_interactions_analyzed(self, ids: List[int]):
         if not ids:
             return
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             placeholders = ','.join('?' * len(ids))
             await db.execute(f"UPDATE interactions SET analyzed = 1 WHERE id IN ({placeholders})", ids)
             await db.commit()
     
     async def add_pattern(self, pattern_type: str, description: str, examples: list = None):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute(
                 """INSERT INTO patterns (pattern_type, description, examples, created_at)
                    VALUES (?, ?, ?, ?)""",
@@ -159,19 +171,18 @@ class GlobalMemory:
             await db.commit()
     
     async def get_all_lessons(self) -> List[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._connect() as db:
             cursor = await db.execute("SELECT * FROM lessons ORDER BY importance DESC")
             rows = await cursor.fetchall()
             return [dict(row) for row in rows]
     
     async def delete_lesson(self, lesson_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("DELETE FROM lessons WHERE id = ?", (lesson_id,))
             await db.commit()
     
     async def get_stats(self) -> Dict:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             lessons_count = await db.execute("SELECT COUNT(*) FROM lessons")
             lessons = (await lessons_count.fetchone())[0]
             
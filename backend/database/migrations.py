@@ -0,0 +1,57 @@
+import aiosqlite
+
+
+async def column_names(db: aiosqlite.Connection, table: str) -> set:
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        return {row[1] for row in await cursor.fetchall()}
+
+
+async def add_columns(db: aiosqlite.Connection, table: str, columns: dict):
+    # Старые базы создавались разными версиями бота — добавляем только то, чего реально нет
+    existing = await column_names(db, table)
+    for name, definition in columns.items():
+        if name not in existing:
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+async def table_exists(db: aiosqlite.Connection, name: str) -> bool:
+    async with db.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)) as cursor:
+        return await cursor.fetchone() is not None
+
+
+async def migrate(db: aiosqlite.Connection, component: str, steps: list) -> int:
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            component TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            updated_at INTEGER DEFAULT (strftime('%s', 'now'))
+        )
+    """)
+    async with db.execute("SELECT version FROM schema_version WHERE component = ?", (component,)) as cursor:
+        row = await cursor.fetchone()
+    current = row[0] if row else 0
+
+    if current >= len(steps):
+        return current
+
+    # Все недостающие шаги — одной транзакцией: либо схема обновилась целиком, либо не изменилась вовсе
+    await db.execute("BEGIN")
+    try:
+        for step in steps[current:]:
+            if callable(step):
+                await step(db)
+            else:
+                for statement in ([step] if isinstance(step, str) else step):
+                    await db.execute(statement)
+        await db.execute("""
+            INSERT INTO schema_version (component, version) VALUES (?, ?)
+            ON CONFLICT(component) DO UPDATE SET version = excluded.version, updated_at = strftime('%s', 'now')
+        """, (component, len(steps)))
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        print(f"[DB] Миграция {component} {current} -> {len(steps)} не удалась, схема не изменена")
+        raise
+
+    print(f"[DB] Схема {component}: {current} -> {len(steps)}")
+    return len(steps)
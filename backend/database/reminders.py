@@ -1,30 +1,56 @@
 from typing import Optional, List
 import time
 from .sqlite import SQLite
+from .migrations import add_columns
+
+
+async def _add_text(db):
+    # Готовый текст, сгенерированный заранее: в момент отправки остаётся только send_message
+    await add_columns(db, "reminders", {"text": "TEXT"})
+
+
+MIGRATIONS = [
+    [
+        """
+        CREATE TABLE IF NOT EXISTS reminders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            send_at INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            sent INTEGER DEFAULT 0
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_reminders_due ON reminders(sent, send_at)",
+        "CREATE INDEX IF NOT EXISTS idx_reminders_user ON reminders(user_id, sent, send_at)",
+    ],
+    _add_text,
+]
 
 
 class ReminderDB:
     def __init__(self, db: SQLite):
         self.db = db
+        # Планировщик подписывается сюда, чтобы узнать о новом напоминании без опроса базы
+        self.listeners = []
 
     async def init_table(self):
-        await self.db.execute("""
-            CREATE TABLE IF NOT EXISTS reminders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                chat_id INTEGER NOT NULL,
-                message TEXT NOT NULL,
-                send_at INTEGER NOT NULL,
-                created_at INTEGER NOT NULL,
-                sent INTEGER DEFAULT 0
-            )
-        """)
+        await self.db.migrate("reminders", MIGRATIONS)
 
     async def add(self, user_id: int, chat_id: int, message: str, send_at: int) -> int:
-        return await self.db.execute(
+        now = int(time.time())
+        reminder_id = await self.db.execute(
             "INSERT INTO reminders (user_id, chat_id, message, send_at, created_at) VALUES (?, ?, ?, ?, ?)",
-            (user_id, chat_id, message, send_at, int(time.time()))
+            (user_id, chat_id, message, send_at, now)
         )
+        reminder = {
+            "id": reminder_id, "user_id": user_id, "chat_id": chat_id,
+            "message": message, "send_at": send_at, "created_at": now, "sent": 0, "text": None
+        }
+        for listener in self.listeners:
+            listener(reminder)
+        return reminder_id
 
     async def get_pending(self) -> List[dict]:
         now = int(time.time())
@@ -33,9 +59,34 @@ class ReminderDB:
             (now,)
         )
 
+    async def get_upcoming(self, limit: int = 100) -> List[dict]:
+        return await self.db.fetchall(
+            "SELECT * FROM reminders WHERE sent = 0 ORDER BY send_at LIMIT ?",
+            (limit,)
+        )
+
+    async def claim(self, reminder_id: int) -> bool:
+        # Помечаем до отправки: удалённое или уже отправленное напоминание не уйдёт второй раз
+        async with self.db.session() as db:
+            cursor = await db.execute("UPDATE reminders SET sent = 1 WHERE id = ? AND sent = 0", (reminder_id,))
+            await db.commit()
+            return cursor.rowcount > 0
+
+    async def set_text(self, reminder_id: int, text: str):
+        await self.db.execute("UPDATE reminders SET text = ? WHERE id = ? AND sent = 0", (text, reminder_id))
+
     async def mark_sent(self, reminder_id: int):
         await self.db.execute("UPDATE reminders SET sent = 1 WHERE id = ?", (reminder_id,))
 
+    async def compact(self, keep_days: int = 7) -> int:
+        async with self.db.session() as db:
+            cursor = await db.execute(
+                "DELETE FROM reminders WHERE sent = 1 AND send_at < ?",
+                (int(time.time()) - keep_days * 86400,)
+            )
+            await db.commit()
+            return cursor.rowcount
+
     async def get_user_reminders(self, user_id: int) -> List[dict]:
         return await self.db.fetchall(
             "SELECT * FROM reminders WHERE user_id = ? AND sent = 0 ORDER BY send_at",
@@ -44,4 +95,3 @@ class ReminderDB:
 
     async def delete(self, reminder_id: int):
         await self.db.execute("DELETE FROM reminders WHERE id = ?", (reminder_id,))
-
@@ -1,31 +1,182 @@
+import asyncio
+import os
+import re
+import time
+from contextlib import asynccontextmanager
 import aiosqlite
+from .migrations import migrate
+
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -8000,
+    "mmap_size": 64 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+
+_TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN|ON)\s+(\w+)', re.IGNORECASE)
+
+
+async def open_connection(db_path: str, pragmas: dict = None) -> aiosqlite.Connection:
+    db = await aiosqlite.connect(db_path)
+    db.row_factory = aiosqlite.Row
+    for name, value in {**PRAGMAS, **(pragmas or {})}.items():
+        await db.execute(f"PRAGMA {name} = {value}")
+    return db
+
+
+def _table_of(query: str) -> str:
+    match = _TABLE_RE.search(query)
+    return match.group(1) if match else "other"
+
+
+class _Timed:
+    # Обёртка над db.execute: работает и как await, и как async with, и пишет время в метрики
+    def __init__(self, result, store, query: str):
+        self._result = result
+        self._store = store
+        self._query = query
+        self._cursor = None
+
+    async def _run(self):
+        start = time.perf_counter()
+        try:
+            return await self._result
+        finally:
+            self._store.record(self._query, time.perf_counter() - start)
+
+    def __await__(self):
+        return self._run().__await__()
+
+    async def __aenter__(self):
+        self._cursor = await self._run()
+        return self._cursor
+
+    async def __aexit__(self, *exc):
+        await self._cursor.close()
+
+
+class _TimedConnection:
+    def __init__(self, conn: aiosqlite.Connection, store):
+        self._conn = conn
+        self._store = store
+
+    def execute(self, query: str, args=()):
+        return _Timed(self._conn.execute(query, args), self._store, query)
+
+    def executemany(self, query: str, args):
+        return _Timed(self._conn.executemany(query, args), self._store, query)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
 
 
 class SQLite:
-    def __init__(self, db_path: str = "data/database.db"):
+    def __init__(self, db_path: str = "data/database.db", pragmas: dict = None):
         self.db_path = db_path
+        self.pragmas = pragmas
         self.db = None
+        self._lock = asyncio.Lock()
+        self.metrics = {}
 
     async def connect(self):
-        self.db = await aiosqlite.connect(self.db_path)
-        self.db.row_factory = aiosqlite.Row
+        if self.db is None:
+            self.db = _TimedConnection(await open_connection(self.db_path, self.pragmas), self)
+
+    def record(self, query: str, elapsed: float):
+        table = _table_of(query)
+        stats = self.metrics.setdefault(table, {"calls": 0, "total": 0.0, "max": 0.0})
+        stats["calls"] += 1
+        stats["total"] += elapsed
+        stats["max"] = max(stats["max"], elapsed)
+
+    @asynccontextmanager
+    async def session(self):
+        # Одно соединение на файл, запросы к нему идут по очереди — как и пишет сам SQLite
+        async with self._lock:
+            await self.connect()
+            yield self.db
 
     async def execute(self, query: str, args: tuple = None):
-        async with self.db.execute(query, args or ()) as cursor:
-            await self.db.commit()
-            return cursor.lastrowid
+        async with self.session() as db:
+            async with db.execute(query, args or ()) as cursor:
+                await db.commit()
+                return cursor.lastrowid
+
+    async def migrate(self, component: str, steps: list) -> int:
+        async with self.session() as db:
+            return await migrate(db, component, steps)
+
+    async def execute_batch(self, statements: list):
+        async with self.session() as db:
+            for query, args in statements:
+                await db.execute(query, args or ())
+            await db.commit()
 
     async def fetchone(self, query: str, args: tuple = None):
-        async with self.db.execute(query, args or ()) as cursor:
-            row = await cursor.fetchone()
-            return dict(row) if row else None
+        async with self.session() as db:
+            async with db.execute(query, args or ()) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
 
     async def fetchall(self, query: str, args: tuple = None):
-        async with self.db.execute(query, args or ()) as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+        async with self.session() as db:
+            async with db.execute(query, args or ()) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+
+    async def backup(self, target_path: str):
+        target = await aiosqlite.connect(target_path)
+        try:
+            async with self.session() as db:
+                await db.backup(target)
+        finally:
+            await target.close()
+
+    def get_stats(self) -> dict:
+        return {
+            table: {**stats, "avg": stats["total"] / stats["calls"] if stats["calls"] else 0.0}
+            for table, stats in self.metrics.items()
+        }
 
     async def close(self):
-        if self.db:
-            await self.db.close()
+        async with self._lock:
+            if self.db:
+                await self.db.close()
+                self.db = None
 
+
+class StorageEngine:
+    def __init__(self, data_dir: str = "data", pragmas: dict = None):
+        self.data_dir = data_dir
+        self.pragmas = pragmas
+        self.stores = {}
+
+    def open(self, name: str) -> SQLite:
+        if name not in self.stores:
+            self.stores[name] = SQLite(os.path.join(self.data_dir, f"{name}.db"), self.pragmas)
+        return self.stores[name]
+
+    async def backup(self, backup_dir: str, keep: int = 3) -> list:
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        target_dir = os.path.join(backup_dir, stamp)
+        os.makedirs(target_dir, exist_ok=True)
+        for name, store in self.stores.items():
+            await store.backup(os.path.join(target_dir, f"{name}.db"))
+
+        snapshots = sorted(d for d in os.listdir(backup_dir) if os.path.isdir(os.path.join(backup_dir, d)))
+        for old in snapshots[:-keep] if keep > 0 else []:
+            old_dir = os.path.join(backup_dir, old)
+            for file in os.listdir(old_dir):
+                os.remove(os.path.join(old_dir, file))
+            os.rmdir(old_dir)
+        print(f"[DB] Бэкап {len(self.stores)} баз в {target_dir}")
+        return [os.path.join(target_dir, f"{name}.db") for name in self.stores]
+
+    def get_stats(self) -> dict:
+        return {name: store.get_stats() for name, store in self.stores.items()}
+
+    async def close(self):
+        for store in self.stores.values():
+            await store.close()
@@ -1,6 +1,9 @@
 from typing import Optional, List
+from collections import OrderedDict
 import time
 from .sqlite import SQLite
+from .buffer import WriteBuffer
+from .migrations import add_columns
 
 
 RELATIONSHIP_LEVELS = {
@@ -20,134 +23,226 @@ RELATIONSHIP_LEVELS = {
 }
 
 
+PROFILE_FIELDS = {
+    "username", "name", "profile", "mood", "relationship", "last_seen",
+    "last_updated", "topics", "dates", "message_count"
+}
+
+
+def _upsert_statement(user_id: int, fields: dict, increments: dict = None) -> tuple:
+    # None = поле не трогаем; increments прибавляются к текущему значению
+    fields = {k: v for k, v in fields.items() if v is not None}
+    increments = {k: v for k, v in (increments or {}).items() if v}
+    unknown = (set(fields) | set(increments)) - PROFILE_FIELDS
+    if unknown:
+        raise ValueError(f"Неизвестные поля профиля: {', '.join(sorted(unknown))}")
+    
+    columns = list(fields) + [k for k in increments if k not in fields]
+    values = [fields.get(k, increments.get(k)) for k in columns]
+    updates = [f"{k} = excluded.{k}" for k in fields]
+    updates += [f"{k} = COALESCE({k}, 0) + excluded.{k}" for k in increments if k not in fields]
+    
+    if not updates:
+        return ("INSERT OR IGNORE INTO user_profiles (user_id) VALUES (?)", (user_id,))
+    query = (
+        f"INSERT INTO user_profiles (user_id, {', '.join(columns)}) VALUES ({', '.join('?' * (len(columns) + 1))}) "
+        f"ON CONFLICT(user_id) DO UPDATE SET {', '.join(updates)}"
+    )
+    return (query, (user_id, *values))
+
+
+async def _create_profiles(db):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            name TEXT,
+            profile TEXT DEFAULT '',
+            mood INTEGER DEFAULT 0,
+            relationship INTEGER DEFAULT 0,
+            last_seen INTEGER DEFAULT 0,
+            last_updated INTEGER DEFAULT 0,
+            topics TEXT DEFAULT '',
+            dates TEXT DEFAULT '',
+            message_count INTEGER DEFAULT 0
+        )
+    """)
+    await add_columns(db, "user_profiles", {
+        "mood": "INTEGER DEFAULT 0",
+        "last_seen": "INTEGER DEFAULT 0",
+        "relationship": "INTEGER DEFAULT 0",
+        "topics": "TEXT DEFAULT ''",
+        "dates": "TEXT DEFAULT ''",
+        "message_count": "INTEGER DEFAULT 0"
+    })
+
+
+MIGRATIONS = [
+    _create_profiles,
+]
+
+
+def _merge_seen(a: tuple, b: tuple) -> tuple:
+    return (max(a[0], b[0]), b[1] or a[1], b[2] or a[2])
+
+
 class UserDB:
-    def __init__(self, db: SQLite):
+    def __init__(self, db: SQLite, write_interval: float = 0.5, write_max_rows: int = 100,
+                 cache_size: int = 1000, cache_ttl: float = 300):
         self.db = db
-
-    async def init_table(self):
-        await self.db.execute("""
-            CREATE TABLE IF NOT EXISTS user_profiles (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                name TEXT,
-                profile TEXT DEFAULT '',
-                mood INTEGER DEFAULT 0,
-                relationship INTEGER DEFAULT 0,
-                last_seen INTEGER DEFAULT 0,
-                last_updated INTEGER DEFAULT 0
-            )
-        """)
-        
-        for col, default in [("mood", 0), ("last_seen", 0), ("relationship", 0)]:
-            try:
-                await self.db.execute(f"ALTER TABLE user_profiles ADD COLUMN {col} INTEGER DEFAULT {default}")
-            except:
-                pass
+        self.writes = WriteBuffer(self._write_batch, write_interval, write_max_rows)
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._profiles = OrderedDict()
+        self._version = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _invalidate(self, *user_ids):
+        self._version += 1
+        if not user_ids:
+            self._profiles.clear()
+        for user_id in user_ids:
+            self._profiles.pop(user_id, None)
+
+    async def _cached_profile(self, user_id: int) -> Optional[dict]:
+        item = self._profiles.get(user_id)
+        if item and item[0] > time.monotonic():
+            self._profiles.move_to_end(user_id)
+            self.cache_hits += 1
+            return dict(item[1]) if item[1] else None
         
-        try:
-            await self.db.execute("ALTER TABLE user_profiles ADD COLUMN topics TEXT DEFAULT ''")
-        except:
-            pass
+        self.cache_misses += 1
+        version = self._version
+        profile = await self.db.fetchone("SELECT * FROM user_profiles WHERE user_id = ?", (user_id,))
+        # Если пока читали, кто-то записал — кладём в кэш только то, что точно актуально
+        if self.cache_size > 0 and version == self._version:
+            self._profiles[user_id] = (time.monotonic() + self.cache_ttl, profile)
+            self._profiles.move_to_end(user_id)
+            while len(self._profiles) > self.cache_size:
+                self._profiles.popitem(last=False)
+        return dict(profile) if profile else None
+
+    def get_cache_stats(self) -> dict:
+        total = self.cache_hits + self.cache_misses
+        return {
+            "size": len(self._profiles),
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "hit_rate": self.cache_hits / total if total else 0.0
+        }
+
+    async def _write_batch(self, ops: dict):
+        updates = {}
+        for (kind, user_id), value in ops.items():
+            fields, increments = updates.setdefault(user_id, ({}, {}))
+            if kind == "seen":
+                fields["last_seen"], fields["username"], fields["name"] = value
+            elif kind == "count":
+                increments["message_count"] = value
         
+        statements = []
+        for user_id, (fields, increments) in updates.items():
+            if fields:
+                statements.append(_upsert_statement(user_id, fields, increments))
+            else:
+                # Одни сообщения профиль не создают — считаем только тем, кто уже есть
+                statements.append((
+                    "UPDATE user_profiles SET message_count = COALESCE(message_count, 0) + ? WHERE user_id = ?",
+                    (increments["message_count"], user_id)
+                ))
         try:
-            await self.db.execute("ALTER TABLE user_profiles ADD COLUMN dates TEXT DEFAULT ''")
-        except:
-            pass
-        
+            await self.db.execute_batch(statements)
+        finally:
+            self._invalidate(*updates)
+
+    async def upsert(self, user_id: int, increments: dict = None, **fields):
         try:
-            await self.db.execute("ALTER TABLE user_profiles ADD COLUMN message_count INTEGER DEFAULT 0")
-        except:
-            pass
+            await self.db.execute(*_upsert_statement(user_id, fields, increments))
+        finally:
+            self._invalidate(user_id)
+
+    async def upsert_many(self, updates: list):
+        # [(user_id, fields), ...] или [(user_id, fields, increments), ...] — одной транзакцией
+        if updates:
+            try:
+                await self.db.execute_batch([_upsert_statement(*update) for update in updates])
+            finally:
+                self._invalidate(*(update[0] for update in updates))
+
+    async def close(self):
+        await self.writes.close()
+
+    async def init_table(self):
+        await self.db.migrate("user_profiles", MIGRATIONS)
 
     async def get_profile(self, user_id: int) -> Optional[dict]:
-        return await self.db.fetchone(
-            "SELECT * FROM user_profiles WHERE user_id = ?",
-            (user_id,)
-        )
+        profile = await self._cached_profile(user_id)
+        pending = {
+            key[0]: value
+            for key, value in self.writes.pending("seen", inflight=False) + self.writes.pending("count", inflight=False)
+            if key[1] == user_id
+        }
+        if not pending:
+            return profile
+        if not profile:
+            # Новый пользователь ещё в буфере — записываем сразу, чтобы не собирать профиль вручную
+            await self.writes.flush()
+            return await self._cached_profile(user_id)
+        
+        if "seen" in pending:
+            now, username, name = pending["seen"]
+            profile["last_seen"] = max(profile.get("last_seen") or 0, now)
+            profile["username"] = username or profile.get("username")
+            profile["name"] = name or profile.get("name")
+        if "count" in pending:
+            profile["message_count"] = (profile.get("message_count") or 0) + pending["count"]
+        return profile
 
     async def update_profile(self, user_id: int, profile: str, username: str = None, name: str = None):
-        existing = await self.get_profile(user_id)
-        now = int(time.time())
-        
-        if existing:
-            await self.db.execute(
-                "UPDATE user_profiles SET profile = ?, username = COALESCE(?, username), name = COALESCE(?, name), last_updated = ? WHERE user_id = ?",
-                (profile, username, name, now, user_id)
-            )
-        else:
-            await self.db.execute(
-                "INSERT INTO user_profiles (user_id, username, name, profile, last_updated) VALUES (?, ?, ?, ?, ?)",
-                (user_id, username, name, profile, now)
-            )
+        await self.upsert(user_id, profile=profile, username=username, name=name, last_updated=int(time.time()))
 
     async def update_mood(self, user_id: int, mood: int):
-        existing = await self.get_profile(user_id)
-        if existing:
-            await self.db.execute("UPDATE user_profiles SET mood = ? WHERE user_id = ?", (mood, user_id))
-        else:
-            await self.db.execute("INSERT INTO user_profiles (user_id, mood) VALUES (?, ?)", (user_id, mood))
+        await self.upsert(user_id, mood=mood)
 
     async def update_relationship(self, user_id: int, level: int):
-        level = max(-5, min(7, level))
-        existing = await self.get_profile(user_id)
-        if existing:
-            await self.db.execute("UPDATE user_profiles SET relationship = ? WHERE user_id = ?", (level, user_id))
-        else:
-            await self.db.execute("INSERT INTO user_profiles (user_id, relationship) VALUES (?, ?)", (user_id, level))
+        await self.upsert(user_id, relationship=max(-5, min(7, level)))
 
     async def get_close_users(self, min_level: int = 4) -> List[dict]:
+        await self.writes.flush()
         return await self.db.fetchall(
             "SELECT * FROM user_profiles WHERE relationship >= ?",
             (min_level,)
         )
     
     async def get_all_profiles(self) -> List[dict]:
+        await self.writes.flush()
         return await self.db.fetchall("SELECT * FROM user_profiles", ())
 
     async def update_last_seen(self, user_id: int, username: str = None, name: str = None):
-        existing = await self.get_profile(user_id)
-        now = int(time.time())
-        if existing:
-            if username or name:
-                await self.db.execute(
-                    "UPDATE user_profiles SET last_seen = ?, username = COALESCE(?, username), name = COALESCE(?, name) WHERE user_id = ?",
-                    (now, username, name, user_id)
-                )
-            else:
-                await self.db.execute("UPDATE user_profiles SET last_seen = ? WHERE user_id = ?", (now, user_id))
-        else:
-            await self.db.execute(
-                "INSERT INTO user_profiles (user_id, last_seen, username, name) VALUES (?, ?, ?, ?)",
-                (user_id, now, username, name)
-            )
+        await self.writes.put(("seen", user_id), (int(time.time()), username, name), _merge_seen)
 
     async def increment_message_count(self, user_id: int):
-        existing = await self.get_profile(user_id)
-        if existing:
-            await self.db.execute("UPDATE user_profiles SET message_count = COALESCE(message_count, 0) + 1 WHERE user_id = ?", (user_id,))
+        await self.writes.put(("count", user_id), 1, lambda a, b: a + b)
 
     async def delete_profile(self, user_id: int):
+        await self.writes.flush()
         await self.db.execute("DELETE FROM user_profiles WHERE user_id = ?", (user_id,))
+        self._invalidate(user_id)
 
     async def delete_all_profiles(self) -> int:
+        await self.writes.flush()
         result = await self.db.fetchone("SELECT COUNT(*) as cnt FROM user_profiles")
         count = result['cnt'] if result else 0
         await self.db.execute("DELETE FROM user_profiles")
+        self._invalidate()
         return count
 
     async def update_topics(self, user_id: int, topics: str):
-        existing = await self.get_profile(user_id)
-        if existing:
-            await self.db.execute("UPDATE user_profiles SET topics = ? WHERE user_id = ?", (topics, user_id))
-        else:
-            await self.db.execute("INSERT INTO user_profiles (user_id, topics) VALUES (?, ?)", (user_id, topics))
+        await self.upsert(user_id, topics=topics)
 
     async def update_dates(self, user_id: int, dates: str):
-        existing = await self.get_profile(user_id)
-        if existing:
-            await self.db.execute("UPDATE user_profiles SET dates = ? WHERE user_id = ?", (dates, user_id))
-        else:
-            await self.db.execute("INSERT INTO user_profiles (user_id, dates) VALUES (?, ?)", (user_id, dates))
+        await self.upsert(user_id, dates=dates)
 
     @staticmethod
     def get_relationship_info(level: int) -> tuple:
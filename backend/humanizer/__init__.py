@@ -2,4 +2,8 @@ from .mood import analyze_mood_ai, get_mood_prompt, update_mood
 from .context import get_time_context, get_pause_reaction, get_personal_event, get_voice_excuse, add_caps_emotion, remove_self_mention
 from .text import maybe_split_message, add_typo, get_short_response, should_short_response
 from .reminders import parse_reminder_time, get_send_timestamp, format_time_msk, get_msk_now, needs_ai_parsing, parse_reminder_ai
+from .triage import triage_message
+from .batching import RespondBatcher
+from .scheduler import ReminderScheduler
+from .summary import summarize_dialog
 from .groups import should_respond_quick, should_respond_ai, get_group_system_prompt, parse_rules_response, parse_staff_response, parse_rules_ai, parse_staff_ai, wait_for_bot_response, get_join_greeting
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import re
+from ..ai.limiter import PRIORITY_MODERATION
+from .groups import RESPOND_RULES, SKIP_CACHE_TTL, precheck_respond, format_context_lines, should_respond_ai
+
+
+def _parse_decisions(response: str, count: int) -> dict:
+    decisions = {}
+    match = re.search(r'\{.*\}', response, re.DOTALL)
+    if match:
+        try:
+            data = json.loads(match.group())
+            for key, value in data.items():
+                decisions[int(key)] = value is True or str(value).lower().strip() in ("да", "yes", "true")
+        except (ValueError, AttributeError):
+            decisions = {}
+    if not decisions:
+        for num, answer in re.findall(r'(\d+)\s*[:\-.)]\s*(да|нет|yes|no)', response.lower()):
+            decisions[int(num)] = answer in ("да", "yes")
+    return {k: v for k, v in decisions.items() if 1 <= k <= count}
+
+
+class RespondBatcher:
+    def __init__(self, window: float = 0.4, max_batch: int = 8):
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self._pending = []
+        self._timer = None
+        self._inflight = 0
+        self.stats = {"batches": 0, "messages": 0, "fallbacks": 0}
+
+    async def decide(self, ai_client, models: list, text: str, context: list, my_username: str,
+                     sender_username: str = None, chat_id: int = 0) -> tuple:
+        if not models or not ai_client:
+            return (False, None)
+
+        skip, reason = precheck_respond(text, context, my_username, sender_username)
+        if skip:
+            return (False, reason)
+
+        skip_key = ai_client.cache.make_key("skip", chat_id, text[:50])
+        if chat_id and await ai_client.cache.get(skip_key):
+            return (False, "cached_skip")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append({
+            "ai_client": ai_client,
+            "models": models,
+            "text": text,
+            "context": context,
+            "my_username": my_username,
+            "sender_username": sender_username,
+            "chat_id": chat_id,
+            "skip_key": skip_key,
+            "future": future
+        })
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            # Пока ни один запрос не летит, ждать окно незачем: забираем только то, что пришло в этот же тик
+            self._timer = loop.call_later(self.window if self._inflight else 0, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            self._inflight += 1
+            asyncio.create_task(self._run(batch))
+
+    async def _single(self, item: dict):
+        # Кулдаун чата срезал бы серию сообщений, ради которой батчер и нужен; кэш пропусков по чату остаётся
+        return await should_respond_ai(
+            item["ai_client"], item["models"], item["text"], item["context"],
+            item["my_username"], item["sender_username"], item["chat_id"], cooldown=False
+        )
+
+    async def _run(self, batch: list):
+        try:
+            if len(batch) == 1:
+                results = [await self._single(batch[0])]
+            else:
+                results = await self._run_batch(batch)
+        except Exception as e:
+            print(f"[BATCH] Ошибка: {e}")
+            results = [(False, None)] * len(batch)
+        finally:
+            self._inflight -= 1
+
+        for item, result in zip(batch, results):
+            if result[0] is False and result[1] in ("ai_skip", "batch_skip") and item["chat_id"]:
+                await item["ai_client"].cache.set(item["skip_key"], True, SKIP_CACHE_TTL)
+            if not item["future"].done():
+                item["future"].set_result(result)
+
+    async def _run_batch(self, batch: list) -> list:
+        ai_client = batch[0]["ai_client"]
+        models = batch[0]["models"]
+
+        blocks = []
+        for i, item in enumerate(batch, 1):
+            context_text = "\n".join(format_context_lines(item["context"], item["my_username"], limit=8))
+            clean_text = item["text"].replace('\n', ' ')[:150]
+            blocks.append(
+                f"=== СООБЩЕНИЕ {i} ===\nКОНТЕКСТ ЧАТА:\n{context_text}\n"
+                f"НОВОЕ СООБЩЕНИЕ от {item['sender_username'] or 'user'}: \"{clean_text}\""
+            )
+
+        prompt = "\n\n".join(blocks) + f"""
+
+Для КАЖДОГО сообщения реши, отвечать ли мне.
+
+{RESPOND_RULES}
+
+ОТВЕТ — JSON вида {{"1": "да", "2": "нет", ...}} для всех {len(batch)} сообщений:"""
+
+        self.stats["batches"] += 1
+        self.stats["messages"] += len(batch)
+        print(f"[BATCH] {len(batch)} сообщений в одном запросе")
+
+        decisions = {}
+        for model in ai_client.router.order(models, "respond"):
+            result = await ai_client.chat(model, [
+                {"role": "system", "content": "Ты анализируешь нужно ли отвечать на сообщения из групповых чатов. [Я] = твои сообщения. Отвечай только JSON."},
+                {"role": "user", "content": prompt}
+            ], retries=2, max_tokens=20 + 10 * len(batch), priority=PRIORITY_MODERATION)
+            if result.get("finish_reason") == "error":
+                continue
+            decisions = _parse_decisions(result.get("content") or "", len(batch))
+            if decisions:
+                break
+
+        results = []
+        missing = []
+        for i, item in enumerate(batch, 1):
+            if i in decisions:
+                results.append((True, "batch_decision") if decisions[i] else (False, "batch_skip"))
+            else:
+                results.append(None)
+                missing.append(i - 1)
+
+        if missing:
+            self.stats["fallbacks"] += len(missing)
+            print(f"[BATCH] Нет решения для {len(missing)} сообщений, спрашиваю по отдельности")
+            singles = await asyncio.gather(*(self._single(batch[i]) for i in missing))
+            for i, result in zip(missing, singles):
+                results[i] = result
+
+        return results
+
+    def get_stats(self) -> dict:
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "avg_batch": self.stats["messages"] / batches if batches else 0.0,
+            "pending": len(self._pending),
+            "inflight": self._inflight
+        }
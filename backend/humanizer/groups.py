@@ -2,12 +2,24 @@ import re
 import asyncio
 import random
 import time
+from ..ai.limiter import PRIORITY_BACKGROUND
 
-chat_model_index = 0
-chat_model_lock = asyncio.Lock()
-_skip_cache = {}
 _last_ai_call = {}
 AI_COOLDOWN = 3
+SKIP_CACHE_TTL = 60
+DECISION_CACHE_TTL = 300
+
+RESPOND_RULES = """ОТВЕЧАЮ ТОЛЬКО ЕСЛИ:
+- Меня НАПРЯМУЮ зовут по имени (Хоно/Hono) или тегают
+- Вопрос/просьба АДРЕСОВАНЫ МНЕ лично
+- Отвечают НАПРЯМУЮ на моё сообщение и ждут продолжения
+
+НЕ ОТВЕЧАЮ:
+- Люди общаются между собой (даже если задают вопросы друг другу)
+- Обсуждение где я не участник
+- Меня не звали и не спрашивали
+
+Это обычный чат. Если меня не позвали - я молчу."""
 
 
 def _should_skip_fast(text: str, context: list, my_username: str) -> tuple:
@@ -54,8 +66,38 @@ def should_respond_quick(text: str, my_username: str, my_id: int, reply_to_me: b
     return (None, None)
 
 
-async def should_respond_ai(ai_client, models: list, text: str, context: list, my_username: str, sender_username: str = None, chat_id: int = 0) -> tuple:
-    global chat_model_index, _skip_cache, _last_ai_call
+def format_context_lines(context: list, my_username: str, limit: int = 12) -> list:
+    lines = []
+    for m in (context or [])[-limit:]:
+        username = m.get('username')
+        if not username or username == 'None':
+            username = f"user_{m.get('user_id', '?')}"
+        username = str(username)
+        msg = m.get('message', '').replace('\n', ' ')[:100]
+        if my_username and username.lower() == my_username.lower():
+            lines.append(f"[Я]: {msg}")
+        else:
+            lines.append(f"[{username}]: {msg}")
+    return lines
+
+
+def precheck_respond(text: str, context: list, my_username: str, sender_username: str = None) -> tuple:
+    if sender_username and my_username and sender_username.lower() == my_username.lower():
+        return (True, "self_message")
+    
+    skip, reason = _should_skip_fast(text, context, my_username)
+    if skip:
+        return (True, reason)
+    
+    recent = format_context_lines(context, my_username)[-5:]
+    if sum(1 for line in recent if line.startswith("[Я]:")) >= 2:
+        return (True, "spam_prevention")
+    
+    return (False, None)
+
+
+async def should_respond_ai(ai_client, models: list, text: str, context: list, my_username: str, sender_username: str = None, chat_id: int = 0, cooldown: bool = True) -> tuple:
+    global _last_ai_call
     
     if not models or not ai_client:
         return (False, None)
@@ -67,44 +109,21 @@ async def should_respond_ai(ai_client, models: list, text: str, context: list, m
     if skip:
         return (False, reason)
     
+    cache = ai_client.cache
+    skip_key = cache.make_key("skip", chat_id, text[:50])
     now = time.time()
     if chat_id:
-        last_call = _last_ai_call.get(chat_id, 0)
-        if now - last_call < AI_COOLDOWN:
-            return (False, "cooldown")
-        _last_ai_call[chat_id] = now
+        if cooldown:
+            last_call = _last_ai_call.get(chat_id, 0)
+            if now - last_call < AI_COOLDOWN:
+                return (False, "cooldown")
+            _last_ai_call[chat_id] = now
         
-        cache_key = f"{chat_id}_{hash(text[:50])}"
-        cached = _skip_cache.get(cache_key)
-        if cached and now - cached < 60:
+        if await cache.get(skip_key):
             return (False, "cached_skip")
     
-    async with chat_model_lock:
-        model = models[chat_model_index % len(models)]
-        chat_model_index += 1
-    
-    context_lines = []
-    hono_spoke_last = False
-    hono_was_in_chat = False
-    last_hono_idx = -1
-    
-    if context:
-        recent = context[-12:]
-        for i, m in enumerate(recent):
-            username = m.get('username')
-            if not username or username == 'None':
-                username = f"user_{m.get('user_id', '?')}"
-            username = str(username)
-            msg = m.get('message', '').replace('\n', ' ')[:100]
-            is_hono = username and my_username and username.lower() == my_username.lower()
-            if is_hono:
-                context_lines.append(f"[Я]: {msg}")
-                hono_was_in_chat = True
-                last_hono_idx = i
-                if i == len(recent) - 1:
-                    hono_spoke_last = True
-            else:
-                context_lines.append(f"[{username}]: {msg}")
+    context_lines = format_context_lines(context, my_username)
+    last_hono_idx = max((i for i, line in enumerate(context_lines) if line.startswith("[Я]:")), default=-1)
     
     context_text = "\n".join(context_lines)
     clean_text = text.replace('\n', ' ')[:150]
@@ -127,98 +146,76 @@ async def should_respond_ai(ai_client, models: list, text: str, context: list, m
 
 НОВОЕ СООБЩЕНИЕ от {sender_username or 'user'}: "{clean_text}"
 
-ОТВЕЧАЮ ТОЛЬКО ЕСЛИ:
-- Меня НАПРЯМУЮ зовут по имени (Хоно/Hono) или тегают
-- Вопрос/просьба АДРЕСОВАНЫ МНЕ лично
-- Отвечают НАПРЯМУЮ на моё сообщение и ждут продолжения
-
-НЕ ОТВЕЧАЮ:
-- Люди общаются между собой (даже если задают вопросы друг другу)
-- Обсуждение где я не участник
-- Меня не звали и не спрашивали
-
-Это обычный чат. Если меня не позвали - я молчу.
+{RESPOND_RULES}
 
 ОТВЕТ (да/нет):"""
 
+    decision_key = cache.make_key("should_respond", system_prompt, prompt)
+    cached = await cache.get(decision_key)
+    if cached:
+        print(f"[CHAT AI] Решение из кэша: {cached[1]}")
+        return tuple(cached)
+
     print(f"[CHAT AI] Контекст ({len(context)} сообщ.):")
     for line in context_text.split('\n')[-6:]:
         print(f"  {line[:120]}")
     print(f"[CHAT AI] Сообщение: {clean_text[:150]}")
     
     response = ""
-    attempt = 0
-    max_attempts = 50
-    current_model_idx = chat_model_index - 1
+    policy = ai_client.retry_policy
+    started = time.monotonic()
+    ordered = ai_client.router.order(models, "respond")
+    current_model_idx = 0
     
-    while attempt < max_attempts:
-        current_model = models[current_model_idx % len(models)]
+    for attempt in range(policy.max_attempts):
+        current_model = ordered[current_model_idx % len(ordered)]
         print(f"[CHAT AI] Модель: {current_model}, попытка {attempt + 1}")
         
-        try:
-            result = await ai_client.chat(current_model, [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ], retries=1, max_tokens=50)
-            
-            print(f"[CHAT AI] RAW результат: {repr(result)[:200]}")
-            
-            if isinstance(result, dict):
-                response = result.get("content", "")
-                if not response:
-                    print(f"[CHAT AI] ОШИБКА: content пустой в dict!")
-                    attempt += 1
-                    current_model_idx += 1
-                    await asyncio.sleep(1)
-                    continue
-                response = response.lower().strip()
-            else:
-                response = str(result).lower().strip()
-            
-            if "prohibited_content" in response or "prohibited content" in response:
-                print(f"[CHAT AI] PROHIBITED_CONTENT, пропускаю сообщение")
-                return (False, "prohibited")
-            
-            if "rate limit" in response or "ошибка" in response or "error" in response:
-                print(f"[CHAT AI] Rate limit в ответе, меняю модель...")
-                current_model_idx += 1
-                await asyncio.sleep(2)
-                continue
-            
-            if response and len(response) > 0:
-                break
-                
-            print(f"[CHAT AI] Пустой ответ: '{response}', меняю модель...")
-            attempt += 1
-            current_model_idx += 1
-            await asyncio.sleep(1)
-                
-        except Exception as e:
-            error_str = str(e).lower()
-            print(f"[CHAT AI] EXCEPTION: {e}")
-            
-            if "rate limit" in error_str:
-                print(f"[CHAT AI] Rate limit exception, жду 3 сек и меняю модель...")
-                current_model_idx += 1
-                await asyncio.sleep(3)
+        result = await ai_client.chat(current_model, [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ], retries=1, max_tokens=50)
+        
+        print(f"[CHAT AI] RAW результат: {repr(result)[:200]}")
+        
+        if result.get("finish_reason") == "error":
+            print(f"[CHAT AI] Ошибка API ({result.get('error_code')}), меняю модель...")
+            if not policy.is_retryable(result.get("error_code")):
+                # Этот запрос модель не примет и после паузы — убираем её и сразу пробуем следующую
+                current_model_idx = ordered.index(current_model)
+                ordered.remove(current_model)
+                if not ordered:
+                    break
                 continue
-            
-            attempt += 1
             current_model_idx += 1
-            await asyncio.sleep(1)
+            if not await policy.wait(attempt, started, result.get("retry_after")):
+                break
+            continue
+        
+        response = (result.get("content") or "").lower().strip()
+        
+        if "prohibited_content" in response or "prohibited content" in response:
+            print(f"[CHAT AI] PROHIBITED_CONTENT, пропускаю сообщение")
+            return (False, "prohibited")
+        
+        if response:
+            break
+        
+        print(f"[CHAT AI] Пустой ответ, меняю модель...")
+        current_model_idx += 1
+        if not await policy.wait(attempt, started):
+            break
     
     print(f"[CHAT AI] Ответ: {response}")
     
     if "да" in response or response == "yes":
+        await cache.set(decision_key, [True, "ai_decision"], DECISION_CACHE_TTL)
         return (True, "ai_decision")
     
+    if response:
+        await cache.set(decision_key, [False, "ai_skip"], DECISION_CACHE_TTL)
     if chat_id:
-        cache_key = f"{chat_id}_{hash(text[:50])}"
-        _skip_cache[cache_key] = time.time()
-        if len(_skip_cache) > 1000:
-            old_keys = [k for k, v in _skip_cache.items() if time.time() - v > 300]
-            for k in old_keys:
-                _skip_cache.pop(k, None)
+        await cache.set(skip_key, True, SKIP_CACHE_TTL)
     
     return (False, "ai_skip")
 
@@ -272,7 +269,7 @@ async def parse_rules_ai(ai_client, model: str, text: str) -> str:
         check = await ai_client.chat(model, [
             {"role": "system", "content": "Отвечай только да или нет"},
             {"role": "user", "content": check_prompt}
-        ], retries=2, max_tokens=10)
+        ], retries=2, max_tokens=10, priority=PRIORITY_BACKGROUND, cache_ttl=86400)
         
         check_response = check.get("content", "").lower().strip() if isinstance(check, dict) else str(check).lower().strip()
         
@@ -300,7 +297,7 @@ async def parse_rules_ai(ai_client, model: str, text: str) -> str:
         result = await ai_client.chat(model, [
             {"role": "system", "content": "Преобразуй правила в список. Формат: 1. Правило - наказание"},
             {"role": "user", "content": normalize_prompt}
-        ], retries=3, max_tokens=500)
+        ], retries=3, max_tokens=500, priority=PRIORITY_BACKGROUND)
         
         response = result.get("content", "") if isinstance(result, dict) else str(result)
         
@@ -328,7 +325,7 @@ async def parse_staff_ai(ai_client, model: str, text: str) -> str:
         result = await ai_client.chat(model, [
             {"role": "system", "content": "Определи это список стаффа или нет. Отвечай только 'да' или 'нет'."},
             {"role": "user", "content": prompt}
-        ], retries=2, max_tokens=10)
+        ], retries=2, max_tokens=10, priority=PRIORITY_BACKGROUND)
         
         response = result.get("content", "").lower().strip() if isinstance(result, dict) else str(result).lower().strip()
         
@@ -1,5 +1,6 @@
 import asyncio
 from typing import Optional, Dict, List
+from ..ai.limiter import PRIORITY_BACKGROUND
 
 LESSON_CATEGORIES = {
     "mistake": "Ошибка - не делай так",
@@ -48,7 +49,7 @@ trigger: ключевые слова когда применять
         result = await ai_client.chat(model, [
             {"role": "system", "content": "Извлекай уроки из взаимодействий. Будь кратким."},
             {"role": "user", "content": prompt}
-        ], retries=2, max_tokens=100)
+        ], retries=2, max_tokens=100, priority=PRIORITY_BACKGROUND)
         
         response = result.get("content", "") if isinstance(result, dict) else str(result)
         
@@ -1,6 +1,7 @@
 import re
 import asyncio
 from typing import Optional, Tuple
+from ..ai.limiter import PRIORITY_MODERATION
 
 mod_analysis_lock = asyncio.Lock()
 
@@ -51,7 +52,7 @@ async def check_promotion(
         result = await ai_client.chat(model, [
             {"role": "system", "content": "Отвечай кратко: нет или да X"},
             {"role": "user", "content": prompt}
-        ], retries=2, max_tokens=20)
+        ], retries=2, max_tokens=20, priority=PRIORITY_MODERATION, cache_ttl=3600)
         
         response = result.get("content", "").lower().strip() if isinstance(result, dict) else str(result).lower().strip()
         
@@ -79,23 +80,15 @@ async def analyze_violation(
     mod_level: int,
     reply_context: dict = None
 ) -> dict:
-    if sender_role in ['owner', 'admin']:
-        return {'action': 'none', 'reason': '', 'confidence': 0}
-    
-    if mod_level == 0:
-        return {'action': 'none', 'reason': '', 'confidence': 0}
-    
-    if len(message_text.strip()) < 10:
+    if not needs_violation_check(message_text, sender_role, mod_level, reply_context):
         return {'action': 'none', 'reason': '', 'confidence': 0}
     
     rules_text = rules[:800] if rules else "Нет правил"
     
     reply_info = ""
     if reply_context:
-        reply_from = "бота" if reply_context.get("is_me") else reply_context.get('from', 'user')
+        reply_from = reply_context.get('from', 'user')
         reply_info = f" (ответ на сообщение {reply_from})"
-        if reply_context.get("is_me"):
-            return {'action': 'none', 'reason': '', 'confidence': 0}
     
     prompt = f"""**Задача**: Проверить сообщение на нарушение правил чата.
 Если нарушение не явное или есть сомнения - нарушения нету!
@@ -120,7 +113,7 @@ async def analyze_violation(
         result = await ai_client.chat(model, [
             {"role": "system", "content": "Отвечай ТОЛЬКО валидным JSON. При любых сомнениях is_violation: false"},
             {"role": "user", "content": prompt}
-        ], retries=3, max_tokens=150)
+        ], retries=3, max_tokens=150, priority=PRIORITY_MODERATION)
         
         response = result.get("content", "") if isinstance(result, dict) else str(result)
         print(f"[MOD AI] {response[:200]}")
@@ -135,7 +128,28 @@ async def analyze_violation(
         except:
             return {'action': 'none', 'reason': '', 'confidence': 0, 'duration': ''}
         
-        if not data.get('is_violation', False):
+        return build_violation(data, mod_level)
+        
+    except Exception as e:
+        print(f"[MODERATION] Ошибка: {e}")
+        return {'action': 'none', 'reason': '', 'confidence': 0, 'duration': ''}
+
+
+def needs_violation_check(message_text: str, sender_role: str, mod_level: int, reply_context: dict = None) -> bool:
+    if sender_role in ['owner', 'admin']:
+        return False
+    if mod_level == 0:
+        return False
+    if len(message_text.strip()) < 10:
+        return False
+    if reply_context and reply_context.get("is_me"):
+        return False
+    return True
+
+
+def build_violation(data: dict, mod_level: int) -> dict:
+    try:
+        if not data or not data.get('is_violation', False):
             return {'action': 'none', 'reason': '', 'confidence': 0, 'duration': ''}
         
         punishment = data.get('punishment') or {}
@@ -172,9 +186,8 @@ async def analyze_violation(
             'duration': duration,
             'rule_number': rule_num
         }
-        
     except Exception as e:
-        print(f"[MODERATION] Ошибка: {e}")
+        print(f"[MODERATION] Ошибка разбора вердикта: {e}")
         return {'action': 'none', 'reason': '', 'confidence': 0, 'duration': ''}
 
 
@@ -264,7 +277,8 @@ async def process_moderation(
     group_id: int,
     group_db,
     context: list,
-    reply_context: dict = None
+    reply_context: dict = None,
+    violation: dict = None
 ) -> Optional[str]:
     async with mod_analysis_lock:
         mod_info = await group_db.get_mod_info(group_id)
@@ -287,18 +301,19 @@ async def process_moderation(
         
         warnings_count = await group_db.get_warnings_count(group_id, sender_id)
         
-        violation = await analyze_violation(
-            ai_client,
-            analyze_model,
-            message_text,
-            sender_name,
-            sender_role,
-            context,
-            rules,
-            warnings_count,
-            mod_level,
-            reply_context
-        )
+        if violation is None:
+            violation = await analyze_violation(
+                ai_client,
+                analyze_model,
+                message_text,
+                sender_name,
+                sender_role,
+                context,
+                rules,
+                warnings_count,
+                mod_level,
+                reply_context
+            )
         
         print(f"[MOD] Violation: {violation}")
         
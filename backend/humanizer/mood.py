@@ -1,3 +1,5 @@
+from ..ai.limiter import PRIORITY_BACKGROUND
+
 MOOD_DESCRIPTIONS = {
     -2: "раздражена, отвечает резко и коротко, может послать",
     -1: "немного недовольна, сдержанна, отвечает сухо",
@@ -30,7 +32,7 @@ async def analyze_mood_ai(ai_client, model: str, message: str) -> int:
             {"role": "system", "content": "Ты анализатор настроения. Отвечай только числом."},
             {"role": "user", "content": prompt}
         ]
-        result = await ai_client.chat(model, messages, retries=5, max_tokens=2000)
+        result = await ai_client.chat(model, messages, retries=5, max_tokens=2000, priority=PRIORITY_BACKGROUND, cache_ttl=3600)
         response = result.get("content", "0") if isinstance(result, dict) else str(result)
         
         response = response.strip().replace("+", "")
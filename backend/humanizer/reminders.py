@@ -1,6 +1,7 @@
 from datetime import datetime, timedelta
 import pytz
 import re
+from ..ai.limiter import PRIORITY_BACKGROUND
 
 MSK = pytz.timezone('Europe/Moscow')
 
@@ -89,7 +90,7 @@ async def parse_reminder_ai(ai_client, model: str, message: str) -> tuple[int, s
         now = get_msk_now()
         prompt = PARSE_PROMPT.format(message=message[:150], current_time=now.strftime('%H:%M'))
         
-        result = await ai_client.chat(model, [{"role": "user", "content": prompt}], retries=1, max_tokens=10)
+        result = await ai_client.chat(model, [{"role": "user", "content": prompt}], retries=1, max_tokens=10, priority=PRIORITY_BACKGROUND)
         response = result.get("content", "").strip() if isinstance(result, dict) else str(result).strip()
         
         if not response or "НЕТ" in response.upper():
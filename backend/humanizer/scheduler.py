@@ -0,0 +1,157 @@
+import asyncio
+import heapq
+import time
+
+# Через сколько повторить подготовку, если все её слоты заняты
+PREPARE_RETRY = 5
+
+
+class ReminderScheduler:
+    def __init__(self, reminder_db, dispatch, prepare=None, lead_time: float = 120, concurrency: int = 4, preload: int = 200):
+        self.reminder_db = reminder_db
+        self.dispatch = dispatch
+        # prepare(reminder) -> текст: дорогая часть (вызов модели) уходит на lead_time раньше срока
+        self.prepare = prepare
+        self.lead_time = max(0.0, lead_time)
+        self.preload = max(1, preload)
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        # Подготовки считаем отдельно: медленные вызовы модели не должны занимать слоты наступивших отправок
+        self.prepare_concurrency = max(1, concurrency // 2)
+        self._preparing = 0
+        self._heap = []
+        self._queued = set()
+        # id, которые уже отправляются: их нельзя снова класть в кучу при перезагрузке из базы
+        self._sending = set()
+        # send_at последнего загруженного, если в базе осталось ещё; None — в памяти всё
+        self._horizon = 0
+        self._wake = asyncio.Event()
+        self._task = None
+        self._running = set()
+        self.stats = {"sent": 0, "failed": 0, "skipped": 0, "lateness": 0.0, "prepared": 0, "ready": 0}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            self.reminder_db.listeners.append(self.push)
+
+    def push(self, reminder: dict):
+        if reminder["id"] in self._queued or reminder["id"] in self._sending:
+            return
+        if self._horizon is not None and reminder["send_at"] > self._horizon:
+            return
+        heapq.heappush(self._heap, (reminder["send_at"], reminder["id"], "send", reminder))
+        # Срок подготовки уже прошёл — отправка наступит вместе с ней и сама сгенерирует текст, второй вызов модели не нужен
+        if self.prepare and not reminder.get("text") and reminder["send_at"] - self.lead_time > time.time():
+            heapq.heappush(self._heap, (reminder["send_at"] - self.lead_time, reminder["id"], "prepare", reminder))
+        self._queued.add(reminder["id"])
+        if self._heap[0][1] == reminder["id"]:
+            self._wake.set()
+
+    async def _load(self):
+        initial = self._horizon == 0
+        upcoming = await self.reminder_db.get_upcoming(self.preload)
+        self._horizon = upcoming[-1]["send_at"] if len(upcoming) >= self.preload else None
+        for reminder in upcoming:
+            self.push(reminder)
+        if initial and self._queued:
+            print(f"[REMIND] В очереди {len(self._queued)}, ближайшее через {max(0, self._next_send() - time.time()):.0f}с")
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            while self._heap and self._heap[0][0] <= time.time():
+                at, reminder_id, kind, reminder = heapq.heappop(self._heap)
+                if kind == "send":
+                    # Слот берём до создания задачи: при всплеске в памяти не больше concurrency задач
+                    await self._semaphore.acquire()
+                    self._queued.discard(reminder_id)
+                    self._sending.add(reminder_id)
+                    task = asyncio.create_task(self._fire(reminder))
+                    task.add_done_callback(self._done)
+                elif self._preparing < self.prepare_concurrency:
+                    self._preparing += 1
+                    task = asyncio.create_task(self._prepare(reminder))
+                    task.add_done_callback(self._prepare_done)
+                else:
+                    # Не успеем подготовить до срока — отправка сгенерирует текст сама
+                    if at + PREPARE_RETRY < reminder["send_at"]:
+                        heapq.heappush(self._heap, (at + PREPARE_RETRY, reminder_id, kind, reminder))
+                    continue
+                self._running.add(task)
+
+            # Догружаем только когда всё отправлено: иначе get_upcoming вернёт те же незаклейменные строки
+            if not self._heap and not self._running and self._horizon is not None:
+                try:
+                    await self._load()
+                except Exception as e:
+                    print(f"[REMIND] Ошибка загрузки: {e}")
+                    await asyncio.sleep(30)
+                continue
+
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _done(self, task):
+        self._running.discard(task)
+        self._semaphore.release()
+        self._wake.set()
+
+    def _prepare_done(self, task):
+        self._running.discard(task)
+        self._preparing -= 1
+        self._wake.set()
+
+    async def _prepare(self, reminder: dict):
+        if reminder.get("text"):
+            return
+        try:
+            text = await self.prepare(reminder)
+            if text and not reminder.get("text"):
+                reminder["text"] = text
+                await self.reminder_db.set_text(reminder["id"], text)
+                self.stats["prepared"] += 1
+        except Exception as e:
+            # Не страшно: dispatch сгенерирует текст сам в момент отправки
+            print(f"[REMIND] Ошибка подготовки #{reminder['id']}: {e}")
+
+    async def _fire(self, reminder: dict):
+        try:
+            if not await self.reminder_db.claim(reminder["id"]):
+                self.stats["skipped"] += 1
+                return
+            late = max(0.0, time.time() - reminder["send_at"])
+            self.stats["lateness"] = late if not self.stats["sent"] else 0.9 * self.stats["lateness"] + 0.1 * late
+            if reminder.get("text"):
+                self.stats["ready"] += 1
+            await self.dispatch(reminder)
+            self.stats["sent"] += 1
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"[REMIND] Ошибка отправки #{reminder['id']}: {e}")
+        finally:
+            self._sending.discard(reminder["id"])
+
+    def _next_send(self):
+        return min((at for at, _, kind, _ in self._heap if kind == "send"), default=None)
+
+    def get_stats(self) -> dict:
+        next_send = self._next_send()
+        return {
+            **self.stats,
+            "queued": len(self._queued),
+            "in_flight": len(self._running),
+            "next_in": max(0.0, next_send - time.time()) if next_send is not None else None
+        }
+
+    async def close(self):
+        if self.push in self.reminder_db.listeners:
+            self.reminder_db.listeners.remove(self.push)
+        # Клиенты и база закрываются следом — незаконченные отправки и подготовки гасим здесь, а не бросаем
+        tasks = list(self._running) + ([self._task] if self._task else [])
+        self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
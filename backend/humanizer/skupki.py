@@ -2,6 +2,7 @@ import re
 import hashlib
 import time
 from typing import Optional, Tuple
+from ..ai.limiter import PRIORITY_BACKGROUND
 
 SKUPKA_KEYWORDS = [
     'скуп', 'skup', 'продаж', 'покупа', 'куплю', 'продам',
@@ -181,7 +182,8 @@ async def parse_skupka_with_vision(client, ai_client, vision_model: str, message
         result = await ai_client.chat_with_image(
             vision_model,
             [{"role": "user", "content": "Прочитай текст на картинке. Напиши ТОЛЬКО текст, без описаний."}],
-            photo
+            photo,
+            priority=PRIORITY_BACKGROUND
         )
         
         return result if result and len(result) > 20 else None
@@ -0,0 +1,39 @@
+from ..ai.limiter import PRIORITY_BACKGROUND
+
+
+SUMMARY_PROMPT = """Ты ведёшь краткую сводку переписки Хоно с юзером. Обнови её с учётом новых реплик.
+
+{previous}НОВЫЕ РЕПЛИКИ:
+{dialog}
+
+ПРАВИЛА:
+- Сохраняй факты о юзере, договорённости, обещания, незакрытые вопросы и общий тон общения
+- Приветствия, мемы и повторы выбрасывай
+- Пиши от третьего лица, сжато, без списков
+- Не больше {words} слов
+
+Сводка:"""
+
+
+def format_dialog(messages: list, limit: int = 300) -> str:
+    lines = []
+    for m in messages:
+        role = "Юзер" if m["role"] == "user" else "Хоно"
+        lines.append(f"{role}: {m['content'][:limit]}")
+    return "\n".join(lines)
+
+
+async def summarize_dialog(ai_client, model: str, summary: str, messages: list, max_tokens: int = 200) -> str:
+    try:
+        previous = f"ТЕКУЩАЯ СВОДКА:\n{summary}\n\n" if summary else ""
+        prompt = SUMMARY_PROMPT.format(previous=previous, dialog=format_dialog(messages), words=max_tokens // 2)
+
+        result = await ai_client.chat(model, [{"role": "user", "content": prompt}], retries=2, max_tokens=max_tokens, priority=PRIORITY_BACKGROUND)
+        response = (result.get("content") or "").strip() if isinstance(result, dict) else str(result).strip()
+
+        if not response or response.startswith("Ошибка"):
+            return ""
+        return response
+    except Exception as e:
+        print(f"[SUMMARY] Ошибка: {e}")
+        return ""
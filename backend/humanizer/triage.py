@@ -0,0 +1,167 @@
+import json
+import re
+import time
+from typing import Optional
+from ..ai.limiter import PRIORITY_MODERATION
+from .groups import precheck_respond, format_context_lines
+from .moderation import needs_violation_check, build_violation
+
+TRIAGE_CACHE_TTL = 300
+
+# Модели, которые не смогли вернуть JSON — для них на время уходим на отдельные вызовы
+UNSTRUCTURED_TTL = 3600
+UNSTRUCTURED_AFTER = 3
+_unstructured_models = {}
+_json_failures = {}
+
+
+def _is_unstructured(model: str) -> bool:
+    until = _unstructured_models.get(model)
+    if until is None:
+        return False
+    if until > time.monotonic():
+        return True
+    del _unstructured_models[model]
+    return False
+
+
+def _mark_unstructured(model: str, reason: str):
+    _json_failures.pop(model, None)
+    _unstructured_models[model] = time.monotonic() + UNSTRUCTURED_TTL
+    print(f"[TRIAGE] {model}: {reason}, {UNSTRUCTURED_TTL // 60} мин без JSON-режима")
+
+
+def _build_prompt(text: str, context_lines: list, sender_username: str, ask_respond: bool,
+                  rules: str, reply_context: dict, emojis: list) -> str:
+    parts = []
+    if context_lines:
+        parts.append("КОНТЕКСТ ЧАТА ([Я] = мои сообщения):\n" + "\n".join(context_lines))
+
+    reply_info = ""
+    if reply_context:
+        reply_info = f" (ответ на сообщение {reply_context.get('from', 'user')})"
+    parts.append(f"НОВОЕ СООБЩЕНИЕ от {sender_username or 'user'}{reply_info}: \"{text.replace(chr(10), ' ')[:300]}\"")
+
+    fields = []
+    if ask_respond:
+        parts.append("""RESPOND — отвечать ли мне:
+- true ТОЛЬКО если меня напрямую зовут (Хоно/Hono), вопрос адресован мне или отвечают на моё сообщение и ждут продолжения
+- false если люди общаются между собой или меня не звали""")
+        fields.append('"respond": bool')
+
+    if rules:
+        parts.append(f"""VIOLATION — нарушает ли сообщение правила чата:
+{rules[:800]}
+- Вопросы ("кто скупает?", "есть чекер?") = НЕ нарушение
+- Одно слово без контекста = НЕ нарушение
+- Грубость = НЕ нарушение (если не в правилах явно)
+- Нужна 100% уверенность, при сомнениях is_violation: false""")
+        fields.append('"violation": {"is_violation": bool, "rule_number": int или null, "reason": "кратко", "punishment": {"type": "мут" или "бан", "duration_minutes": int} или null}')
+
+    parts.append("MOOD — как собеседник относится ко мне: -2 грубит, -1 холоден, 0 нейтрально, 1 дружелюбен, 2 очень мил")
+    fields.append('"mood": int')
+
+    if emojis:
+        emoji_list = "\n".join(f"#{i+1} {e['emoji']} — {e.get('description', '')}" for i, e in enumerate(emojis))
+        parts.append(f"REACTION — номер подходящей emoji-реакции или 0 если ничего не подходит:\n{emoji_list}")
+        fields.append('"reaction": int')
+
+    parts.append("ОТВЕТ — один JSON объект:\n{" + ", ".join(fields) + "}")
+    return "\n\n".join(parts)
+
+
+def _parse(response: str) -> Optional[dict]:
+    response = response.strip()
+    if response.startswith("```"):
+        response = re.sub(r'^```(?:json)?|```$', '', response).strip()
+    try:
+        data = json.loads(response)
+    except ValueError:
+        match = re.search(r'\{.*\}', response, re.DOTALL)
+        if not match:
+            return None
+        try:
+            data = json.loads(match.group())
+        except ValueError:
+            return None
+    return data if isinstance(data, dict) else None
+
+
+async def triage_message(ai_client, models: list, text: str, context: list, my_username: str,
+                         sender_username: str = None, sender_role: str = "", rules: str = None,
+                         mod_level: int = 0, reply_context: dict = None, emojis: list = None) -> Optional[dict]:
+    if not ai_client or not models:
+        return None
+    
+    model = next((m for m in ai_client.router.order(models, "triage") if not _is_unstructured(m)), None)
+    if not model:
+        return None
+
+    if sender_username and my_username and sender_username.lower() == my_username.lower():
+        return None
+
+    context_lines = format_context_lines(context, my_username)
+    skip, skip_reason = precheck_respond(text, context, my_username, sender_username)
+    moderate = bool(rules) and needs_violation_check(text, sender_role, mod_level, reply_context)
+
+    if skip and not moderate:
+        # Предфильтр уже решил не отвечать, а проверять нечего — модель не зовём
+        return {"respond": (False, skip_reason), "violation": None, "mood": 0, "reaction": None, "reaction_checked": False}
+    if skip:
+        # Реакцию ставим только когда отвечаем, спрашивать её незачем
+        emojis = None
+
+    prompt = _build_prompt(
+        text, context_lines, sender_username,
+        not skip, rules if moderate else None, reply_context, emojis
+    )
+
+    result = await ai_client.chat(model, [
+        {"role": "system", "content": "Ты классификатор сообщений группового чата. Отвечай ТОЛЬКО валидным JSON без пояснений."},
+        {"role": "user", "content": prompt}
+    ], retries=2, max_tokens=200, priority=PRIORITY_MODERATION, cache_ttl=TRIAGE_CACHE_TTL,
+        response_format={"type": "json_object"})
+
+    if result.get("finish_reason") == "error":
+        error = (result.get("content") or "").lower()
+        if result.get("error_code") == 400 and ("response_format" in error or "json" in error):
+            _mark_unstructured(model, "не поддерживает response_format")
+        return None
+
+    data = _parse(result.get("content") or "")
+    if data is None:
+        print(f"[TRIAGE] {model} вернула не JSON: {(result.get('content') or '')[:100]}")
+        _json_failures[model] = _json_failures.get(model, 0) + 1
+        if _json_failures[model] >= UNSTRUCTURED_AFTER:
+            _mark_unstructured(model, f"{UNSTRUCTURED_AFTER} ответа подряд не JSON")
+        return None
+    _json_failures.pop(model, None)
+
+    print(f"[TRIAGE] {json.dumps(data, ensure_ascii=False)[:200]}")
+
+    if skip:
+        respond = (False, skip_reason)
+    else:
+        respond = (True, "triage") if data.get("respond") is True else (False, "triage_skip")
+
+    try:
+        mood = max(-2, min(2, int(data.get("mood") or 0)))
+    except (TypeError, ValueError):
+        mood = 0
+
+    reaction = None
+    if emojis:
+        try:
+            idx = int(data.get("reaction") or 0) - 1
+        except (TypeError, ValueError):
+            idx = -1
+        if 0 <= idx < len(emojis):
+            reaction = emojis[idx]
+
+    return {
+        "respond": respond,
+        "violation": build_violation(data.get("violation"), mod_level) if moderate else None,
+        "mood": mood,
+        "reaction": reaction,
+        "reaction_checked": bool(emojis)
+    }
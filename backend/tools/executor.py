@@ -26,6 +26,7 @@ from telethon.errors import (
     MessageIdInvalidError,
     ReactionInvalidError
 )
+from ..ai.limiter import PRIORITY_INTERACTIVE
 
 recent_groups = {}
 known_dm_users = set()
@@ -673,17 +674,10 @@ async def unmute_user(client, username: str, group_link: str = "current", group_
         return {"success": False, "error": f"Ошибка: {e}"}
 
 
-_knowledge_cache = {}
+KNOWLEDGE_CACHE_TTL = 3600
 
 async def search_knowledge(client, query: str, ai_client=None, analyze_model=None, **kwargs) -> dict:
     import os
-    global _knowledge_cache
-    
-    cache_key = query.lower().strip()[:100]
-    if cache_key in _knowledge_cache:
-        cached = _knowledge_cache[cache_key]
-        if time.time() - cached['time'] < 3600:
-            return {**cached['result'], "cached": True}
     
     knowledge_path = "data/knowledge.txt"
     if not os.path.exists(knowledge_path):
@@ -698,6 +692,14 @@ async def search_knowledge(client, query: str, ai_client=None, analyze_model=Non
     if len(knowledge_text) < 50:
         return {"success": False, "error": "База знаний пустая"}
     
+    cache = ai_client.cache if ai_client else None
+    cache_key = None
+    if cache:
+        cache_key = cache.make_key("knowledge", query.lower().strip()[:100], knowledge_text)
+        cached = await cache.get(cache_key)
+        if cached:
+            return {**cached, "cached": True}
+    
     if not ai_client or not analyze_model:
         sections = knowledge_text.split("\n## ")
         query_lower = query.lower()
@@ -708,7 +710,8 @@ async def search_knowledge(client, query: str, ai_client=None, analyze_model=Non
         
         if relevant:
             result = {"success": True, "answer": "\n\n".join(relevant[:3]), "method": "keyword"}
-            _knowledge_cache[cache_key] = {'result': result, 'time': time.time()}
+            if cache:
+                await cache.set(cache_key, result, KNOWLEDGE_CACHE_TTL)
             return result
         return {"success": False, "error": "Ничего не найдено по запросу"}
     
@@ -730,18 +733,14 @@ async def search_knowledge(client, query: str, ai_client=None, analyze_model=Non
         result = await ai_client.chat(analyze_model, [
             {"role": "system", "content": "Ты точный поисковик по базе знаний. Находи КОНКРЕТНУЮ информацию, не путай похожие термины. Отвечай полно."},
             {"role": "user", "content": prompt}
-        ], retries=2, max_tokens=350)
+        ], retries=2, max_tokens=350, priority=PRIORITY_INTERACTIVE)
         
         response = result.get("content", "") if isinstance(result, dict) else str(result)
         
         if response:
             print(f"[KNOWLEDGE] Запрос: {query[:50]}, Ответ: {response[:100]}...")
             result = {"success": True, "answer": response, "method": "ai"}
-            _knowledge_cache[cache_key] = {'result': result, 'time': time.time()}
-            if len(_knowledge_cache) > 200:
-                old = sorted(_knowledge_cache.items(), key=lambda x: x[1]['time'])[:50]
-                for k, _ in old:
-                    _knowledge_cache.pop(k, None)
+            await cache.set(cache_key, result, KNOWLEDGE_CACHE_TTL)
             return result
         
         return {"success": False, "error": "AI не смог найти ответ"}
@@ -805,11 +804,14 @@ async def search_chat_history(client, query: str, group_link: str = "last", grou
     
     results = []
     for msg in messages:
-        results.append({
+        result = {
             "from": msg.get('username', 'user'),
             "text": msg.get('message', '')[:200],
             "time": msg.get('timestamp')
-        })
+        }
+        if msg.get('snippet') and len(msg.get('message', '')) > 200:
+            result["snippet"] = msg['snippet']
+        results.append(result)
     
     return {"success": True, "found": len(results), "messages": results}
 
@@ -973,7 +975,7 @@ async def analyze_tone(client, message: str, context: str = None, ai_client=None
         result = await ai_client.chat(analyze_model, [
             {"role": "system", "content": "Ты анализатор тона. Отвечай только JSON."},
             {"role": "user", "content": prompt}
-        ], max_tokens=150)
+        ], max_tokens=150, priority=PRIORITY_INTERACTIVE)
         
         import json
         content = result.get("content", "") if isinstance(result, dict) else str(result)
@@ -7,10 +7,11 @@ from telethon import TelegramClient, events, functions
 from telethon.errors import SessionPasswordNeededError
 from telethon.tl.types import MessageEntityCustomEmoji, MessageEntityBold, MessageEntityCode, SendMessageTypingAction, ReactionCustomEmoji, InputStickerSetID
 from telethon.tl.functions.messages import SendReactionRequest
-from backend.ai import OpenRouterClient, get_models, get_vision_models, sort_models, format_price
-from backend.database import SQLite, EmojiDB, UserDB, ReminderDB, StickerDB, GroupDB
+from backend.ai import OpenRouterClient, RetryPolicy, AdmissionController, ResponseCache, ModelRouter, HedgePolicy, PromptBuilder, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, get_models, get_vision_models, sort_models, format_price
+from backend.database import StorageEngine, EmojiDB, UserDB, ReminderDB, StickerDB, GroupDB, ChatHistory
+from backend.database.history import message_tokens
 from backend.database.memory import GlobalMemory, detect_reaction_type
-from backend.humanizer import analyze_mood_ai, get_mood_prompt, update_mood, get_time_context, get_pause_reaction, maybe_split_message, should_short_response, get_short_response, parse_reminder_time, get_send_timestamp, format_time_msk, needs_ai_parsing, parse_reminder_ai, get_personal_event, get_voice_excuse, add_caps_emotion, remove_self_mention, should_respond_quick, should_respond_ai, get_group_system_prompt, parse_rules_response, parse_staff_response, parse_rules_ai, parse_staff_ai, wait_for_bot_response, get_join_greeting
+from backend.humanizer import analyze_mood_ai, get_mood_prompt, update_mood, get_time_context, get_pause_reaction, maybe_split_message, should_short_response, get_short_response, parse_reminder_time, get_send_timestamp, format_time_msk, needs_ai_parsing, parse_reminder_ai, get_personal_event, get_voice_excuse, add_caps_emotion, remove_self_mention, should_respond_quick, should_respond_ai, triage_message, RespondBatcher, ReminderScheduler, summarize_dialog, get_group_system_prompt, parse_rules_response, parse_staff_response, parse_rules_ai, parse_staff_ai, wait_for_bot_response, get_join_greeting
 from backend.humanizer.moderation import check_promotion, process_moderation, track_admin_action
 from backend.humanizer.context_utils import get_current_datetime_info, detect_media_type, count_my_messages_in_row, extract_mentions, extract_links, get_chat_activity_info, get_relationship_stats, get_online_status, get_online_status_from_user, format_group_profile_brief, extract_buttons, format_buttons_for_ai
 from backend.humanizer.learning import get_contextual_lessons, process_pending_interactions, quick_learn
@@ -42,6 +43,8 @@ PROMPT_FILE = os.path.join(DATA_DIR, "prompt.txt")
 
 config = {}
 ai_client = None
+storage = None
+reminder_scheduler = None
 db = None
 emoji_db = None
 user_db = None
@@ -52,7 +55,7 @@ memory_db = None
 last_bot_responses = {}
 models_cache = {"free": [], "paid": [], "all": {}}
 vision_models_cache = {"free": [], "paid": []}
-chat_history = {}
+chat_history = None
 system_prompt = ""
 analyze_locks = {}
 analyze_queue = {}
@@ -60,6 +63,8 @@ chat_queues = {}
 chat_workers = {}
 chat_locks = {}
 bot_off_reason = None
+respond_batcher = None
+prompt_builder = None
 
 
 def load_prompt():
@@ -72,31 +77,46 @@ def load_prompt():
 
 
 def load_config():
-    global config, ai_client
+    global config, ai_client, respond_batcher, prompt_builder
     with open(CONFIG_FILE, "r", encoding="utf-8") as f:
         config = json.load(f)
+    respond_batcher = RespondBatcher(**config.get("respond_batch", {}))
+    prompt_builder = PromptBuilder(**config.get("prompt_cache", {}))
     if config.get("api_key"):
-        ai_client = OpenRouterClient(config["api_key"])
+        retry_policy = RetryPolicy(**config.get("retry", {}))
+        limiter = AdmissionController(**config.get("limits", {}))
+        cache_config = dict(config.get("cache", {}))
+        cache_config.pop("persist", None)
+        cache = ResponseCache(**cache_config)
+        router = ModelRouter(**config.get("router", {}))
+        hedge_config = dict(config.get("hedge", {}))
+        hedge = HedgePolicy(**hedge_config) if hedge_config.pop("enabled", False) else None
+        ai_client = OpenRouterClient(config["api_key"], retry_policy=retry_policy, limiter=limiter, cache=cache, router=router, hedge=hedge, **config.get("http", {}))
 
 
 async def init_db():
-    global db, emoji_db, user_db, reminder_db, sticker_db, group_db
-    db = SQLite(os.path.join(DATA_DIR, "database.db"))
-    await db.connect()
+    global storage, db, emoji_db, user_db, reminder_db, sticker_db, group_db, chat_history
+    storage = StorageEngine(DATA_DIR, config.get("storage", {}).get("pragmas"))
+    db = storage.open("database")
     emoji_db = EmojiDB(db)
     await emoji_db.init_table()
-    user_db = UserDB(db)
+    user_db = UserDB(db, **config.get("database", {}), **config.get("profile_cache", {}))
     await user_db.init_table()
     reminder_db = ReminderDB(db)
     await reminder_db.init_table()
     sticker_db = StickerDB(db)
     await sticker_db.init_table()
-    group_db = GroupDB(os.path.join(DATA_DIR, "groups.db"))
+    chat_history = ChatHistory(db, **config.get("database", {}), **config.get("chat_history", {}))
+    await chat_history.init_table()
+    group_db = GroupDB(storage.open("groups"), **config.get("database", {}), **config.get("group_archive", {}))
     await group_db.init()
     
     global memory_db
-    memory_db = GlobalMemory(os.path.join(DATA_DIR, "global_memory.db"))
+    memory_db = GlobalMemory(storage.open("global_memory"))
     await memory_db.init()
+    
+    if ai_client and config.get("cache", {}).get("persist"):
+        await ai_client.cache.attach(db)
 
 
 def save_config():
@@ -219,24 +239,6 @@ def format_vision_models_page(models: list, page: int, per_page: int = 8) -> tup
     return "\n\n".join(lines), total_pages
 
 
-def get_chat_history(chat_id: int) -> list:
-    if chat_id not in chat_history:
-        chat_history[chat_id] = []
-    return chat_history[chat_id]
-
-
-def add_to_history(chat_id: int, role: str, content: str):
-    history = get_chat_history(chat_id)
-    history.append({"role": role, "content": content})
-    if len(history) > 20:
-        history.pop(0)
-        history.pop(0)
-
-
-def clear_history(chat_id: int):
-    chat_history[chat_id] = []
-
-
 _analyze_counter = {}
 
 async def analyze_all(user_id: int, username: str, name: str, last_message: str, messages: list):
@@ -262,6 +264,23 @@ async def analyze_all(user_id: int, username: str, name: str, last_message: str,
             print(f"Ошибка analyze_all: {e}")
 
 
+async def update_summary(chat_id: int):
+    analyze_model = config.get("analyze_model")
+    if not analyze_model or not ai_client:
+        return
+    
+    folded = chat_history.take_folded(chat_id)
+    if not folded:
+        return
+    
+    summary = await chat_history.get_summary(chat_id)
+    new_summary = await summarize_dialog(ai_client, analyze_model, summary, folded, chat_history.summary_tokens)
+    await chat_history.set_summary(chat_id, new_summary, folded)
+    if new_summary:
+        folded_tokens = sum(message_tokens(m) for m in folded)
+        print(f"[SUMMARY] {chat_id}: свернуто {len(folded)} реплик (~{folded_tokens} токенов) в сводку ~{len(new_summary) // 4} токенов")
+
+
 async def try_ai_reminder(user_id: int, chat_id: int, text: str):
     try:
         analyze_model = config.get("analyze_model")
@@ -331,7 +350,7 @@ async def analyze_user(user_id: int, username: str, name: str, messages: list):
         result = await ai_client.chat(analyze_model, [
             {"role": "system", "content": "Извлекай ТОЛЬКО факты которые юзер ПРЯМО написал. Не выдумывай!"},
             {"role": "user", "content": combined_prompt}
-        ], retries=5, max_tokens=150)
+        ], retries=5, max_tokens=150, priority=PRIORITY_BACKGROUND)
         
         response = (result.get("content") or "") if isinstance(result, dict) else str(result)
         print(f"[ANALYZE {user_id}] {response[:150]}")
@@ -359,19 +378,20 @@ async def analyze_user(user_id: int, username: str, name: str, messages: list):
                     rel_value = int(rel_str)
         
         bad_words = ['хоно', 'бот', 'она', 'ии', 'ai', 'assistant']
+        updates = {}
         
         if facts and facts.lower() != "нет" and len(facts) > 3:
             if not any(bw in facts.lower() for bw in bad_words):
-                await user_db.update_profile(user_id, facts[:120], username, name)
+                updates.update(profile=facts[:120], username=username, name=name, last_updated=int(time.time()))
                 print(f"[PROFILE] {user_id}: {facts[:50]}")
         
         if interests and interests.lower() != "нет" and len(interests) > 2:
             if not any(bw in interests.lower() for bw in bad_words):
-                await user_db.update_topics(user_id, interests[:80])
+                updates["topics"] = interests[:80]
                 print(f"[INTERESTS] {user_id}: {interests[:40]}")
         
         if dates and dates.lower() != "нет" and len(dates) > 3:
-            await user_db.update_dates(user_id, dates[:80])
+            updates["dates"] = dates[:80]
             print(f"[DATES] {user_id}: {dates[:40]}")
         
         rel_value = max(-5, min(7, rel_value))
@@ -380,8 +400,11 @@ async def analyze_user(user_id: int, username: str, name: str, messages: list):
                 smooth = min(current_rel + 1, rel_value)
             else:
                 smooth = max(current_rel - 1, rel_value)
-            await user_db.update_relationship(user_id, smooth)
+            updates["relationship"] = smooth
             print(f"[REL] {user_id}: {current_rel} -> {smooth}")
+        
+        if updates:
+            await user_db.upsert(user_id, **updates)
             
     except Exception as e:
         print(f"[ANALYZE ERR] {e}")
@@ -474,7 +497,7 @@ def parse_emoji_tags(text: str, emoji_map: dict, id_map: dict) -> tuple[str, lis
     return result, entities
 
 
-async def send_reaction(client, chat_id: int, msg_id: int, text: str, relationship: int = 0):
+async def send_reaction(client, chat_id: int, msg_id: int, text: str, relationship: int = 0, emoji: dict = None, picked: bool = False):
     import random
     
     if relationship < 2:
@@ -488,11 +511,11 @@ async def send_reaction(client, chat_id: int, msg_id: int, text: str, relationsh
             return
     
     try:
-        emojis = await emoji_db.get_all()
-        if not emojis:
-            return
-        
-        emoji = await pick_reaction_emoji(text, emojis)
+        if not picked:
+            emojis = (await emoji_db.catalog()).emojis
+            if not emojis:
+                return
+            emoji = await pick_reaction_emoji(text, emojis)
         if not emoji:
             return
         
@@ -509,9 +532,8 @@ async def send_reaction(client, chat_id: int, msg_id: int, text: str, relationsh
 async def handle_tool_calls(client, model: str, messages: list, tool_calls: list, emoji_list: str, system_prompt: str, on_join_callback=None, current_chat_id=None, sender_role=None, current_msg_id=None) -> str:
     import json
     
-    emojis = await emoji_db.get_all() if emoji_db else []
-    emoji_map = {e["document_id"]: e["emoji"] for e in emojis}
-    _, id_map = await get_emojis_for_ai()
+    catalog = await emoji_db.catalog()
+    emoji_map, id_map = catalog.emoji_map, catalog.id_map
     
     async def send_with_emoji(entity, text):
         text = text.replace("\\n", "\n")
@@ -576,7 +598,9 @@ async def handle_tool_calls(client, model: str, messages: list, tool_calls: list
             "content": json.dumps(result, ensure_ascii=False)
         })
     
-    final_result = await ai_client.chat(model, messages_with_tools, tools=TOOLS)
+    final_result = await ai_client.chat(model, messages_with_tools, tools=TOOLS, priority=PRIORITY_INTERACTIVE)
+    if final_result.get("finish_reason") == "error":
+        return ""
     final_text = final_result.get("content", "") if isinstance(final_result, dict) else str(final_result)
     
     new_tool_calls = final_result.get("tool_calls") if isinstance(final_result, dict) else None
@@ -586,6 +610,88 @@ async def handle_tool_calls(client, model: str, messages: list, tool_calls: list
     return final_text
 
 
+SENTENCE_END = re.compile(r'[.!?…)]+\s|\n')
+STREAM_EDIT_INTERVAL = 1.5
+
+
+def last_sentence_end(text: str) -> int:
+    end = 0
+    for match in SENTENCE_END.finditer(text):
+        end = match.end()
+    return end
+
+
+async def stream_reply(client, chat_id: int, model: str, messages: list, emoji_map: dict, id_map: dict, tools: list = None, reply_to: int = None, hedge_model: str = None) -> dict:
+    text = ""
+    sent_msg = None
+    sent_len = 0
+    last_edit = 0.0
+    tool_started = False
+    done = {}
+    
+    def render(chunk: str) -> tuple:
+        chunk = remove_self_mention(chunk).replace("\\n", "\n").strip()
+        return parse_emoji_tags(chunk, emoji_map, id_map)
+    
+    async def show(upto: int):
+        nonlocal sent_msg, sent_len, last_edit
+        final_text, entities = render(text[:upto])
+        if not final_text:
+            return
+        if sent_msg is None:
+            if entities:
+                sent_msg = await client.send_message(chat_id, final_text, formatting_entities=entities, reply_to=reply_to)
+            else:
+                sent_msg = await client.send_message(chat_id, final_text, parse_mode='md', reply_to=reply_to)
+        else:
+            try:
+                if entities:
+                    await client.edit_message(chat_id, sent_msg, final_text, formatting_entities=entities)
+                else:
+                    await client.edit_message(chat_id, sent_msg, final_text, parse_mode='md')
+            except Exception as e:
+                print(f"[STREAM] Ошибка редактирования: {e}")
+        sent_len = upto
+        last_edit = time.monotonic()
+    
+    async for chunk in ai_client.chat_stream(model, messages, tools=tools, priority=PRIORITY_INTERACTIVE, hedge_model=hedge_model):
+        if chunk["type"] == "content":
+            text += chunk["text"]
+            if tool_started:
+                continue
+            boundary = last_sentence_end(text)
+            if boundary <= sent_len:
+                continue
+            if sent_msg is None or time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+                await show(boundary)
+        elif chunk["type"] == "tool_call":
+            tool_started = True
+        elif chunk["type"] == "done":
+            done = chunk
+    
+    if sent_msg is not None and not tool_started and len(text) > sent_len:
+        await show(len(text))
+    
+    if sent_msg is not None and done.get("tool_calls"):
+        # Ход закончился вызовом инструментов: ответ пришлёт handle_tool_calls, а начало без продолжения висело бы обрывком
+        try:
+            await client.delete_messages(chat_id, sent_msg)
+        except Exception as e:
+            print(f"[STREAM] Ошибка удаления начала ответа: {e}")
+        sent_msg = None
+    
+    if done.get("finish_reason") == "error" and not text:
+        text = done.get("error") or "Ошибка стрима"
+    
+    return {
+        "content": text,
+        "tool_calls": done.get("tool_calls"),
+        "finish_reason": done.get("finish_reason"),
+        "usage": done.get("usage"),
+        "sent": sent_msg is not None
+    }
+
+
 async def pick_reaction_emoji(text: str, emojis: list) -> dict:
     import random
     analyze_model = config.get("analyze_model")
@@ -615,7 +721,7 @@ async def pick_reaction_emoji(text: str, emojis: list) -> dict:
         result = await ai_client.chat(analyze_model, [
             {"role": "system", "content": "Выбери подходящую реакцию. Ответь только номером."},
             {"role": "user", "content": prompt}
-        ], retries=5, max_tokens=50)
+        ], retries=5, max_tokens=50, priority=PRIORITY_BACKGROUND, cache_ttl=3600)
         
         response = result.get("content", "").strip() if isinstance(result, dict) else str(result).strip()
         
@@ -660,18 +766,13 @@ async def maybe_send_sticker(client, chat_id: int, text: str, relationship: int
 
 
 async def get_emojis_for_ai() -> tuple[str, dict]:
-    emojis = await emoji_db.get_all()
-    if not emojis:
-        return "ЭМОДЗИ НЕТ - не используй никакие эмодзи!", {}
-    
-    lines = []
-    id_map = {}
-    for i, e in enumerate(emojis, 1):
-        lines.append(f"#{i} — {e['description']}")
-        id_map[i] = e['document_id']
-    
-    text = "ПРЕМИУМ ЭМОДЗИ (пиши #номер):\n" + "\n".join(lines)
-    return text, id_map
+    catalog = await emoji_db.catalog()
+    return catalog.prompt, catalog.id_map
+
+
+async def get_prompt_prefix() -> str:
+    catalog = await emoji_db.catalog()
+    return prompt_builder.prefix(system_prompt, catalog.prompt, catalog.version)
 
 
 async def main():
@@ -755,6 +856,116 @@ async def main():
             except:
                 balance_text = "💰 Баланс: ошибка загрузки\n\n"
         
+        limiter_text = ""
+        if ai_client and ai_client.limiter:
+            stats = ai_client.limiter.get_stats()
+            limiter_text = f"📶 Запросы: {stats['active']}/{stats['max_concurrency']} активно, в очереди {stats['queue_depth']}\n"
+            for lane, lane_stats in stats["lanes"].items():
+                if lane_stats["requests"] or lane_stats["queued"]:
+                    limiter_text += (
+                        f"• {lane}: {lane_stats['requests']} запр., {lane_stats['active']} акт., {lane_stats['queued']} в очереди, "
+                        f"ожидание ср. {lane_stats['avg_wait']:.2f}с / p95 {lane_stats['p95_wait']:.2f}с"
+                    )
+                    if lane_stats["promoted"]:
+                        limiter_text += f", поднято {lane_stats['promoted']}"
+                    limiter_text += "\n"
+            limiter_text += "\n"
+        
+        if ai_client:
+            router_stats = ai_client.router.get_stats()
+            if router_stats["models"]:
+                limiter_text += "🩺 Модели:\n"
+                for model_id, health in router_stats["models"].items():
+                    limiter_text += (
+                        f"• `{model_id}`: {health['success_rate']:.0%} ок из {health['requests']}, "
+                        f"p50 {health['p50']:.1f}с / p95 {health['p95']:.1f}с, 429 {health['rate_limited']:.0%}"
+                    )
+                    if health["cancelled"]:
+                        limiter_text += f", отменено дублей {health['cancelled']}"
+                    if health["first_token"] is not None:
+                        limiter_text += f", первый токен {health['first_token']:.1f}с"
+                    if health["open"]:
+                        limiter_text += f", ⛔ отключена ещё {health['open_for']:.0f}с"
+                    limiter_text += "\n"
+                for task, decision in router_stats["decisions"].items():
+                    limiter_text += f"↪️ {task}: `{decision['model']}` ({decision['reason']})\n"
+                limiter_text += "\n"
+        
+        if ai_client and ai_client.hedge:
+            hedge_stats = ai_client.hedge.get_stats()
+            limiter_text += (
+                f"🪁 Хеджирование: {hedge_stats['hedged']} из {hedge_stats['calls']} ({hedge_stats['ratio']:.0%}, "
+                f"лимит {hedge_stats['max_ratio']:.0%}), запасная быстрее {hedge_stats['backup_wins']} раз\n\n"
+            )
+        
+        batch_stats = respond_batcher.get_stats()
+        if batch_stats["batches"]:
+            limiter_text += (
+                f"📦 Батчи решений: {batch_stats['batches']}, в среднем {batch_stats['avg_batch']:.1f} сообщ., "
+                f"по отдельности {batch_stats['fallbacks']}\n\n"
+            )
+        
+        if ai_client:
+            cache_stats = ai_client.cache.get_stats()
+            limiter_text += (
+                f"🗂 Кэш ответов: {cache_stats['size']} записей, {cache_stats['hits']} попаданий / "
+                f"{cache_stats['misses']} промахов ({cache_stats['hit_rate']:.0%})\n\n"
+            )
+        
+        profile_stats = user_db.get_cache_stats()
+        if profile_stats["hits"] or profile_stats["misses"]:
+            limiter_text += (
+                f"👤 Кэш профилей: {profile_stats['size']} записей, {profile_stats['hits']} попаданий / "
+                f"{profile_stats['misses']} промахов ({profile_stats['hit_rate']:.0%})\n\n"
+            )
+        
+        prompt_stats = prompt_builder.get_stats()
+        if prompt_stats["calls"]:
+            limiter_text += (
+                f"🧩 Кэш промпта: {prompt_stats['cached_tokens']} из {prompt_stats['prompt_tokens']} входных токенов "
+                f"({prompt_stats['cached_rate']:.0%}), префикс собран {prompt_stats['prefix_builds']} раз\n\n"
+            )
+        
+        history_stats = chat_history.get_stats()
+        limiter_text += (
+            f"💬 История: {history_stats['chats']} чатов, {history_stats['messages']} сообщений, "
+            f"~{history_stats['tokens']} токенов ({history_stats['bytes'] / 1024:.0f} КБ), "
+            f"вытеснено {history_stats['evictions']}, загружено из БД {history_stats['loads']}\n"
+            f"📝 Сводки: {history_stats['summaries']} (~{history_stats['summary_tokens']} токенов), "
+            f"свернуто реплик {history_stats['folded']}\n\n"
+        )
+        
+        if reminder_scheduler:
+            remind_stats = reminder_scheduler.get_stats()
+            next_in = f", ближайшее через {remind_stats['next_in'] / 60:.0f} мин" if remind_stats["next_in"] is not None else ""
+            limiter_text += (
+                f"⏰ Напоминания: в очереди {remind_stats['queued']}{next_in}, отправлено {remind_stats['sent']}, "
+                f"ошибок {remind_stats['failed']}, опоздание ~{remind_stats['lateness']:.1f}с, "
+                f"с готовым текстом {remind_stats['ready']}\n\n"
+            )
+        
+        db_tables = [
+            (f"{name}.{table}", stats)
+            for name, tables in storage.get_stats().items()
+            for table, stats in tables.items()
+        ]
+        db_tables.sort(key=lambda item: item[1]["total"], reverse=True)
+        if db_tables:
+            limiter_text += "🗄 Время запросов к БД:\n" + "\n".join(
+                f"  {table}: {stats['calls']} запр., ср. {stats['avg'] * 1000:.1f}мс, макс {stats['max'] * 1000:.0f}мс"
+                for table, stats in db_tables[:5]
+            ) + "\n\n"
+        
+        writes = [group_db.writes.stats, user_db.writes.stats]
+        if any(w["flushes"] for w in writes):
+            rows = sum(w["rows"] for w in writes)
+            flushes = sum(w["flushes"] for w in writes)
+            limiter_text += (
+                f"💾 Отложенная запись: {rows} операций за {flushes} транзакций"
+                f"{', ошибок ' + str(sum(w['errors'] for w in writes)) if any(w['errors'] for w in writes) else ''}"
+                f"{', потеряно ' + str(sum(w['dropped'] for w in writes)) if any(w['dropped'] for w in writes) else ''}\n\n"
+            )
+        
         text = (
             "⚙️ **Панель управления**\n\n"
             f"{balance_text}"
@@ -762,6 +973,7 @@ async def main():
             f"🔄 Alt: `{alt_model}`\n"
             f"👁 Vision: `{vision_model}`\n"
             f"🧠 Анализ: `{analyze_model}`\n\n"
+            f"{limiter_text}"
             "`/help` — все команды"
         )
         
@@ -1004,7 +1216,7 @@ async def main():
 
     @client.on(events.NewMessage(pattern=r"^/clear$", func=lambda e: e.is_private))
     async def clear_handler(event):
-        clear_history(event.chat_id)
+        await chat_history.clear(event.chat_id)
         await event.respond("🗑 История очищена")
 
     @client.on(events.NewMessage(pattern=r"^/reset_memory", func=lambda e: e.is_private))
@@ -1018,7 +1230,7 @@ async def main():
                 "❌ Использование:\n"
                 "`/reset_memory <user_id>` - сбросить память об одном юзере\n"
                 "`/reset_memory all` - сбросить ВСЮ память о пользователях\n\n"
-                f"Активные чаты: {len(chat_history)}"
+                f"Активные чаты: {chat_history.get_stats()['chats']}"
             )
             return
         
@@ -1026,7 +1238,7 @@ async def main():
         
         if arg == "all":
             count = await user_db.delete_all_profiles()
-            chat_history.clear()
+            await chat_history.clear_all()
             await event.respond(f"✅ Удалено {count} профилей и очищена история всех чатов")
             return
         
@@ -1036,13 +1248,9 @@ async def main():
         
         user_id = int(arg)
         
-        deleted_history = False
+        deleted_history = await chat_history.clear(user_id)
         deleted_profile = False
         
-        if user_id in chat_history:
-            del chat_history[user_id]
-            deleted_history = True
-        
         profile = await user_db.get_profile(user_id)
         if profile:
             await user_db.delete_profile(user_id)
@@ -1551,10 +1759,47 @@ async def main():
         if chat_id not in chat_locks:
             chat_locks[chat_id] = asyncio.Lock()
         
-        async with chat_locks[chat_id]:
-            await _process_group_message(event, chat, chat_id, text)
+        # Чат занят прошлым сообщением — решение «отвечать ли» ставим в пачку заранее, не дожидаясь очереди
+        early = None
+        if chat_locks[chat_id].locked():
+            early = asyncio.create_task(_early_respond_decision(event, chat_id, text))
+        
+        try:
+            async with chat_locks[chat_id]:
+                await _process_group_message(event, chat, chat_id, text, early)
+        finally:
+            if early and not early.done():
+                early.cancel()
+    
+    async def _early_respond_decision(event, chat_id, text):
+        # Только для сообщений, которые точно дойдут до батчера: ответы, упоминания и выключенный бот решаются в очереди.
+        # С триажем решение приходит вместе с модерацией, батчер остаётся запасным путём на его сбой
+        chat_models = config.get("chat_analyze_models", [])
+        if config.get("triage", True) or not chat_models or bot_off_reason is not None or event.message.reply_to:
+            return None
+        try:
+            me = await client.get_me()
+            if event.sender_id == me.id:
+                return None
+            
+            mentioned_ids = []
+            if event.message.entities:
+                from telethon.tl.types import MessageEntityMentionName
+                mentioned_ids = [e.user_id for e in event.message.entities if isinstance(e, MessageEntityMentionName)]
+            if should_respond_quick(text, me.username, me.id, False, mentioned_ids)[0] is not None:
+                return None
+            
+            context = await group_db.get_context(chat_id, limit=8)
+            if len(context) < 3:
+                return None
+            
+            sender = await event.get_sender()
+            return await respond_batcher.decide(ai_client, chat_models, text, context, me.username, get_display_name(sender, event.sender_id), chat_id)
+        except Exception as e:
+            print(f"[BATCH] Ошибка раннего решения: {e}")
+            return None
     
-    async def _process_group_message(event, chat, chat_id, text):
+    async def _process_group_message(event, chat, chat_id, text, early=None):
         group_info = await group_db.get_group(chat_id)
         if not group_info:
             await group_db.add_group(chat_id, getattr(chat, 'title', 'Unknown'), getattr(chat, 'username', None))
@@ -1693,6 +1938,7 @@ async def main():
                     mentioned_ids.append(entity.user_id)
         
         should_respond, reason = should_respond_quick(text, my_username, my_id, reply_to_me, mentioned_ids)
+        triage = None
         
         if should_respond is None:
             chat_models = config.get("chat_analyze_models", [])
@@ -1716,7 +1962,37 @@ async def main():
                     except Exception as e:
                         print(f"[GROUP] Ошибка загрузки из TG: {e}")
                 
-                should_respond, reason = await should_respond_ai(ai_client, chat_models, text, context, my_username, sender_username, chat_id)
+                if config.get("triage", True):
+                    mod_info = await group_db.get_mod_info(chat_id)
+                    mod_level = mod_info.get('mod_level', 0) if mod_info else 0
+                    sender_rel = sender_profile.get('relationship', 0) if sender_profile else 0
+                    triage = await triage_message(
+                        ai_client,
+                        chat_models,
+                        text,
+                        context,
+                        my_username,
+                        sender_username,
+                        sender_role,
+                        group_info.get('rules', '') if group_info else '',
+                        mod_level if sender_rel < 3 else 0,
+                        reply_context,
+                        (await emoji_db.catalog()).emojis[:15]
+                    )
+                
+                if triage:
+                    should_respond, reason = triage["respond"]
+                    if triage["mood"]:
+                        current_mood = sender_profile.get('mood', 0) if sender_profile else 0
+                        new_mood = update_mood(current_mood, 1 if triage["mood"] > 0 else -1)
+                        # Пишем только реальное изменение: у крайних значений настроение упирается в предел
+                        if new_mood != current_mood:
+                            await user_db.update_mood(sender_id, new_mood)
+                else:
+                    decision = await early if early else None
+                    if decision is None:
+                        decision = await respond_batcher.decide(ai_client, chat_models, text, context, my_username, sender_username, chat_id)
+                    should_respond, reason = decision
             else:
                 should_respond = False
         
@@ -1761,7 +2037,7 @@ async def main():
             context = await group_db.get_context(chat_id, limit=10)
             mod_command = await process_moderation(
                 ai_client,
-                chat_analyze_models[0],
+                ai_client.router.order(chat_analyze_models, "moderation")[0],
                 text,
                 sender_id,
                 sender_username,
@@ -1769,7 +2045,8 @@ async def main():
                 chat_id,
                 group_db,
                 context,
-                reply_context
+                reply_context,
+                triage["violation"] if triage else None
             )
             if mod_command:
                 print(f"[MODERATION] Действие: {mod_command[:50]}")
@@ -1786,7 +2063,10 @@ async def main():
         try:
             user_profile = await user_db.get_profile(sender_id)
             rel_level = user_profile.get("relationship", 0) if user_profile else 0
-            asyncio.create_task(send_reaction(client, chat_id, event.message.id, text, rel_level))
+            if triage and triage["reaction_checked"]:
+                asyncio.create_task(send_reaction(client, chat_id, event.message.id, text, rel_level, triage["reaction"], picked=True))
+            else:
+                asyncio.create_task(send_reaction(client, chat_id, event.message.id, text, rel_level))
         except:
             pass
         
@@ -1905,9 +2185,13 @@ async def main():
                 if rel_stats:
                     sender_info += f" ({rel_stats})"
             
-            full_prompt = f"🕐 {datetime_info}\n\n" + system_prompt + "\n\n" + group_prompt + my_role_info + group_profile_info + sender_info + msg_meta + media_info + buttons_info + spam_warning + reply_info + relationships_info + activity_info + lessons_text + "\n\n" + emoji_list
+            model, alt_model = (ai_client.router.order([model, config.get("alt_model")], "reply", pinned=True) + [None])[:2]
             
-            messages = [{"role": "system", "content": full_prompt}]
+            prompt_prefix = await get_prompt_prefix()
+            group_text = "\n\n" + group_prompt + my_role_info + group_profile_info + sender_info + msg_meta + media_info + buttons_info + spam_warning + reply_info + relationships_info + activity_info + lessons_text + f"\n\n🕐 {datetime_info}"
+            full_prompt = prompt_prefix + group_text
+            
+            messages = [prompt_builder.system_message(model, prompt_prefix, volatile=group_text)]
             
             for msg in context[-15:]:
                 msg_username = msg.get('username') or f"user_{msg.get('user_id', '?')}"
@@ -1927,6 +2211,8 @@ async def main():
             
             has_photo = event.message.photo is not None
             vision_model = config.get("selected_vision_model")
+            streamed = False
+            failed = False
             
             current_msg_prefix = f"@{sender_username}"
             if forward_info:
@@ -1941,46 +2227,61 @@ async def main():
                     user_msg = text or "Что на картинке?"
                     messages.append({"role": "user", "content": f"{current_msg_prefix}: [фото] {user_msg}"})
                     
-                    response_text = await ai_client.chat_with_image(vision_model, messages, photo)
+                    response_text = await ai_client.chat_with_image(vision_model, messages, photo, priority=PRIORITY_INTERACTIVE)
                     print(f"[GROUP] Использовал vision модель для фото")
+                    failed = response_text.startswith("Ошибка")
                     tool_calls = None
                 except Exception as e:
                     print(f"[GROUP] Ошибка vision: {e}, использую обычную модель")
                     messages.append({"role": "user", "content": f"{current_msg_prefix}: {text}"})
-                    result = await ai_client.chat(model, messages, tools=TOOLS, max_tokens=500)
+                    result = await ai_client.chat(model, messages, tools=TOOLS, max_tokens=500, priority=PRIORITY_INTERACTIVE)
                     response_text = result.get("content", "") if isinstance(result, dict) else str(result)
                     tool_calls = result.get("tool_calls") if isinstance(result, dict) else None
+                    failed = result.get("finish_reason") == "error"
+            elif config.get("stream_replies"):
+                messages.append({"role": "user", "content": f"{current_msg_prefix}: {text}"})
+                emoji_map = (await emoji_db.catalog()).emoji_map
+                result = await stream_reply(client, chat_id, model, messages, emoji_map, id_map, tools=TOOLS, reply_to=event.message.id)
+                streamed = result["sent"]
+                if streamed:
+                    typing_task.cancel()
+                response_text = result.get("content", "")
+                tool_calls = result.get("tool_calls")
+                failed = result.get("finish_reason") == "error" and not streamed
+                prompt_builder.record(model, result.get("usage"))
             else:
                 messages.append({"role": "user", "content": f"{current_msg_prefix}: {text}"})
-                result = await ai_client.chat(model, messages, tools=TOOLS, max_tokens=500)
+                result = await ai_client.chat(model, messages, tools=TOOLS, max_tokens=500, priority=PRIORITY_INTERACTIVE)
                 response_text = result.get("content", "") if isinstance(result, dict) else str(result)
                 tool_calls = result.get("tool_calls") if isinstance(result, dict) else None
+                failed = result.get("finish_reason") == "error"
+                prompt_builder.record(model, result.get("usage"))
             
             if tool_calls:
                 response_text = await handle_tool_calls(client, model, messages, tool_calls, emoji_list, full_prompt, on_group_join, chat_id, sender_role, event.message.id)
             
-            if not response_text or response_text.startswith("Ошибка"):
-                alt_model = config.get("alt_model")
-                if alt_model:
-                    result = await ai_client.chat(alt_model, messages, max_tokens=500)
-                    response_text = result.get("content", "") if isinstance(result, dict) else str(result)
+            if (failed or not response_text) and alt_model:
+                print(f"[GROUP] {model} не ответила, пробую {alt_model}")
+                result = await ai_client.chat(alt_model, messages, max_tokens=500, priority=PRIORITY_INTERACTIVE)
+                response_text = result.get("content", "") if isinstance(result, dict) else str(result)
+                failed = result.get("finish_reason") == "error"
             
-            if response_text and not response_text.startswith("Ошибка"):
+            if response_text and not failed:
                 await group_db.add_context(chat_id, my_id, my_username, response_text[:300])
                 await group_db.increment_messages(chat_id, is_mine=True)
                 
                 response_text = remove_self_mention(response_text)
                 response_text = response_text.replace("\\n", "\n")
                 
-                emojis = await emoji_db.get_all()
-                emoji_map = {e["document_id"]: e["emoji"] for e in emojis}
-                
-                final_text, entities = parse_emoji_tags(response_text, emoji_map, id_map)
-                
-                if entities:
-                    await client.send_message(chat_id, final_text, formatting_entities=entities, reply_to=event.message.id)
-                else:
-                    await client.send_message(chat_id, final_text, parse_mode='md', reply_to=event.message.id)
+                if not streamed:
+                    emoji_map = (await emoji_db.catalog()).emoji_map
+                    
+                    final_text, entities = parse_emoji_tags(response_text, emoji_map, id_map)
+                    
+                    if entities:
+                        await client.send_message(chat_id, final_text, formatting_entities=entities, reply_to=event.message.id)
+                    else:
+                        await client.send_message(chat_id, final_text, parse_mode='md', reply_to=event.message.id)
                 
                 interaction_key = f"{chat_id}_{sender_id}"
                 last_bot_responses[interaction_key] = response_text[:300]
@@ -2299,6 +2600,7 @@ async def main():
         
         id_map = {}
         emoji_map = {}
+        streamed = False
         
         try:
             if has_photo:
@@ -2314,34 +2616,37 @@ async def main():
                 if user_profile and user_profile.get("profile"):
                     profile_text = f"\n\n(возможно о собеседнике: {user_profile['profile']})"
                 
-                full_prompt = system_prompt + profile_text + "\n\n" + emoji_list
+                summary = await chat_history.get_summary(event.chat_id)
+                summary_text = f"\n\nРАНЕЕ В ДИАЛОГЕ (кратко): {summary}" if summary else ""
+                
+                prompt_prefix = await get_prompt_prefix()
                 
                 user_msg = text or "Что на картинке?"
-                add_to_history(event.chat_id, "user", f"[фото] {user_msg}")
+                await chat_history.add(event.chat_id, "user", f"[фото] {user_msg}")
                 
                 photo = await event.message.download_media(bytes)
-                history = get_chat_history(event.chat_id)
-                messages = [{"role": "system", "content": full_prompt}]
+                history = await chat_history.get(event.chat_id)
+                messages = [prompt_builder.system_message(vision_model, prompt_prefix, profile_text + summary_text)]
                 messages.extend(history[:-1])
                 messages.append({"role": "user", "content": user_msg})
                 
-                response = await ai_client.chat_with_image(vision_model, messages, photo)
+                response = await ai_client.chat_with_image(vision_model, messages, photo, priority=PRIORITY_INTERACTIVE)
                 response_text = response
                 
                 if response_text and not response_text.startswith("Ошибка"):
-                    add_to_history(event.chat_id, "assistant", response_text)
+                    await chat_history.add(event.chat_id, "assistant", response_text)
                     
-                    asyncio.create_task(analyze_all(event.sender_id, username, user_name, user_msg, get_chat_history(event.chat_id)))
+                    asyncio.create_task(analyze_all(event.sender_id, username, user_name, user_msg, await chat_history.get(event.chat_id)))
+                    asyncio.create_task(update_summary(event.chat_id))
                 
-                emojis = await emoji_db.get_all()
-                emoji_map = {e["document_id"]: e["emoji"] for e in emojis}
+                emoji_map = (await emoji_db.catalog()).emoji_map
             else:
                 if should_short_response(text):
                     response_text = get_short_response()
                     id_map = {}
                     emoji_map = {}
                 else:
-                    add_to_history(event.chat_id, "user", text)
+                    await chat_history.add(event.chat_id, "user", text)
                     
                     emoji_list, id_map = await get_emojis_for_ai()
                     
@@ -2390,6 +2695,9 @@ async def main():
                         if lessons_text:
                             lessons_text = "\n\n" + lessons_text
                     
+                    summary = await chat_history.get_summary(event.chat_id)
+                    summary_text = f"\n\nРАНЕЕ В ДИАЛОГЕ (кратко): {summary}" if summary else ""
+                    
                     datetime_info = get_current_datetime_info()
                     
                     online_status = get_online_status_from_user(sender)
@@ -2410,31 +2718,47 @@ async def main():
                         if stats:
                             rel_stats = f" ({stats})"
                     
-                    full_prompt = f"🕐 {datetime_info}\n\n" + system_prompt + profile_text + rel_stats + mood_text + online_text + media_info + buttons_info + time_text + pause_text + event_text + lessons_text + "\n\n" + emoji_list
+                    # Сверху то, что не меняется между сообщениями, внизу — минуты, онлайн и случайные события
+                    prompt_prefix = await get_prompt_prefix()
+                    stable_text = profile_text + rel_stats + summary_text
+                    volatile_text = mood_text + lessons_text + time_text + pause_text + event_text + f"\n\n🕐 {datetime_info}" + online_text + media_info + buttons_info
+                    full_prompt = prompt_prefix + stable_text + volatile_text
+                    
+                    model, alt_model = (ai_client.router.order([model, config.get("alt_model")], "reply", pinned=True) + [None])[:2]
                     
-                    history = get_chat_history(event.chat_id)
-                    messages = [{"role": "system", "content": full_prompt}]
+                    history = await chat_history.get(event.chat_id)
+                    messages = [prompt_builder.system_message(model, prompt_prefix, stable_text, volatile_text)]
                     messages.extend(history)
                     
-                    result = await ai_client.chat(model, messages, tools=TOOLS)
+                    if config.get("stream_replies"):
+                        emoji_map = (await emoji_db.catalog()).emoji_map
+                        result = await stream_reply(client, event.chat_id, model, messages, emoji_map, id_map, tools=TOOLS, hedge_model=alt_model)
+                        streamed = result["sent"]
+                        if streamed:
+                            typing_task.cancel()
+                    else:
+                        result = await ai_client.chat(model, messages, tools=TOOLS, priority=PRIORITY_INTERACTIVE, hedge_model=alt_model)
+                    prompt_builder.record(model, result.get("usage"))
                     response_text = result.get("content", "") if isinstance(result, dict) else result
                     tool_calls = result.get("tool_calls") if isinstance(result, dict) else None
+                    failed = result.get("finish_reason") == "error" and not streamed
                     
                     if tool_calls:
                         response_text = await handle_tool_calls(client, model, messages, tool_calls, emoji_list, full_prompt, on_group_join, event.chat_id, None, event.message.id)
+                        failed = not response_text
                     
-                    if response_text and response_text.startswith("Ошибка"):
-                        alt_model = config.get("alt_model")
-                        if alt_model:
-                            print(f"Основная модель не ответила, пробую alt: {alt_model}")
-                            result = await ai_client.chat(alt_model, messages, tools=TOOLS)
-                            response_text = result.get("content", "") if isinstance(result, dict) else result
+                    if failed and alt_model:
+                        print(f"Основная модель не ответила, пробую alt: {alt_model}")
+                        result = await ai_client.chat(alt_model, messages, tools=TOOLS, priority=PRIORITY_INTERACTIVE)
+                        response_text = result.get("content", "") if isinstance(result, dict) else result
+                        failed = result.get("finish_reason") == "error"
                     
-                    if response_text and not response_text.startswith("Ошибка"):
-                        add_to_history(event.chat_id, "assistant", response_text)
+                    if response_text and not failed:
+                        await chat_history.add(event.chat_id, "assistant", response_text)
                         print(f"AI ответ: {response_text}")
                         
-                        asyncio.create_task(analyze_all(event.sender_id, username, user_name, text, get_chat_history(event.chat_id)))
+                        asyncio.create_task(analyze_all(event.sender_id, username, user_name, text, await chat_history.get(event.chat_id)))
+                        asyncio.create_task(update_summary(event.chat_id))
                         
                         reminder_mins, reminder_topic = parse_reminder_time(text)
                         if reminder_mins > 0 and reminder_topic:
@@ -2444,16 +2768,14 @@ async def main():
                         elif needs_ai_parsing(text):
                             asyncio.create_task(try_ai_reminder(event.sender_id, event.chat_id, text))
                     
-                    emojis = await emoji_db.get_all()
-                    emoji_map = {e["document_id"]: e["emoji"] for e in emojis}
+                    emoji_map = (await emoji_db.catalog()).emoji_map
                 
                 await user_db.update_last_seen(event.sender_id, username, user_name)
-                emojis = await emoji_db.get_all()
-                emoji_map = {e["document_id"]: e["emoji"] for e in emojis}
+                emoji_map = (await emoji_db.catalog()).emoji_map
         finally:
             typing_task.cancel()
         
-        if response_text:
+        if response_text and not streamed:
             sticker_sent = await maybe_send_sticker(client, event.chat_id, text, rel_level)
             
             if not sticker_sent:
@@ -2476,51 +2798,52 @@ async def main():
                 if i < len(parts) - 1:
                     await asyncio.sleep(0.8)
 
-    async def reminder_checker():
-        while True:
-            try:
-                pending = await reminder_db.get_pending()
-                for r in pending:
-                    try:
-                        topic = r['message']
-                        model = config.get("selected_model")
-                        
-                        is_self_reminder = topic.startswith("[HONO_SELF]")
-                        if is_self_reminder:
-                            topic = topic.replace("[HONO_SELF]", "").strip()
-                            reminder_prompt = f"Ты хотела написать: {topic}. Напиши это сообщение естественно, как будто сама решила написать."
-                        else:
-                            reminder_prompt = f"Ты напоминаешь пользователю о: {topic}. Напиши короткое напоминание (1-2 предложения)."
-                        
-                        emoji_list, id_map = await get_emojis_for_ai()
-                        
-                        result = await ai_client.chat(model, [
-                            {"role": "system", "content": system_prompt + "\n\n" + emoji_list},
-                            {"role": "user", "content": reminder_prompt}
-                        ], max_tokens=150)
-                        
-                        msg = result.get("content", "") if isinstance(result, dict) else str(result)
-                        if not msg or msg.startswith("Ошибка"):
-                            msg = topic if is_self_reminder else f"Эй, напоминаю про {topic}!"
-                        
-                        emojis = await emoji_db.get_all()
-                        emoji_map = {e["document_id"]: e["emoji"] for e in emojis}
-                        
-                        final_text, entities = parse_emoji_tags(msg, emoji_map, id_map)
-                        
-                        if entities:
-                            await client.send_message(r['chat_id'], final_text, formatting_entities=entities)
-                        else:
-                            await client.send_message(r['chat_id'], final_text)
-                        
-                        await reminder_db.mark_sent(r['id'])
-                        print(f"{'Само-напоминание' if is_self_reminder else 'Напоминание'} '{topic}' отправлено")
-                    except Exception as e:
-                        print(f"Ошибка отправки напоминания: {e}")
-                        await reminder_db.mark_sent(r['id'])
-            except Exception as e:
-                print(f"Ошибка checker: {e}")
-            await asyncio.sleep(30)
+    async def prepare_reminder(r, priority=PRIORITY_BACKGROUND):
+        topic = r['message']
+        model = config.get("selected_model")
+        
+        is_self_reminder = topic.startswith("[HONO_SELF]")
+        if is_self_reminder:
+            topic = topic.replace("[HONO_SELF]", "").strip()
+            reminder_prompt = f"Ты хотела написать: {topic}. Напиши это сообщение естественно, как будто сама решила написать."
+        else:
+            reminder_prompt = f"Ты напоминаешь пользователю о: {topic}. Напиши короткое напоминание (1-2 предложения)."
+        
+        emoji_list, _ = await get_emojis_for_ai()
+        
+        result = await ai_client.chat(model, [
+            {"role": "system", "content": system_prompt + "\n\n" + emoji_list},
+            {"role": "user", "content": reminder_prompt}
+        ], max_tokens=150, priority=priority)
+        
+        msg = result.get("content", "") if isinstance(result, dict) else str(result)
+        if not msg or msg.startswith("Ошибка"):
+            msg = topic if is_self_reminder else f"Эй, напоминаю про {topic}!"
+        return msg
+    
+    async def send_reminder(r):
+        topic = r['message']
+        is_self_reminder = topic.startswith("[HONO_SELF]")
+        if is_self_reminder:
+            topic = topic.replace("[HONO_SELF]", "").strip()
+        
+        # Обычно текст готов заранее; если подготовка не успела — генерируем прямо сейчас
+        msg = r.get('text') or await prepare_reminder(r, PRIORITY_INTERACTIVE)
+        
+        catalog = await emoji_db.catalog()
+        final_text, entities = parse_emoji_tags(msg, catalog.emoji_map, catalog.id_map)
+        
+        if entities:
+            await client.send_message(r['chat_id'], final_text, formatting_entities=entities)
+        else:
+            await client.send_message(r['chat_id'], final_text)
+        
+        print(f"{'Само-напоминание' if is_self_reminder else 'Напоминание'} '{topic}' отправлено")
+    
+    global reminder_scheduler
+    reminder_config = dict(config.get("reminders", {}))
+    reminder_keep_days = reminder_config.pop("keep_days", 7)
+    reminder_scheduler = ReminderScheduler(reminder_db, send_reminder, prepare_reminder, **reminder_config)
     
     async def spontaneous_messages():
         import random
@@ -2557,14 +2880,13 @@ async def main():
                 result = await ai_client.chat(model, [
                     {"role": "system", "content": full_prompt},
                     {"role": "user", "content": random.choice(prompts)}
-                ], max_tokens=100)
+                ], max_tokens=100, priority=PRIORITY_BACKGROUND)
                 
                 msg = result.get("content", "") if isinstance(result, dict) else str(result)
                 if not msg or msg.startswith("Ошибка"):
                     continue
                 
-                emojis = await emoji_db.get_all()
-                emoji_map = {e["document_id"]: e["emoji"] for e in emojis}
+                emoji_map = (await emoji_db.catalog()).emoji_map
                 final_text, entities = parse_emoji_tags(msg, emoji_map, id_map)
                 
                 if entities:
@@ -2598,9 +2920,34 @@ async def main():
             except Exception as e:
                 print(f"[LEARNING] Ошибка: {e}")
     
-    asyncio.create_task(reminder_checker())
+    async def storage_maintenance():
+        while True:
+            try:
+                await asyncio.sleep(group_db.compact_interval)
+                await group_db.compact()
+                removed = await reminder_db.compact(reminder_keep_days)
+                if removed:
+                    print(f"[REMIND] Удалено {removed} отправленных напоминаний старше {reminder_keep_days} дн.")
+            except Exception as e:
+                print(f"[GROUPS] Ошибка компакции: {e}")
+    
+    async def storage_backups():
+        storage_config = config.get("storage", {})
+        interval = storage_config.get("backup_interval", 0)
+        if interval <= 0:
+            return
+        while True:
+            try:
+                await asyncio.sleep(interval)
+                await storage.backup(os.path.join(DATA_DIR, "backups"), storage_config.get("backup_keep", 3))
+            except Exception as e:
+                print(f"[DB] Ошибка бэкапа: {e}")
+    
+    reminder_scheduler.start()
     asyncio.create_task(spontaneous_messages())
     asyncio.create_task(learning_loop())
+    asyncio.create_task(storage_maintenance())
+    asyncio.create_task(storage_backups())
     
     print("Бот запущен! Ожидание сообщений...")
     print("Нажмите Ctrl+C для остановки")
@@ -2608,7 +2955,13 @@ async def main():
     try:
         await client.run_until_disconnected()
     finally:
-        await db.close()
+        await reminder_scheduler.close()
+        if ai_client:
+            await ai_client.close()
+        await group_db.close()
+        await chat_history.close()
+        await user_db.close()
+        await storage.close()
         print("\nБот остановлен")
 
 
@@ -0,0 +1,75 @@
+import asyncio
+import json
+import os
+from backend.ai.cache import ResponseCache
+from backend.ai.retry import RetryPolicy
+from backend.ai.router import ModelRouter
+from backend.humanizer.batching import RespondBatcher
+
+
+class FakeClient:
+    def __init__(self, content):
+        self.router = ModelRouter()
+        self.cache = ResponseCache()
+        self.retry_policy = RetryPolicy()
+        self.content = content
+        self.calls = 0
+
+    async def chat(self, model, messages, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return {"content": self.content, "finish_reason": "stop"}
+
+
+CONTEXT = [
+    {"username": "vasya", "message": "кто идёт вечером"},
+    {"username": "petya", "message": "я может"},
+    {"username": "vasya", "message": "ну решай уже"},
+]
+
+
+def test_concurrent_decisions_share_one_call():
+    async def run():
+        client = FakeClient('{"1": "да", "2": "нет"}')
+        batcher = RespondBatcher(window=0.4)
+        results = await asyncio.gather(
+            batcher.decide(client, ["m"], "а вы что думаете", CONTEXT, "hono", "vasya", 1),
+            batcher.decide(client, ["m"], "петя ты где", CONTEXT, "hono", "vasya", 1),
+        )
+        return client, batcher, results
+
+    client, batcher, results = asyncio.run(run())
+    assert client.calls == 1
+    assert results == [(True, "batch_decision"), (False, "batch_skip")]
+    assert batcher.stats["batches"] == 1
+
+
+def test_lone_decision_skips_the_window():
+    async def run():
+        client = FakeClient("да")
+        batcher = RespondBatcher(window=5)
+        started = asyncio.get_running_loop().time()
+        result = await batcher.decide(client, ["m"], "а вы что думаете", CONTEXT, "hono", "vasya", 2)
+        return result, asyncio.get_running_loop().time() - started
+
+    result, elapsed = asyncio.run(run())
+    assert result[0] is True
+    assert elapsed < 1
+
+
+def test_same_chat_burst_is_not_dropped_by_cooldown():
+    # С конфигом по умолчанию батчер — запасной путь триажа: сообщения одного чата приходят по очереди под локом
+    with open(os.path.join(os.path.dirname(__file__), "..", "config.json"), encoding="utf-8") as f:
+        config = json.load(f)
+    assert config["triage"] is True
+
+    async def run():
+        client = FakeClient("да")
+        batcher = RespondBatcher(**config["respond_batch"])
+        first = await batcher.decide(client, ["m"], "а вы что думаете", CONTEXT, "hono", "vasya", 3)
+        second = await batcher.decide(client, ["m"], "петя ты где вообще", CONTEXT, "hono", "petya", 3)
+        return client, first, second
+
+    client, first, second = asyncio.run(run())
+    assert client.calls == 2
+    assert first == second == (True, "ai_decision")
@@ -0,0 +1,46 @@
+import asyncio
+from backend.database.buffer import WriteBuffer
+
+
+def test_rows_survive_a_failing_flush():
+    async def run():
+        written = []
+        failures = 1
+
+        async def flush(ops):
+            nonlocal failures
+            if failures:
+                failures -= 1
+                raise RuntimeError("database is locked")
+            written.extend(sorted(ops.items()))
+
+        buffer = WriteBuffer(flush, interval=0.01)
+        await buffer.put(("ctx", 1), "первое")
+        await buffer.put(("count", 7), 1, lambda a, b: a + b)
+        await buffer.flush()
+        assert buffer.pending("ctx") == [(("ctx", 1), "первое")]
+
+        # Пока пачка ждёт повтора, приходят новые операции — счётчики складываются
+        await buffer.put(("count", 7), 2, lambda a, b: a + b)
+        await asyncio.sleep(0.05)
+        await buffer.close()
+        return written, buffer.stats
+
+    written, stats = asyncio.run(run())
+    assert written == [(("count", 7), 3), (("ctx", 1), "первое")]
+    assert stats["errors"] == 1 and stats["dropped"] == 0
+
+
+def test_batch_is_dropped_after_max_retries():
+    async def run():
+        async def flush(ops):
+            raise RuntimeError("database is locked")
+
+        buffer = WriteBuffer(flush, interval=0.01, max_retries=2)
+        await buffer.put(("ctx", 1), "первое")
+        await buffer.close()
+        return buffer
+
+    buffer = asyncio.run(run())
+    assert buffer.stats["dropped"] == 1
+    assert not buffer.ops
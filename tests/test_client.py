@@ -0,0 +1,85 @@
+import asyncio
+import json
+from backend.ai.client import OpenRouterClient
+from backend.ai.hedge import HedgePolicy
+from backend.ai.router import ModelRouter
+
+
+class FakeContent:
+    def __init__(self, chunks, delay):
+        self.chunks = chunks
+        self.delay = delay
+
+    async def __aiter__(self):
+        for text in self.chunks:
+            await asyncio.sleep(self.delay)
+            data = {"choices": [{"delta": {"content": text}, "finish_reason": None}]}
+            yield f"data: {json.dumps(data)}\n".encode()
+        yield b"data: [DONE]\n"
+
+
+class FakeResponse:
+    status = 200
+    headers = {}
+
+    def __init__(self, chunks, delay):
+        self.content = FakeContent(chunks, delay)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    def __init__(self, delays):
+        self.delays = delays
+
+    def post(self, url, json):
+        return FakeResponse(["при", "вет"], self.delays[json["model"]])
+
+
+def make_client(delays, hedge=None):
+    client = OpenRouterClient("key", hedge=hedge)
+    client._get_session = lambda: FakeSession(delays)
+    return client
+
+
+def test_stream_latency_excludes_consumer_time():
+    async def run():
+        client = make_client({"m": 0.01})
+        async for chunk in client.chat_stream("m", [{"role": "user", "content": "hi"}]):
+            # Потребитель медленный, как редактирование сообщения в Telegram
+            await asyncio.sleep(0.2)
+        return client.router.models["m"]
+
+    health = asyncio.run(run())
+    assert health.latencies[0] < 0.1
+    assert health.first_tokens[0] < 0.1
+
+
+def test_stream_hedge_delay_uses_first_token():
+    router = ModelRouter()
+    for _ in range(5):
+        router.record("m", True, 8.0, first_token=0.5)
+    hedge = HedgePolicy(min_delay=0.1)
+    assert hedge.delay(router, "m") == 8.0
+    assert hedge.delay(router, "m", stream=True) == 0.5
+
+
+def test_cancelled_hedge_loser_is_recorded():
+    async def run():
+        client = make_client({"slow": 1.0, "fast": 0.01}, HedgePolicy(max_ratio=1, default_delay=0.1, min_delay=0))
+        text = ""
+        async for chunk in client.chat_stream("slow", [{"role": "user", "content": "hi"}], hedge_model="fast"):
+            if chunk["type"] == "content":
+                text += chunk["text"]
+        return client, text
+
+    client, text = asyncio.run(run())
+    slow = client.router.models["slow"]
+    assert text == "привет"
+    assert client.hedge.backup_wins == 1
+    assert slow.cancelled == 1
+    assert slow.first_tokens[0] >= 0.1
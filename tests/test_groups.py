@@ -0,0 +1,41 @@
+import asyncio
+from backend.ai.cache import ResponseCache
+from backend.ai.retry import RetryPolicy
+from backend.ai.router import ModelRouter
+from backend.humanizer.groups import should_respond_ai
+
+
+class FakeClient:
+    def __init__(self, replies):
+        self.router = ModelRouter()
+        self.cache = ResponseCache()
+        self.retry_policy = RetryPolicy()
+        self.replies = replies
+        self.calls = []
+
+    async def chat(self, model, messages, **kwargs):
+        self.calls.append(model)
+        code = self.replies[model]
+        if isinstance(code, int):
+            return {"content": "Ошибка", "finish_reason": "error", "error_code": code, "retry_after": None}
+        return {"content": code, "finish_reason": "stop"}
+
+
+CONTEXT = [
+    {"username": "vasya", "message": "кто идёт вечером"},
+    {"username": "petya", "message": "я может"},
+]
+
+
+def test_non_retryable_error_moves_to_next_model():
+    client = FakeClient({"a": 404, "b": "да"})
+    result = asyncio.run(should_respond_ai(client, ["a", "b"], "а вы что думаете", CONTEXT, "hono", "vasya"))
+    assert result == (True, "ai_decision")
+    assert client.calls == ["a", "b"]
+
+
+def test_stops_when_every_model_rejects():
+    client = FakeClient({"a": 400, "b": 403})
+    result = asyncio.run(should_respond_ai(client, ["a", "b"], "а вы что думаете ещё", CONTEXT, "hono", "vasya"))
+    assert result == (False, "ai_skip")
+    assert client.calls == ["a", "b"]
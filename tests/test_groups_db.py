@@ -0,0 +1,33 @@
+import asyncio
+from backend.database.sqlite import SQLite
+from backend.database.groups import GroupDB
+
+
+def test_archive_fts_is_rebuilt_on_startup(tmp_path):
+    path = str(tmp_path / "groups.db")
+
+    async def run():
+        db = GroupDB(SQLite(path))
+        try:
+            await db.init()
+            await db.add_context(1, 2, "vasya", "скупаю аккаунты недорого", 10)
+            await db.writes.flush()
+            # Как база, мигрированная на SQLite без FTS5: версия записана, индекса нет
+            await db.store.execute_batch([
+                ("DROP TRIGGER group_archive_ai", None),
+                ("DROP TRIGGER group_archive_ad", None),
+                ("DROP TABLE group_archive_fts", None),
+            ])
+        finally:
+            await db.close()
+
+        db = GroupDB(SQLite(path))
+        try:
+            await db.init()
+            return db.fts, await db.search_messages(1, "скупаю")
+        finally:
+            await db.close()
+
+    fts, found = asyncio.run(run())
+    assert fts
+    assert [m["msg_id"] for m in found] == [10]
@@ -0,0 +1,65 @@
+import asyncio
+import time
+from backend.ai.limiter import AdmissionController, estimate_tokens, IMAGE_TOKENS, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+
+
+def test_image_payload_is_a_fixed_cost():
+    photo = "data:image/jpeg;base64," + "A" * 340_000
+    messages = [
+        {"role": "system", "content": "persona"},
+        {"role": "user", "content": [
+            {"type": "text", "text": "что на картинке?"},
+            {"type": "image_url", "image_url": {"url": photo}},
+        ]},
+    ]
+    tokens = estimate_tokens(messages, 500)
+    assert IMAGE_TOKENS + 500 <= tokens < IMAGE_TOKENS + 600
+
+
+def test_background_leaves_headroom_for_interactive():
+    async def run():
+        limiter = AdmissionController(tpm=6000, interactive_share=0.2)
+        async with limiter.slot("m", PRIORITY_BACKGROUND, 4000):
+            pass
+        # Второй фоновый не влезает выше запаса и ждёт, ничего не списав
+        waiting = asyncio.create_task(limiter.slot("m", PRIORITY_BACKGROUND, 1500).__aenter__())
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+
+        started = time.monotonic()
+        async with limiter.slot("m", PRIORITY_INTERACTIVE, 1000):
+            pass
+        interactive_wait = time.monotonic() - started
+        waiting.cancel()
+        return interactive_wait
+
+    assert asyncio.run(run()) < 0.1
+
+
+def test_large_background_request_is_not_starved():
+    async def run():
+        for share in (0.2, 1.0):
+            limiter = AdmissionController(tpm=6000, interactive_share=share)
+            # Оценка выше capacity * (1 - share): раньше такой запрос ждал запас, который никогда не наберётся
+            async with limiter.slot("m", PRIORITY_BACKGROUND, 5500):
+                pass
+
+    asyncio.run(asyncio.wait_for(run(), 1))
+
+
+def test_cancelled_reservation_is_refunded():
+    async def run():
+        limiter = AdmissionController(tpm=600)
+        _, bucket = limiter._get_buckets("m")
+        async with limiter.slot("m", PRIORITY_INTERACTIVE, 600):
+            pass
+        before = bucket.tokens
+        task = asyncio.create_task(limiter.slot("m", PRIORITY_INTERACTIVE, 300).__aenter__())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        bucket._refill()
+        return before, bucket.tokens
+
+    before, after = asyncio.run(run())
+    assert after >= before
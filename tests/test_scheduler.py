@@ -0,0 +1,156 @@
+import asyncio
+import time
+from backend.database import StorageEngine, ReminderDB
+from backend.humanizer import ReminderScheduler
+
+
+def test_slow_dispatch_does_not_reload_in_a_loop(tmp_path):
+    async def run():
+        storage = StorageEngine(str(tmp_path))
+        try:
+            reminder_db = ReminderDB(storage.open("database"))
+            await reminder_db.init_table()
+            now = int(time.time())
+            for i in range(8):
+                await reminder_db.add(1, 1, f"r{i}", now - 10)
+
+            sent = []
+            active = 0
+            peak = 0
+
+            async def dispatch(reminder):
+                nonlocal active, peak
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.1)
+                active -= 1
+                sent.append(reminder["id"])
+
+            scheduler = ReminderScheduler(reminder_db, dispatch, concurrency=1, preload=3)
+            loads = 0
+            load = scheduler._load
+
+            async def counting_load():
+                nonlocal loads
+                loads += 1
+                await load()
+
+            scheduler._load = counting_load
+            scheduler.start()
+            for _ in range(40):
+                await asyncio.sleep(0.05)
+                assert len(scheduler._running) <= 1
+                if len(sent) == 8:
+                    break
+            await scheduler.close()
+            return sent, loads, peak
+        finally:
+            await storage.close()
+
+    sent, loads, peak = asyncio.run(run())
+    assert sorted(sent) == list(range(1, 9))
+    assert peak == 1
+    # 8 строк пачками по 3: три загрузки плюс последняя пустая
+    assert loads <= 4
+
+
+def test_overdue_reminder_is_not_prepared_separately(tmp_path):
+    async def run():
+        storage = StorageEngine(str(tmp_path))
+        try:
+            reminder_db = ReminderDB(storage.open("database"))
+            await reminder_db.init_table()
+            now = int(time.time())
+            await reminder_db.add(1, 1, "просрочено", now - 10)
+            await reminder_db.add(1, 1, "через минуту", now + 60)
+
+            prepared = []
+            sent = []
+
+            async def prepare(reminder):
+                prepared.append(reminder["id"])
+                return "текст"
+
+            async def dispatch(reminder):
+                sent.append(reminder["id"])
+
+            scheduler = ReminderScheduler(reminder_db, dispatch, prepare, lead_time=120)
+            scheduler.start()
+            for _ in range(20):
+                await asyncio.sleep(0.05)
+                if sent:
+                    break
+            await scheduler.close()
+            return prepared, sent
+        finally:
+            await storage.close()
+
+    prepared, sent = asyncio.run(run())
+    assert sent == [1]
+    # Просроченное не готовим заранее; у второго срок подготовки (send_at - lead_time) тоже уже прошёл
+    assert prepared == []
+
+
+class MemoryReminders:
+    def __init__(self):
+        self.listeners = []
+
+    async def get_upcoming(self, limit):
+        return []
+
+    async def claim(self, reminder_id):
+        return True
+
+    async def set_text(self, reminder_id, text):
+        pass
+
+
+def test_slow_prepares_do_not_delay_due_sends():
+    async def run():
+        sent_at = {}
+
+        async def prepare(reminder):
+            await asyncio.sleep(2)
+            return "текст"
+
+        async def dispatch(reminder):
+            sent_at[reminder["id"]] = time.time()
+
+        scheduler = ReminderScheduler(MemoryReminders(), dispatch, prepare, lead_time=9.9, concurrency=2)
+        scheduler.start()
+        await asyncio.sleep(0.05)
+        now = time.time()
+        scheduler.push({"id": 1, "send_at": now + 10})
+        scheduler.push({"id": 2, "send_at": now + 10})
+        scheduler.push({"id": 3, "send_at": now + 0.2, "text": "готово"})
+        for _ in range(20):
+            await asyncio.sleep(0.05)
+            if 3 in sent_at:
+                break
+        await scheduler.close()
+        return sent_at.get(3, float("inf")) - now
+
+    assert asyncio.run(run()) < 0.6
+
+
+def test_close_stops_running_tasks_and_listener():
+    async def run():
+        reminders = MemoryReminders()
+        started = asyncio.Event()
+
+        async def dispatch(reminder):
+            started.set()
+            await asyncio.sleep(10)
+
+        scheduler = ReminderScheduler(reminders, dispatch)
+        scheduler.start()
+        await asyncio.sleep(0.05)
+        scheduler.push({"id": 1, "send_at": time.time()})
+        await asyncio.wait_for(started.wait(), 1)
+        running = list(scheduler._running)
+        await scheduler.close()
+        return reminders.listeners, running
+
+    listeners, running = asyncio.run(run())
+    assert listeners == []
+    assert running and all(task.done() for task in running)
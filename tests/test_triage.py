@@ -0,0 +1,49 @@
+import asyncio
+from backend.ai.router import ModelRouter
+from backend.humanizer import triage
+from backend.humanizer.triage import triage_message
+
+
+class FakeClient:
+    def __init__(self, content="{}", error_code=None):
+        self.router = ModelRouter()
+        self.calls = 0
+        self.content = content
+        self.error_code = error_code
+
+    async def chat(self, model, messages, **kwargs):
+        self.calls += 1
+        if self.error_code:
+            return {"content": f"Ошибка: {self.content}", "finish_reason": "error", "error_code": self.error_code}
+        return {"content": self.content, "finish_reason": "stop"}
+
+
+SPAM_CONTEXT = [
+    {"username": "hono", "message": "первый"},
+    {"username": "hono", "message": "второй"},
+]
+
+
+def test_skipped_message_without_moderation_makes_no_call():
+    client = FakeClient()
+    result = asyncio.run(triage_message(client, ["m"], "ну и что дальше будет", SPAM_CONTEXT, "hono", "vasya"))
+    assert client.calls == 0
+    assert result["respond"] == (False, "spam_prevention")
+
+
+def test_one_bad_reply_does_not_disable_json_mode():
+    triage._unstructured_models.clear()
+    triage._json_failures.clear()
+    client = FakeClient(content="не json")
+    for _ in range(triage.UNSTRUCTURED_AFTER - 1):
+        asyncio.run(triage_message(client, ["m"], "хоно, как дела?", [], "hono", "vasya"))
+    assert not triage._is_unstructured("m")
+    asyncio.run(triage_message(client, ["m"], "хоно, как дела?", [], "hono", "vasya"))
+    assert triage._is_unstructured("m")
+
+
+def test_unrelated_400_does_not_disable_json_mode():
+    triage._unstructured_models.clear()
+    client = FakeClient(content="context length exceeded", error_code=400)
+    asyncio.run(triage_message(client, ["m"], "хоно, как дела?", [], "hono", "vasya"))
+    assert not triage._is_unstructured("m")
@@ -0,0 +1,24 @@
+import asyncio
+from backend.database import StorageEngine
+from backend.database.users import UserDB
+
+
+def test_message_count_does_not_create_profiles(tmp_path):
+    async def run():
+        storage = StorageEngine(str(tmp_path))
+        try:
+            users = UserDB(storage.open("database"))
+            await users.init_table()
+            await users.update_last_seen(1, "vasya", "Вася")
+            await users.writes.flush()
+            await users.increment_message_count(1)
+            await users.increment_message_count(1)
+            await users.increment_message_count(2)
+            await users.writes.flush()
+            return await users.get_profile(1), await users.get_profile(2)
+        finally:
+            await storage.close()
+
+    known, unknown = asyncio.run(run())
+    assert known["message_count"] == 2
+    assert unknown is None